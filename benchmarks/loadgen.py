@@ -0,0 +1,110 @@
+import asyncio
+import itertools
+import math
+import time
+from typing import Callable, Dict, List, Optional, Sequence
+
+import httpx
+
+# Statuses that count as a successful answer
+OK_STATUSES = frozenset({200, 201, 204, 304})
+
+
+class Scenario:
+    """One request shape to drive: a method and URL, plus per-request headers and JSON body."""
+
+    def __init__(
+        self,
+        name: str,
+        method: str,
+        url: str,
+        headers: Optional[Callable[[], Dict[str, str]]] = None,
+        json: Optional[Callable[[], dict]] = None,
+    ):
+        self.name = name
+        self.method = method
+        self.url = url
+        self.headers = headers
+        self.json = json
+
+    def request(self, client: httpx.AsyncClient):
+        return client.request(
+            self.method,
+            self.url,
+            headers=self.headers() if self.headers else None,
+            json=self.json() if self.json else None,
+        )
+
+
+def rotating(values: Sequence) -> Callable[[], object]:
+    """A factory returning the given values round-robin."""
+    cycle = itertools.cycle(values)
+    return lambda: next(cycle)
+
+
+def percentile(sorted_values: List[float], fraction: float) -> float:
+    """Nearest-rank percentile of already sorted values."""
+    if not sorted_values:
+        return 0.0
+    rank = max(1, math.ceil(fraction * len(sorted_values)))
+    return sorted_values[rank - 1]
+
+
+def summarize(latencies: List[float], errors: int, elapsed: float) -> dict:
+    latencies.sort()
+    to_ms = 1000
+    return {
+        "requests": len(latencies),
+        "errors": errors,
+        "duration_s": round(elapsed, 3),
+        "throughput_rps": round(len(latencies) / elapsed, 1) if elapsed else 0.0,
+        "latency_ms": {
+            "mean": round(sum(latencies) / len(latencies) * to_ms, 3) if latencies else 0.0,
+            "p50": round(percentile(latencies, 0.50) * to_ms, 3),
+            "p95": round(percentile(latencies, 0.95) * to_ms, 3),
+            "p99": round(percentile(latencies, 0.99) * to_ms, 3),
+            "max": round(latencies[-1] * to_ms, 3) if latencies else 0.0,
+        },
+    }
+
+
+async def drive(scenario: Scenario, concurrency: int, duration: float, warmup: float) -> dict:
+    """
+    Run a closed-loop load against one scenario.
+
+    Each of `concurrency` workers sends its next request as soon as the
+    previous one has been read in full. Requests finishing during the warmup
+    are discarded; the rest are timed until `duration` runs out.
+    """
+    limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+    latencies: List[float] = []
+    errors = 0
+
+    async with httpx.AsyncClient(limits=limits, timeout=30.0) as client:
+        started = time.perf_counter()
+        measure_from = started + warmup
+        stop_at = measure_from + duration
+
+        async def worker():
+            nonlocal errors
+            while True:
+                sent = time.perf_counter()
+                if sent >= stop_at:
+                    return
+                try:
+                    response = await scenario.request(client)
+                    ok = response.status_code in OK_STATUSES
+                except httpx.HTTPError:
+                    ok = False
+                finished = time.perf_counter()
+                if sent < measure_from:
+                    continue
+                if ok:
+                    latencies.append(finished - sent)
+                else:
+                    errors += 1
+
+        await asyncio.gather(*(worker() for _ in range(concurrency)))
+        elapsed = time.perf_counter() - measure_from
+
+    return summarize(latencies, errors, elapsed)
@@ -0,0 +1,19 @@
+"""In-memory Redis stand-in speaking RESP over TCP, so services connect to it with a normal REDIS_URL."""
+import argparse
+
+from fakeredis import TcpFakeServer
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=6390)
+    args = parser.parse_args()
+
+    server = TcpFakeServer((args.host, args.port), server_type="redis")
+    server.daemon_threads = True
+    server.serve_forever()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,50 @@
+"""
+Auth service stand-in for benchmarks.
+
+Issues real HS256 tokens signed with JWT_SECRET, so the gateway verifies
+them exactly as it would in production, but skips the database and bcrypt
+to keep the measurement on the gateway path.
+"""
+import os
+import time
+
+from fastapi import FastAPI, HTTPException
+from fastapi.responses import ORJSONResponse
+from jose import JWTError, jwt
+from pydantic import BaseModel
+
+JWT_SECRET = os.environ["JWT_SECRET"]
+JWT_ALGORITHM = os.environ.get("JWT_ALGORITHM", "HS256")
+TOKEN_TTL = 1800
+
+app = FastAPI(title="HarborX Auth (benchmark stub)", default_response_class=ORJSONResponse)
+
+
+class LoginRequest(BaseModel):
+    email: str
+    password: str
+
+
+def issue_token(email: str) -> str:
+    """A token with the same claims the real login endpoint issues."""
+    now = int(time.time())
+    return jwt.encode({"sub": email, "role": "USER", "exp": now + TOKEN_TTL}, JWT_SECRET, algorithm=JWT_ALGORITHM)
+
+
+@app.get("/health")
+async def health_check():
+    return {"status": "healthy", "service": "harborx-auth-stub"}
+
+
+@app.post("/api/v1/auth/login")
+async def login(request: LoginRequest):
+    return {"access_token": issue_token(request.email), "token_type": "bearer"}
+
+
+@app.post("/api/v1/auth/verify")
+async def verify(token: str):
+    try:
+        claims = jwt.decode(token, JWT_SECRET, algorithms=[JWT_ALGORITHM])
+    except JWTError as exc:
+        raise HTTPException(status_code=401, detail="Invalid token") from exc
+    return {"valid": True, "user_id": claims["sub"]}
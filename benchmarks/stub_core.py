@@ -0,0 +1,83 @@
+"""
+Core service stand-in for benchmarks.
+
+Serves /api/v1/shipments through core's real RedisCache.get_or_compute and
+encode_page, with a canned page in place of the database query, so changes
+to the cache or page encoding show up in the numbers. /api/v1/shipments/ping
+answers a small fixed body for measuring pure proxy overhead.
+"""
+import hashlib
+import os
+import sys
+from contextlib import asynccontextmanager
+from datetime import datetime, timedelta, timezone
+from types import SimpleNamespace
+from typing import Optional
+
+from fastapi import FastAPI, Query, Response
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "services", "core"))
+
+from cache import cache  # noqa: E402
+from shipments import encode_cursor, encode_page  # noqa: E402
+
+PING_BODY = b'{"status":"ok"}'
+STATUSES = ("PENDING", "IN_TRANSIT", "DELIVERED")
+
+
+def _canned_rows(count: int) -> list:
+    newest = datetime(2026, 1, 1, tzinfo=timezone.utc)
+    return [
+        SimpleNamespace(
+            id=f"shp_{index:08d}",
+            tracking_number=f"HX{index:010d}",
+            origin="Jeddah",
+            destination="Rotterdam",
+            status=STATUSES[index % len(STATUSES)],
+            created_at=newest - timedelta(minutes=index),
+        )
+        for index in range(count)
+    ]
+
+
+ROWS = _canned_rows(200)
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    await cache.connect()
+    yield
+    await cache.disconnect()
+
+
+app = FastAPI(title="HarborX Core (benchmark stub)", lifespan=lifespan)
+
+
+@app.get("/health")
+async def health_check():
+    return {"status": "healthy", "service": "harborx-core-stub"}
+
+
+@app.get("/api/v1/shipments/ping")
+async def ping():
+    return Response(content=PING_BODY, media_type="application/json")
+
+
+@app.get("/api/v1/shipments")
+async def get_shipments(
+    limit: int = Query(50, ge=1, le=200),
+    cursor: Optional[str] = None,
+    status: Optional[str] = None,
+    origin: Optional[str] = None,
+    destination: Optional[str] = None,
+):
+    """Same cache key and cache path as core's list endpoint, minus the database."""
+    params = f"{limit}|{cursor}|{status}|{origin}|{destination}"
+    cache_key = await cache.versioned_key("shipments", "list:" + hashlib.sha1(params.encode()).hexdigest())
+
+    async def build_page() -> bytes:
+        rows = ROWS[:limit]
+        last = rows[-1]
+        return encode_page(rows, len(ROWS), False, encode_cursor(last.created_at, last.id))
+
+    return Response(content=await cache.get_or_compute(cache_key, build_page, ttl=30), media_type="application/json")
@@ -1,3 +1,5 @@
+from typing import Optional
+
 from pydantic_settings import BaseSettings
 
 
@@ -9,6 +11,44 @@ class Settings(BaseSettings):
     jwt_access_token_expire_minutes: int = 30
     environment: str = "development"
 
+    # Password hashing (bcrypt runs on a dedicated thread pool)
+    bcrypt_rounds: int = 12
+    password_hash_workers: int = 4
+    password_hash_max_queue: int = 64
+
+    # Database engine profile (per process)
+    database_replica_url: Optional[str] = None
+    db_echo: bool = False
+    db_pool_size: int = 10
+    db_max_overflow: int = 10
+    db_pool_timeout: float = 30.0
+    db_pool_recycle: int = 1800
+    db_pool_pre_ping: bool = True
+    db_statement_cache_size: int = 100
+    db_statement_timeout_ms: int = 15000
+
+    # Event-loop lag monitor (seconds); stalls keep the stack of the blocking call
+    loop_lag_interval: float = 0.1
+    loop_lag_stall_threshold: float = 0.1
+    loop_lag_max_stalls: int = 20
+
+    # Production launcher (python main.py); 0 workers means one per available CPU.
+    # Keep-alive outlasts typical load balancer idle timeouts (60s) so they close first;
+    # the graceful timeout fits inside Kubernetes' default 30s termination grace period.
+    server_host: str = "0.0.0.0"
+    server_port: int = 8001
+    server_workers: int = 0
+    server_reuse_port: bool = True
+    server_backlog: int = 2048
+    server_keepalive_timeout: int = 75
+    server_graceful_timeout: float = 20.0
+    server_access_log: bool = False
+
+    # Admin endpoints (/debug/*) are disabled unless a token is set
+    admin_token: Optional[str] = None
+    profile_max_seconds: float = 60.0
+    profile_sample_interval: float = 0.005
+
     class Config:
         env_file = ".env"
         case_sensitive = False
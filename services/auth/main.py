@@ -1,7 +1,14 @@
-from fastapi import FastAPI, HTTPException, Depends
+from fastapi import FastAPI, HTTPException, Depends, Query, Request, status
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import JSONResponse, ORJSONResponse, Response
+from contextlib import asynccontextmanager
 from schemas import LoginRequest, TokenResponse, UserMeResponse
 from config import settings
+from metrics import CONTENT_TYPE, MetricsMiddleware, generate_latest
+from diagnostics import ProfileBusyError, loop_monitor, profiler, require_admin
+from database import pool_stats, dispose_engines
+from deadline import DeadlineMiddleware
+from security import password_hasher, PasswordHashingBusyError
 from datetime import datetime, timezone
 import logging
 
@@ -9,12 +16,32 @@ import logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """Lifespan context manager for startup and shutdown events."""
+    # Startup
+    await loop_monitor.start()
+    logger.info("Auth service started")
+    yield
+    # Shutdown
+    password_hasher.shutdown()
+    await dispose_engines()
+    await loop_monitor.stop()
+    logger.info("Auth service stopped")
+
+
 app = FastAPI(
     title="HarborX Auth Service",
     description="Authentication and Authorization Service for HarborX platform",
     version="1.0.0",
+    lifespan=lifespan,
+    default_response_class=ORJSONResponse,
 )
 
+# Cancel handlers once the caller's deadline (from the gateway) has passed
+app.add_middleware(DeadlineMiddleware)
+
 # CORS Configuration
 # SECURITY: Default to localhost only for development
 # Production MUST configure specific allowed origins via CORS_ORIGINS env var
@@ -33,6 +60,22 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# Outermost, so rejections by the other middleware are measured too
+app.add_middleware(MetricsMiddleware)
+
+
+@app.exception_handler(PasswordHashingBusyError)
+async def password_hashing_busy_handler(request: Request, exc: PasswordHashingBusyError):
+    """Shed login load quickly when password hashing is saturated."""
+    return JSONResponse(
+        status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+        content={
+            "error": "Service Busy",
+            "message": "Too many authentication requests in progress. Please try again shortly.",
+        },
+        headers={"Retry-After": "1"},
+    )
+
 
 @app.get("/health")
 @app.get("/healthz")
@@ -46,6 +89,44 @@ async def health_check():
     }
 
 
+@app.get("/health/db")
+async def db_pool_stats():
+    """Database connection pool usage and checkout wait times."""
+    return {"pools": pool_stats()}
+
+
+@app.get("/health/hashing")
+async def password_hashing_stats():
+    """Password hashing pool usage, latency and queue wait."""
+    return {"password_hashing": password_hasher.stats()}
+
+
+@app.get("/metrics", include_in_schema=False)
+async def metrics():
+    """Prometheus metrics for this process."""
+    return Response(content=generate_latest(), media_type=CONTENT_TYPE)
+
+
+@app.get("/debug/loop-lag", dependencies=[Depends(require_admin)], include_in_schema=False)
+async def loop_lag_stats():
+    """Event-loop lag and the stacks captured for recent stalls (admin only)."""
+    return {"loop_lag": loop_monitor.stats()}
+
+
+@app.get("/debug/profile", dependencies=[Depends(require_admin)], include_in_schema=False)
+async def cpu_profile(seconds: float = Query(10.0, gt=0, le=settings.profile_max_seconds)):
+    """
+    Sample the event loop for N seconds and return collapsed stacks (admin only).
+
+    The output feeds flamegraph.pl or speedscope directly.
+    """
+    try:
+        stacks = await profiler.profile(seconds)
+    except ProfileBusyError as exc:
+        raise HTTPException(status_code=409, detail=str(exc)) from exc
+    return Response(content=stacks, media_type="text/plain; charset=utf-8")
+
+
 @app.post("/api/v1/auth/login", response_model=TokenResponse)
 async def login(request: LoginRequest):
     """
@@ -137,5 +218,5 @@ async def verify_token_endpoint(token: str):
 
 
 if __name__ == "__main__":
-    import uvicorn
-    uvicorn.run(app, host="0.0.0.0", port=8001)
+    from serve import serve
+    serve("main:app")
@@ -1,22 +1,142 @@
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timedelta, timezone
-from typing import Optional
+from typing import Optional, Tuple
 from jose import JWTError, jwt
 from passlib.context import CryptContext
 from config import settings
+from metrics import CallbackGauge, Counter, Histogram
+import asyncio
+import time
 
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+# Pinning min and max rounds to the configured cost makes needs_update()
+# flag any hash made with a different cost, so it gets rehashed on login.
+pwd_context = CryptContext(
+    schemes=["bcrypt"],
+    deprecated="auto",
+    bcrypt__default_rounds=settings.bcrypt_rounds,
+    bcrypt__min_rounds=settings.bcrypt_rounds,
+    bcrypt__max_rounds=settings.bcrypt_rounds,
+)
+
+
+class PasswordHashingBusyError(Exception):
+    """Raised when the password hashing queue is full."""
+    pass
+
+
+PASSWORD_HASH_DURATION = Histogram("password_hash_seconds", "Time spent in bcrypt per hash or verify")
+PASSWORD_HASH_QUEUE_WAIT = Histogram("password_hash_queue_wait_seconds", "Time bcrypt jobs waited for a worker")
+PASSWORD_HASH_REJECTED = Counter("password_hash_rejected_total", "bcrypt jobs rejected because the queue was full")
+
+
+class PasswordHasher:
+    """
+    Runs bcrypt on a dedicated thread pool so it never blocks the event loop.
+
+    bcrypt releases the GIL while hashing, so threads give real parallelism.
+    At most `workers` hashes run at once and at most `max_queue` more may
+    wait; beyond that callers are rejected immediately instead of queueing.
+    """
+
+    def __init__(self, workers: int, max_queue: int):
+        self.workers = workers
+        self.max_queue = max_queue
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="password-hash")
+        self.pending = 0
+        self.completed = 0
+        self.rejected = 0
+        self.hash_seconds_total = 0.0
+        self.hash_seconds_max = 0.0
+        self.queue_wait_seconds_total = 0.0
+        self.queue_wait_seconds_max = 0.0
+
+    async def _run(self, fn, *args):
+        if self.pending >= self.workers + self.max_queue:
+            self.rejected += 1
+            PASSWORD_HASH_REJECTED.inc()
+            raise PasswordHashingBusyError("Password hashing capacity exhausted")
+
+        submitted = time.perf_counter()
+
+        def timed():
+            started = time.perf_counter()
+            result = fn(*args)
+            return result, started - submitted, time.perf_counter() - started
+
+        self.pending += 1
+        try:
+            # If the request is cancelled (e.g. its deadline passed) while the job
+            # is still queued, the executor drops it without hashing
+            result, waited, took = await asyncio.get_running_loop().run_in_executor(self._executor, timed)
+        finally:
+            self.pending -= 1
+
+        self.completed += 1
+        PASSWORD_HASH_DURATION.observe(took)
+        PASSWORD_HASH_QUEUE_WAIT.observe(waited)
+        self.hash_seconds_total += took
+        self.hash_seconds_max = max(self.hash_seconds_max, took)
+        self.queue_wait_seconds_total += waited
+        self.queue_wait_seconds_max = max(self.queue_wait_seconds_max, waited)
+        return result
+
+    async def verify(self, plain_password: str, hashed_password: str) -> Tuple[bool, Optional[str]]:
+        """
+        Verify a password, rehashing it if the stored hash uses outdated parameters.
+
+        Returns:
+            Whether the password matches, and a replacement hash to persist (or None)
+        """
+        return await self._run(pwd_context.verify_and_update, plain_password, hashed_password)
+
+    async def hash(self, password: str) -> str:
+        return await self._run(pwd_context.hash, password)
+
+    def stats(self) -> dict:
+        return {
+            "workers": self.workers,
+            "max_queue": self.max_queue,
+            "pending": self.pending,
+            "completed": self.completed,
+            "rejected": self.rejected,
+            "hash_ms_avg": round(self.hash_seconds_total / self.completed * 1000, 3) if self.completed else 0.0,
+            "hash_ms_max": round(self.hash_seconds_max * 1000, 3),
+            "queue_wait_ms_avg": round(self.queue_wait_seconds_total / self.completed * 1000, 3) if self.completed else 0.0,
+            "queue_wait_ms_max": round(self.queue_wait_seconds_max * 1000, 3),
+        }
+
+    def shutdown(self):
+        self._executor.shutdown(wait=True, cancel_futures=True)
+
+
+# Global password hasher instance
+password_hasher = PasswordHasher(settings.password_hash_workers, settings.password_hash_max_queue)
+
+CallbackGauge(
+    "password_hash_pending", "bcrypt jobs running or queued", (), lambda: {(): password_hasher.pending}
+)
 
 
 def verify_password(plain_password: str, hashed_password: str) -> bool:
-    """Verify a password against a hash."""
+    """Verify a password against a hash (blocking; use verify_password_async in request handlers)."""
     return pwd_context.verify(plain_password, hashed_password)
 
 
 def get_password_hash(password: str) -> str:
-    """Hash a password."""
+    """Hash a password (blocking; use get_password_hash_async in request handlers)."""
     return pwd_context.hash(password)
 
 
+async def verify_password_async(plain_password: str, hashed_password: str) -> Tuple[bool, Optional[str]]:
+    """Verify a password off the event loop; also returns a new hash when a rehash is due."""
+    return await password_hasher.verify(plain_password, hashed_password)
+
+
+async def get_password_hash_async(password: str) -> str:
+    """Hash a password off the event loop."""
+    return await password_hasher.hash(password)
+
+
 def create_access_token(data: dict, expires_delta: Optional[timedelta] = None) -> str:
     """Create a JWT access token."""
     to_encode = data.copy()
@@ -0,0 +1,53 @@
+import asyncio
+import threading
+
+import pytest
+from passlib.context import CryptContext
+
+from security import PasswordHasher, PasswordHashingBusyError, create_access_token, pwd_context, verify_token
+
+
+async def test_hash_and_verify_run_on_the_pool():
+    hasher = PasswordHasher(workers=2, max_queue=2)
+    try:
+        hashed = await hasher.hash("correct horse")
+        assert await hasher.verify("correct horse", hashed) == (True, None)
+        assert await hasher.verify("wrong horse", hashed) == (False, None)
+        assert hasher.completed == 3 and hasher.pending == 0
+    finally:
+        hasher.shutdown()
+
+
+async def test_hash_with_another_cost_is_replaced_on_verify():
+    hasher = PasswordHasher(workers=1, max_queue=0)
+    try:
+        old_hash = CryptContext(schemes=["bcrypt"], bcrypt__default_rounds=5).hash("secret")
+        ok, new_hash = await hasher.verify("secret", old_hash)
+        assert ok and new_hash is not None
+        assert not pwd_context.needs_update(new_hash)
+    finally:
+        hasher.shutdown()
+
+
+async def test_full_queue_rejects_instead_of_waiting():
+    hasher = PasswordHasher(workers=1, max_queue=1)
+    release = threading.Event()
+    try:
+        running = [asyncio.ensure_future(hasher._run(release.wait)) for _ in range(2)]
+        await asyncio.sleep(0)
+        with pytest.raises(PasswordHashingBusyError):
+            await hasher.hash("secret")
+        assert hasher.rejected == 1
+        release.set()
+        await asyncio.gather(*running)
+        assert hasher.pending == 0
+    finally:
+        release.set()
+        hasher.shutdown()
+
+
+def test_access_token_round_trip():
+    token = create_access_token({"sub": "user-1", "role": "admin"})
+    claims = verify_token(token)
+    assert claims["sub"] == "user-1" and claims["role"] == "admin"
+    assert verify_token(token + "x") is None
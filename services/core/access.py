@@ -0,0 +1,40 @@
+import hmac
+from typing import Optional
+
+from fastapi import Header, HTTPException, status
+from jose import JWTError, jwt
+
+from config import settings
+
+
+def _bearer_claims(authorization: str) -> dict:
+    scheme, _, token = authorization.partition(" ")
+    if scheme.lower() != "bearer" or not token.strip():
+        raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Authentication required")
+    try:
+        return jwt.decode(token.strip(), settings.jwt_secret, algorithms=[settings.jwt_algorithm])
+    except JWTError as exc:
+        raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Invalid or expired token") from exc
+
+
+def require_write_access(
+    authorization: Optional[str] = Header(None),
+    x_admin_token: Optional[str] = Header(None),
+):
+    """
+    Write endpoints need the admin token or a bearer token whose role is listed in WRITE_ROLES.
+
+    The token is verified here rather than trusting the gateway's
+    X-Auth-Role, which anyone able to reach core directly could send.
+    Operators calling core directly may use X-Admin-Token instead.
+    """
+    if x_admin_token is not None:
+        if settings.admin_token and hmac.compare_digest(x_admin_token.encode(), settings.admin_token.encode()):
+            return
+        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Invalid admin token")
+    if authorization is None:
+        raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Authentication required")
+    role = _bearer_claims(authorization).get("role")
+    write_roles = {name.strip() for name in settings.write_roles.split(",") if name.strip()}
+    if role not in write_roles:
+        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Not allowed to modify shipments")
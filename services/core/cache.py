@@ -1,66 +1,619 @@
 import redis.asyncio as redis
 from config import settings
-from typing import Optional
-import json
+from deadline import cap_timeout
+from metrics import Counter, Histogram
+from collections import OrderedDict
+from fnmatch import fnmatchcase
+from typing import Awaitable, Callable, Dict, Iterable, Optional, Tuple
+import asyncio
 import logging
+import math
+import random
+import re
+import time
+import uuid
+import zstandard
 
 logger = logging.getLogger(__name__)
 
+CACHE_REQUESTS = Counter(
+    "cache_requests_total", "Cache operations by tier, result and key prefix", ("tier", "result", "prefix")
+)
+CACHE_COMPUTE = Histogram("cache_compute_seconds", "Time spent computing values on a cache miss", ("prefix",))
+
+
+# Every zstd frame starts with these bytes; JSON and plain numbers never do
+ZSTD_MAGIC = b"\x28\xb5\x2f\xfd"
+
+# Version segment of a versioned key, as in "shipments:v3:list:..."
+VERSION_SEGMENT = re.compile(r"v\d+")
+
+# Invalidation messages for a whole namespace carry this prefix instead of a key
+NAMESPACE_MESSAGE = "#namespace:"
+
+
+def key_prefix(key: str) -> str:
+    """The first two segments of a key, e.g. "shipments:list", used as a metric label."""
+    segments = key.split(":", 3)
+    if len(segments) > 2 and VERSION_SEGMENT.fullmatch(segments[1]):
+        del segments[1]
+    return ":".join(segments[:2])
+
+
+def namespace_of(key: str) -> str:
+    return key.split(":", 1)[0]
+
+
+def _parse_thresholds(value: str) -> Dict[str, int]:
+    thresholds = {}
+    for item in value.split(","):
+        namespace, _, min_bytes = item.strip().partition("=")
+        if namespace and min_bytes:
+            thresholds[namespace.strip()] = int(min_bytes)
+    return thresholds
+
+
+class LocalCache:
+    """In-process LRU cache of raw bytes with per-entry TTL."""
+
+    def __init__(self, max_entries: int, ttl: float):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._entries: "OrderedDict[str, Tuple[bytes, float]]" = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key: str) -> Optional[bytes]:
+        entry = self._entries.get(key)
+        if entry is None:
+            self.misses += 1
+            CACHE_REQUESTS.labels("l1", "miss", key_prefix(key)).inc()
+            return None
+        value, expires_at = entry
+        if expires_at <= time.monotonic():
+            del self._entries[key]
+            self.misses += 1
+            CACHE_REQUESTS.labels("l1", "miss", key_prefix(key)).inc()
+            return None
+        self._entries.move_to_end(key)
+        self.hits += 1
+        CACHE_REQUESTS.labels("l1", "hit", key_prefix(key)).inc()
+        return value
+
+    def set(self, key: str, value: bytes, expire: Optional[float] = None):
+        ttl = self.ttl if expire is None else min(self.ttl, expire)
+        if ttl <= 0 or self.max_entries <= 0:
+            return
+        self._entries[key] = (value, time.monotonic() + ttl)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+    def delete(self, key: str):
+        self._entries.pop(key, None)
+
+    def delete_matching(self, pattern: str):
+        for key in [key for key in self._entries if fnmatchcase(key, pattern)]:
+            del self._entries[key]
+
+    def clear(self):
+        self._entries.clear()
+
+    def stats(self) -> dict:
+        return {
+            "size": len(self._entries),
+            "max_entries": self.max_entries,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+        }
+
+
+# Release a lock only if we still own it
+RELEASE_LOCK_SCRIPT = """
+if redis.call("get", KEYS[1]) == ARGV[1] then
+    return redis.call("del", KEYS[1])
+end
+return 0
+"""
+
 
 class RedisCache:
+    """
+    Two-tier cache: an in-process L1 in front of Redis (L2).
+
+    Writes and deletes are announced on a Redis pub/sub channel so every
+    replica drops its L1 copy of the key. get_or_compute adds stampede
+    protection on top: per-key single-flight within the process, a short
+    Redis lock across replicas, and probabilistic early refresh (XFetch).
+
+    Keys built with versioned_key carry their namespace's version, so
+    invalidate_namespace drops a whole namespace with a single INCR. Values
+    in namespaces listed in CACHE_COMPRESS_MIN_BYTES are zstd-compressed in
+    Redis above the threshold; L1 always holds them uncompressed.
+    """
+
     def __init__(self):
         self.redis_client: Optional[redis.Redis] = None
+        self.local = LocalCache(settings.cache_l1_max_entries, settings.cache_l1_ttl)
+        self.instance_id = uuid.uuid4().hex
+        self._listener: Optional[asyncio.Task] = None
+        self._inflight: Dict[str, asyncio.Future] = {}
+        self._release_lock = None
+        self._versions: Dict[str, int] = {}
+        self._compress_min_bytes = _parse_thresholds(settings.cache_compress_min_bytes)
+        self._compressor = zstandard.ZstdCompressor(level=settings.cache_compression_level)
+        self._decompressor = zstandard.ZstdDecompressor()
+        self.l2_hits = 0
+        self.l2_misses = 0
+        self.l2_errors = 0
+        self.compressed_values = 0
+        self.compressed_bytes_in = 0
+        self.compressed_bytes_out = 0
+
+    def _count_l2(self, result: str, key: str):
+        if result == "hit":
+            self.l2_hits += 1
+        elif result == "miss":
+            self.l2_misses += 1
+        else:
+            self.l2_errors += 1
+        CACHE_REQUESTS.labels("l2", result, key_prefix(key)).inc()
+
+    def _encode(self, key: str, value: bytes) -> bytes:
+        """The bytes stored in Redis: compressed when the key's namespace asks for it and the value is big enough."""
+        min_bytes = self._compress_min_bytes.get(namespace_of(key))
+        if min_bytes is None or len(value) < min_bytes:
+            return value
+        compressed = self._compressor.compress(value)
+        self.compressed_values += 1
+        self.compressed_bytes_in += len(value)
+        self.compressed_bytes_out += len(compressed)
+        return compressed
+
+    def _decode(self, value: bytes) -> bytes:
+        if value.startswith(ZSTD_MAGIC):
+            return self._decompressor.decompress(value)
+        return value
 
     async def connect(self):
         """Connect to Redis."""
         try:
-            self.redis_client = await redis.from_url(
-                settings.redis_url,
-                encoding="utf-8",
-                decode_responses=True
-            )
+            self.redis_client = await redis.from_url(settings.redis_url)
             logger.info("Connected to Redis")
         except Exception as e:
             logger.error(f"Failed to connect to Redis: {e}")
             self.redis_client = None
+            return
+        self._release_lock = self.redis_client.register_script(RELEASE_LOCK_SCRIPT)
+        self._listener = asyncio.create_task(self._listen_for_invalidations())
 
     async def disconnect(self):
         """Disconnect from Redis."""
+        if self._listener:
+            self._listener.cancel()
+            try:
+                await self._listener
+            except asyncio.CancelledError:
+                pass
+            self._listener = None
         if self.redis_client:
             await self.redis_client.close()
             logger.info("Disconnected from Redis")
 
-    async def get(self, key: str) -> Optional[str]:
+    async def _listen_for_invalidations(self):
+        """Drop L1 entries invalidated by other replicas."""
+        channel = settings.cache_invalidation_channel
+        backoff = 1
+        while True:
+            pubsub = self.redis_client.pubsub(ignore_subscribe_messages=True)
+            try:
+                await pubsub.subscribe(channel)
+                backoff = 1
+                async for message in pubsub.listen():
+                    sender, _, key = message["data"].decode().partition(":")
+                    if sender == self.instance_id:
+                        continue
+                    if key.startswith(NAMESPACE_MESSAGE):
+                        self._forget_namespace(key[len(NAMESPACE_MESSAGE):])
+                    elif any(char in key for char in "*?["):
+                        self.local.delete_matching(key)
+                    else:
+                        self.local.delete(key)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Cache invalidation listener error: {e}")
+                # Anything may have changed while we were not listening
+                self.local.clear()
+                self._versions.clear()
+                await asyncio.sleep(backoff)
+                backoff = min(backoff * 2, 30)
+            finally:
+                await pubsub.aclose()
+
+    async def _publish_invalidation(self, key: str):
+        try:
+            await asyncio.wait_for(
+                self.redis_client.publish(settings.cache_invalidation_channel, f"{self.instance_id}:{key}"),
+                cap_timeout(settings.cache_redis_timeout),
+            )
+        except Exception as e:
+            logger.error(f"Redis PUBLISH error: {e}")
+
+    async def get(self, key: str) -> Optional[bytes]:
         """Get value from cache."""
+        value = self.local.get(key)
+        if value is not None:
+            return value
         if not self.redis_client:
             return None
         try:
-            return await self.redis_client.get(key)
+            value = await asyncio.wait_for(self.redis_client.get(key), cap_timeout(settings.cache_redis_timeout))
         except Exception as e:
-            logger.error(f"Redis GET error: {e}")
+            self._count_l2("error", key)
+            logger.error(f"Redis GET error: {e!r}")
+            return None
+        if value is None:
+            self._count_l2("miss", key)
             return None
+        self._count_l2("hit", key)
+        value = self._decode(value)
+        self.local.set(key, value)
+        return value
 
-    async def set(self, key: str, value: str, expire: int = 30) -> bool:
+    async def get_many(self, keys: Iterable[str]) -> Dict[str, bytes]:
+        """Get several values, fetching everything not in L1 with one MGET. Missing keys are left out."""
+        found = {}
+        remote = []
+        for key in keys:
+            value = self.local.get(key)
+            if value is None:
+                remote.append(key)
+            else:
+                found[key] = value
+        if not remote or not self.redis_client:
+            return found
+        try:
+            values = await asyncio.wait_for(self.redis_client.mget(remote), cap_timeout(settings.cache_redis_timeout))
+        except Exception as e:
+            for key in remote:
+                self._count_l2("error", key)
+            logger.error(f"Redis MGET error: {e!r}")
+            return found
+        for key, value in zip(remote, values, strict=True):
+            if value is None:
+                self._count_l2("miss", key)
+                continue
+            self._count_l2("hit", key)
+            value = self._decode(value)
+            self.local.set(key, value)
+            found[key] = value
+        return found
+
+    async def set(self, key: str, value: bytes, expire: int = 30) -> bool:
         """Set value in cache with expiration."""
         if not self.redis_client:
             return False
         try:
-            await self.redis_client.set(key, value, ex=expire)
-            return True
+            await asyncio.wait_for(
+                self.redis_client.set(key, self._encode(key, value), ex=expire),
+                cap_timeout(settings.cache_redis_timeout),
+            )
         except Exception as e:
+            self._count_l2("error", key)
             logger.error(f"Redis SET error: {e}")
             return False
+        self.local.set(key, value, expire)
+        await self._publish_invalidation(key)
+        return True
+
+    async def set_many(self, values: Dict[str, bytes], expire: int = 30) -> bool:
+        """Set several values, and announce them to other replicas, in one pipelined round-trip."""
+        if not values:
+            return True
+        if not self.redis_client:
+            return False
+        try:
+            async with self.redis_client.pipeline(transaction=False) as pipe:
+                for key, value in values.items():
+                    pipe.set(key, self._encode(key, value), ex=expire)
+                    pipe.publish(settings.cache_invalidation_channel, f"{self.instance_id}:{key}")
+                await asyncio.wait_for(pipe.execute(), cap_timeout(settings.cache_redis_timeout))
+        except Exception as e:
+            for key in values:
+                self._count_l2("error", key)
+            logger.error(f"Redis pipelined SET error: {e}")
+            return False
+        for key, value in values.items():
+            self.local.set(key, value, expire)
+        return True
 
     async def delete(self, key: str) -> bool:
         """Delete key from cache."""
+        self.local.delete(key)
         if not self.redis_client:
             return False
         try:
-            await self.redis_client.delete(key)
-            return True
+            await asyncio.wait_for(self.redis_client.delete(key), cap_timeout(settings.cache_redis_timeout))
         except Exception as e:
+            self._count_l2("error", key)
             logger.error(f"Redis DELETE error: {e}")
             return False
+        await self._publish_invalidation(key)
+        return True
+
+    async def delete_many(self, keys: Iterable[str]) -> int:
+        """Delete several keys, and announce it, in one pipelined round-trip."""
+        keys = list(keys)
+        for key in keys:
+            self.local.delete(key)
+        if not keys or not self.redis_client:
+            return 0
+        try:
+            async with self.redis_client.pipeline(transaction=False) as pipe:
+                pipe.unlink(*keys)
+                for key in keys:
+                    pipe.publish(settings.cache_invalidation_channel, f"{self.instance_id}:{key}")
+                deleted, *_ = await asyncio.wait_for(pipe.execute(), cap_timeout(settings.cache_redis_timeout))
+        except Exception as e:
+            for key in keys:
+                self._count_l2("error", key)
+            logger.error(f"Redis pipelined DELETE error: {e}")
+            return 0
+        return deleted
+
+    async def delete_pattern(self, pattern: str) -> int:
+        """
+        Delete all keys matching a glob pattern, e.g. "shipments:*".
+
+        This walks the keyspace with SCAN; prefer invalidate_namespace for
+        keys built with versioned_key.
+        """
+        self.local.delete_matching(pattern)
+        if not self.redis_client:
+            return 0
+        deleted = 0
+        try:
+            # One bounded call per SCAN page and UNLINK rather than a single
+            # bound on the walk, whose length depends on the keyspace
+            cursor = None
+            while cursor != 0:
+                cursor, keys = await asyncio.wait_for(
+                    self.redis_client.scan(cursor or 0, match=pattern, count=500),
+                    cap_timeout(settings.cache_redis_timeout),
+                )
+                if keys:
+                    deleted += await asyncio.wait_for(
+                        self.redis_client.unlink(*keys), cap_timeout(settings.cache_redis_timeout)
+                    )
+        except Exception as e:
+            self._count_l2("error", pattern)
+            logger.error(f"Redis DELETE pattern error: {e}")
+        await self._publish_invalidation(pattern)
+        return deleted
+
+    @staticmethod
+    def _version_key(namespace: str) -> str:
+        return f"cache:version:{namespace}"
+
+    async def versioned_key(self, namespace: str, key: str) -> str:
+        """
+        Key for an entry in a versioned namespace, e.g. "shipments:v3:list:<digest>".
+
+        The namespace's version is read from Redis once and then kept in
+        process until another replica invalidates the namespace.
+        """
+        version = self._versions.get(namespace)
+        if version is None:
+            version = 0
+            if self.redis_client:
+                try:
+                    stored = await asyncio.wait_for(
+                        self.redis_client.get(self._version_key(namespace)), cap_timeout(settings.cache_redis_timeout)
+                    )
+                    version = int(stored or 0)
+                    self._versions[namespace] = version
+                except Exception as e:
+                    logger.error(f"Redis GET version error: {e!r}")
+        return f"{namespace}:v{version}:{key}"
+
+    async def invalidate_namespace(self, namespace: str) -> bool:
+        """
+        Drop every versioned entry in a namespace in one round-trip.
+
+        Bumping the version makes all existing keys unreachable; they expire
+        on their own TTL. Other replicas forget their copy of the version and
+        their L1 entries for the namespace.
+        """
+        self._forget_namespace(namespace)
+        if not self.redis_client:
+            return False
+        try:
+            async with self.redis_client.pipeline(transaction=False) as pipe:
+                pipe.incr(self._version_key(namespace))
+                pipe.publish(settings.cache_invalidation_channel, f"{self.instance_id}:{NAMESPACE_MESSAGE}{namespace}")
+                version, _ = await asyncio.wait_for(pipe.execute(), cap_timeout(settings.cache_redis_timeout))
+        except Exception as e:
+            self._count_l2("error", self._version_key(namespace))
+            logger.error(f"Redis namespace invalidation error: {e}")
+            return False
+        self._versions[namespace] = version
+        return True
+
+    def _forget_namespace(self, namespace: str):
+        self._versions.pop(namespace, None)
+        self.local.delete_matching(f"{namespace}:*")
+
+    async def get_or_compute(self, key: str, loader: Callable[[], Awaitable[bytes]], ttl: int = 30) -> bytes:
+        """
+        Get a value from cache, computing and storing it with loader on a miss.
+
+        Concurrent callers in this process share one computation, and only the
+        replica holding the Redis lock recomputes while others wait for its
+        result. Values close to expiry are refreshed early with a probability
+        that grows as expiry approaches, so hot keys rarely expire at all.
+
+        Args:
+            key: Cache key
+            loader: Coroutine function producing the bytes to cache
+            ttl: Expiration in seconds
+
+        Returns:
+            Cached or freshly computed value
+        """
+        value = self.local.get(key)
+        if value is not None:
+            return value
+
+        inflight = self._inflight.get(key)
+        while inflight is not None:
+            try:
+                return await asyncio.shield(inflight)
+            except asyncio.CancelledError:
+                if not inflight.cancelled():
+                    raise
+                # The leading request was abandoned (e.g. its deadline passed); take over
+                inflight = self._inflight.get(key)
+
+        future = asyncio.get_running_loop().create_future()
+        self._inflight[key] = future
+        try:
+            value = await self._load_or_compute(key, loader, ttl)
+            future.set_result(value)
+            return value
+        except asyncio.CancelledError:
+            future.cancel()
+            raise
+        except Exception as exc:
+            future.set_exception(exc)
+            # Mark the exception retrieved when nobody else was waiting
+            future.exception()
+            raise
+        finally:
+            del self._inflight[key]
+
+    async def _load_or_compute(self, key: str, loader: Callable[[], Awaitable[bytes]], ttl: int) -> bytes:
+        if not self.redis_client:
+            return await loader()
+
+        try:
+            async with self.redis_client.pipeline(transaction=False) as pipe:
+                pipe.get(key)
+                pipe.pttl(key)
+                pipe.get(f"{key}:delta")
+                value, remaining_ms, delta_ms = await asyncio.wait_for(
+                    pipe.execute(), cap_timeout(settings.cache_redis_timeout)
+                )
+        except Exception as e:
+            self._count_l2("error", key)
+            logger.error(f"Redis GET error: {e!r}")
+            return await loader()
+
+        if value is not None:
+            self._count_l2("hit", key)
+            value = self._decode(value)
+            if not self._should_refresh_early(remaining_ms, delta_ms):
+                self.local.set(key, value, remaining_ms / 1000 if remaining_ms > 0 else None)
+                return value
+        else:
+            self._count_l2("miss", key)
+
+        token = uuid.uuid4().hex
+        lock_key = f"lock:{key}"
+        try:
+            acquired = await asyncio.wait_for(
+                self.redis_client.set(lock_key, token, nx=True, px=settings.cache_lock_ttl_ms),
+                cap_timeout(settings.cache_redis_timeout),
+            )
+        except Exception as e:
+            logger.error(f"Redis lock error: {e!r}")
+            acquired = True
+            token = None
+
+        if not acquired:
+            if value is not None:
+                # Another replica is already refreshing; keep serving the current value
+                return value
+            value = await self._wait_for_value(key)
+            if value is not None:
+                return value
+            return await self._compute(key, loader, ttl)
+
+        try:
+            return await self._compute(key, loader, ttl)
+        finally:
+            if token is not None:
+                try:
+                    # Not capped by the request deadline: other replicas wait on this lock
+                    await asyncio.wait_for(
+                        self._release_lock(keys=[lock_key], args=[token]), settings.cache_redis_timeout
+                    )
+                except Exception as e:
+                    logger.error(f"Redis unlock error: {e}")
+
+    @staticmethod
+    def _should_refresh_early(remaining_ms: int, delta_ms: Optional[bytes]) -> bool:
+        """XFetch: refresh when -delta * beta * ln(rand) reaches the remaining TTL."""
+        if remaining_ms is None or remaining_ms < 0:
+            # The key has no expiry
+            return False
+        if not delta_ms:
+            return False
+        return -float(delta_ms) * settings.cache_early_refresh_beta * math.log(random.random() or 1e-12) >= remaining_ms
+
+    async def _wait_for_value(self, key: str) -> Optional[bytes]:
+        """Poll for a value being computed by the replica holding the lock, within the request deadline."""
+        deadline = time.monotonic() + cap_timeout(settings.cache_lock_ttl_ms / 1000)
+        while time.monotonic() < deadline:
+            await asyncio.sleep(settings.cache_lock_poll_interval)
+            try:
+                value = await asyncio.wait_for(self.redis_client.get(key), cap_timeout(settings.cache_redis_timeout))
+            except Exception as e:
+                logger.error(f"Redis GET error: {e!r}")
+                return None
+            if value is not None:
+                value = self._decode(value)
+                self.local.set(key, value)
+                return value
+        return None
+
+    async def _compute(self, key: str, loader: Callable[[], Awaitable[bytes]], ttl: int) -> bytes:
+        started = time.monotonic()
+        value = await loader()
+        elapsed = time.monotonic() - started
+        CACHE_COMPUTE.labels(key_prefix(key)).observe(elapsed)
+        delta_ms = int(elapsed * 1000)
+        try:
+            async with self.redis_client.pipeline(transaction=False) as pipe:
+                pipe.set(key, self._encode(key, value), ex=ttl)
+                pipe.set(f"{key}:delta", delta_ms, ex=ttl)
+                await asyncio.wait_for(pipe.execute(), cap_timeout(settings.cache_redis_timeout))
+        except Exception as e:
+            self._count_l2("error", key)
+            logger.error(f"Redis SET error: {e}")
+            return value
+        self.local.set(key, value, ttl)
+        await self._publish_invalidation(key)
+        return value
+
+    def stats(self) -> dict:
+        """Hit/miss/eviction counters for each tier."""
+        return {
+            "l1": self.local.stats(),
+            "l2": {
+                "connected": self.redis_client is not None,
+                "hits": self.l2_hits,
+                "misses": self.l2_misses,
+                "errors": self.l2_errors,
+                "compressed_values": self.compressed_values,
+                "compressed_bytes_in": self.compressed_bytes_in,
+                "compressed_bytes_out": self.compressed_bytes_out,
+                "namespace_versions": dict(self._versions),
+            },
+        }
 
 
 # Global cache instance
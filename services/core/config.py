@@ -1,3 +1,5 @@
+from typing import Optional
+
 from pydantic_settings import BaseSettings
 
 
@@ -8,6 +10,98 @@ class Settings(BaseSettings):
     jwt_algorithm: str = "HS256"
     environment: str = "development"
 
+    # Database engine profile (per process)
+    database_replica_url: Optional[str] = None
+    db_echo: bool = False
+    db_pool_size: int = 10
+    db_max_overflow: int = 10
+    db_pool_timeout: float = 30.0
+    db_pool_recycle: int = 1800
+    db_pool_pre_ping: bool = True
+    db_statement_cache_size: int = 100
+    db_statement_timeout_ms: int = 15000
+
+    # Rows fetched per server-side cursor round-trip in bulk exports
+    export_batch_size: int = 1000
+
+    # Bulk ingest: rows per COPY batch, per-row errors kept in the report, and
+    # the longest line (CSV record) accepted, so one upload cannot buffer unbounded
+    ingest_batch_size: int = 5000
+    ingest_max_errors: int = 1000
+    ingest_max_line_bytes: int = 64 * 1024
+
+    # Shipment search: up to SEARCH_MAX_PLACES place names from the cached
+    # vocabulary of origins/destinations; tracking number substrings need
+    # this many characters. A tracking number prefix ranks at most
+    # SEARCH_PREFIX_SCAN_LIMIT of its matches by recency. TTLs in seconds
+    search_max_places: int = 5
+    search_substring_min_length: int = 3
+    search_prefix_scan_limit: int = 500
+    search_places_ttl: int = 300
+    search_cache_ttl: int = 30
+
+    # Lane/status/day rollups: rows per NumPy batch when recomputing, and the
+    # widest window the analytics endpoints answer
+    rollup_recompute_batch_size: int = 50000
+    analytics_max_days: int = 366
+
+    # Shipment events: monthly partitions created ahead and dropped past
+    # retention (0 keeps them all); events this far in the future are rejected
+    event_partition_months_ahead: int = 2
+    event_retention_months: int = 24
+    event_partition_check_interval: float = 3600.0
+    event_max_future_seconds: float = 300.0
+
+    # Live status stream (SSE): one Redis subscription per process fans out to
+    # every connected client; clients further behind than the queue are resynced
+    status_stream_channel: str = "shipments:status"
+    status_stream_heartbeat_seconds: float = 15.0
+    status_stream_retry_ms: int = 5000
+    status_stream_queue_size: int = 16
+    status_stream_max_subscribers: int = 50000
+    status_stream_max_tracking_numbers: int = 100
+
+    # In-process L1 cache in front of Redis
+    cache_l1_max_entries: int = 1024
+    cache_l1_ttl: float = 5.0
+    cache_invalidation_channel: str = "cache:invalidate"
+    # Upper bound on a single Redis call; requests with a deadline get less
+    cache_redis_timeout: float = 1.0
+
+    # Stampede protection for get_or_compute
+    cache_lock_ttl_ms: int = 5000
+    cache_lock_poll_interval: float = 0.05
+    cache_early_refresh_beta: float = 1.0
+
+    # zstd-compress values in Redis from this many bytes, per key namespace
+    # (comma-separated "namespace=bytes"; unlisted namespaces are stored as is)
+    cache_compress_min_bytes: str = "shipments=1024"
+    cache_compression_level: int = 3
+
+    # Event-loop lag monitor (seconds); stalls keep the stack of the blocking call
+    loop_lag_interval: float = 0.1
+    loop_lag_stall_threshold: float = 0.1
+    loop_lag_max_stalls: int = 20
+
+    # Production launcher (python main.py); 0 workers means one per available CPU.
+    # Keep-alive outlasts typical load balancer idle timeouts (60s) so they close first;
+    # the graceful timeout fits inside Kubernetes' default 30s termination grace period.
+    server_host: str = "0.0.0.0"
+    server_port: int = 8002
+    server_workers: int = 0
+    server_reuse_port: bool = True
+    server_backlog: int = 2048
+    server_keepalive_timeout: int = 75
+    server_graceful_timeout: float = 20.0
+    server_access_log: bool = False
+
+    # Admin endpoints (/debug/*) are disabled unless a token is set
+    admin_token: Optional[str] = None
+    # Token roles allowed to call write endpoints, comma-separated
+    write_roles: str = "ADMIN"
+    profile_max_seconds: float = 60.0
+    profile_sample_interval: float = 0.005
+
     class Config:
         env_file = ".env"
         case_sensitive = False
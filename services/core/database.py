@@ -1,16 +1,129 @@
-from sqlalchemy.ext.asyncio import create_async_engine, AsyncSession
-from sqlalchemy.orm import sessionmaker, declarative_base
+import time
+
+from sqlalchemy import text
+from sqlalchemy.engine import make_url
+from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine
+from sqlalchemy.orm import declarative_base, sessionmaker
+from sqlalchemy.pool import AsyncAdaptedQueuePool
+
 from config import settings
+from deadline import statement_timeout_ms
+from metrics import CallbackGauge, Histogram
+
+DB_CHECKOUT_WAIT = Histogram(
+    "db_pool_checkout_wait_seconds", "Time spent waiting for a pooled database connection", ("pool",)
+)
+
+
+class InstrumentedPool(AsyncAdaptedQueuePool):
+    """Async queue pool that records how long checkouts wait for a connection."""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        # The engine's pool_logging_name, which survives pool recreation on dispose
+        self._checkout_wait = DB_CHECKOUT_WAIT.labels(self._orig_logging_name or "primary")
+        self.checkouts = 0
+        self.checkout_wait_total = 0.0
+        self.checkout_wait_max = 0.0
+
+    def _do_get(self):
+        started = time.perf_counter()
+        connection = super()._do_get()
+        waited = time.perf_counter() - started
+        self._checkout_wait.observe(waited)
+        self.checkouts += 1
+        self.checkout_wait_total += waited
+        self.checkout_wait_max = max(self.checkout_wait_max, waited)
+        return connection
 
-# Convert postgresql:// to postgresql+asyncpg://
-DATABASE_URL = settings.database_url.replace("postgresql://", "postgresql+asyncpg://")
+    def stats(self) -> dict:
+        return {
+            "size": self.size(),
+            "checked_out": self.checkedout(),
+            "checked_in": self.checkedin(),
+            "overflow": self.overflow(),
+            "checkouts": self.checkouts,
+            "checkout_wait_avg_ms": round(self.checkout_wait_total / self.checkouts * 1000, 3) if self.checkouts else 0.0,
+            "checkout_wait_max_ms": round(self.checkout_wait_max * 1000, 3),
+        }
 
-engine = create_async_engine(DATABASE_URL, echo=True)
+
+def _async_url(url: str):
+    """Convert a postgresql:// URL (as used by Prisma) to an asyncpg URL."""
+    async_url = make_url(url).set(drivername="postgresql+asyncpg")
+    # Prisma's ?schema= parameter is not an asyncpg connection argument
+    async_url = async_url.difference_update_query(["schema"])
+    # SQLAlchemy-level prepared statement cache (0 disables it, e.g. behind PgBouncer)
+    return async_url.update_query_dict({"prepared_statement_cache_size": str(settings.db_statement_cache_size)})
+
+
+def _create_engine(url: str, name: str):
+    return create_async_engine(
+        _async_url(url),
+        echo=settings.db_echo,
+        poolclass=InstrumentedPool,
+        pool_logging_name=name,
+        pool_size=settings.db_pool_size,
+        max_overflow=settings.db_max_overflow,
+        pool_timeout=settings.db_pool_timeout,
+        pool_recycle=settings.db_pool_recycle,
+        pool_pre_ping=settings.db_pool_pre_ping,
+        connect_args={
+            "statement_cache_size": settings.db_statement_cache_size,
+            "server_settings": {"statement_timeout": str(settings.db_statement_timeout_ms)},
+        },
+    )
+
+
+engine = _create_engine(settings.database_url, "primary")
 AsyncSessionLocal = sessionmaker(engine, class_=AsyncSession, expire_on_commit=False)
 
+# Read-only sessions use the replica when one is configured
+read_engine = _create_engine(settings.database_replica_url, "replica") if settings.database_replica_url else engine
+AsyncReadSessionLocal = sessionmaker(read_engine, class_=AsyncSession, expire_on_commit=False)
+
 Base = declarative_base()
 
 
+async def _apply_deadline(session: AsyncSession):
+    """Lower statement_timeout for the session's first transaction to fit the request deadline."""
+    timeout_ms = statement_timeout_ms(settings.db_statement_timeout_ms)
+    if timeout_ms is not None:
+        await session.execute(text("SELECT set_config('statement_timeout', :timeout, true)"), {"timeout": str(timeout_ms)})
+
+
 async def get_db():
     async with AsyncSessionLocal() as session:
+        await _apply_deadline(session)
         yield session
+
+
+async def get_read_db():
+    """Session for read-only queries, served by the read replica if configured."""
+    async with AsyncReadSessionLocal() as session:
+        await _apply_deadline(session)
+        yield session
+
+
+def pool_stats() -> dict:
+    """Connection pool usage for the primary and replica engines."""
+    stats = {"primary": engine.pool.stats()}
+    if read_engine is not engine:
+        stats["replica"] = read_engine.pool.stats()
+    return stats
+
+
+def _pool_gauge(field: str):
+    return lambda: {(name,): stats[field] for name, stats in pool_stats().items()}
+
+
+CallbackGauge("db_pool_size", "Configured connections per pool", ("pool",), _pool_gauge("size"))
+CallbackGauge("db_pool_checked_out", "Connections currently checked out", ("pool",), _pool_gauge("checked_out"))
+CallbackGauge("db_pool_overflow", "Connections opened beyond pool_size", ("pool",), _pool_gauge("overflow"))
+
+
+async def dispose_engines():
+    """Close all pooled connections."""
+    await engine.dispose()
+    if read_engine is not engine:
+        await read_engine.dispose()
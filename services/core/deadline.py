@@ -0,0 +1,105 @@
+import asyncio
+import json
+import logging
+import time
+from contextvars import ContextVar
+from typing import Optional
+
+logger = logging.getLogger(__name__)
+
+# Milliseconds the caller is still willing to wait, set by the gateway
+DEADLINE_HEADER = b"x-request-timeout-ms"
+
+_deadline: ContextVar[Optional[float]] = ContextVar("request_deadline", default=None)
+
+
+def remaining() -> Optional[float]:
+    """Seconds left before the current request's deadline, or None without one."""
+    deadline = _deadline.get()
+    if deadline is None:
+        return None
+    return deadline - time.monotonic()
+
+
+def cap_timeout(timeout: float) -> float:
+    """A timeout in seconds, shortened to the time left on the current request."""
+    left = remaining()
+    if left is None:
+        return timeout
+    return max(0.0, min(timeout, left))
+
+
+def statement_timeout_ms(default_ms: int) -> Optional[int]:
+    """A statement timeout tighter than default_ms, or None if the default already fits."""
+    left = remaining()
+    if left is None or left * 1000 >= default_ms:
+        return None
+    return max(1, int(left * 1000))
+
+
+class DeadlineMiddleware:
+    """
+    Enforce the caller's deadline on each request.
+
+    The handler runs inside a timeout derived from the deadline header; when
+    it passes, the handler task is cancelled (and with it any in-flight DB
+    query or cache rebuild) and the caller gets 504 if nothing was sent yet.
+    """
+
+    def __init__(self, app):
+        self.app = app
+        self.expired = 0
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        budget_ms = None
+        for name, value in scope["headers"]:
+            if name == DEADLINE_HEADER:
+                try:
+                    budget_ms = int(value)
+                except ValueError:
+                    pass
+                break
+        if budget_ms is None or budget_ms <= 0:
+            # Not a usable budget; the gateway never sends one below 1ms
+            await self.app(scope, receive, send)
+            return
+
+        started = False
+
+        async def send_wrapper(message):
+            nonlocal started
+            if message["type"] == "http.response.start":
+                started = True
+            await send(message)
+
+        token = _deadline.set(time.monotonic() + budget_ms / 1000)
+        timeout = asyncio.timeout(budget_ms / 1000)
+        try:
+            async with timeout:
+                await self.app(scope, receive, send_wrapper)
+        except TimeoutError:
+            if not timeout.expired():
+                raise
+            self.expired += 1
+            logger.warning(f"Deadline of {budget_ms}ms passed for {scope['method']} {scope['path']}; cancelled")
+            if not started:
+                await self._timeout(send)
+        finally:
+            _deadline.reset(token)
+
+    @staticmethod
+    async def _timeout(send):
+        body = json.dumps({"error": "Gateway Timeout", "message": "Request deadline exceeded"}).encode()
+        await send({
+            "type": "http.response.start",
+            "status": 504,
+            "headers": [
+                (b"content-type", b"application/json"),
+                (b"content-length", str(len(body)).encode()),
+            ],
+        })
+        await send({"type": "http.response.body", "body": body})
@@ -0,0 +1,238 @@
+import asyncio
+import logging
+import re
+import uuid
+from datetime import datetime, timedelta, timezone
+from typing import List, Optional, Set, Tuple
+
+from sqlalchemy import select, text
+from sqlalchemy.ext.asyncio import AsyncConnection, AsyncSession
+
+from config import settings
+from database import engine
+from metrics import Counter
+from models import Shipment, ShipmentEvent
+from rollups import record_status_change
+from status_stream import status_broadcaster
+
+logger = logging.getLogger(__name__)
+
+PARTITION_NAME = re.compile(r"shipment_events_(\d{4})_(\d{2})")
+
+# Serializes partition DDL across replicas; released when the transaction ends
+PARTITION_LOCK = text("SELECT pg_advisory_xact_lock(hashtext('shipment_events_partitions'))")
+
+LIST_PARTITIONS = text(
+    "SELECT child.relname FROM pg_inherits "
+    "JOIN pg_class child ON child.oid = pg_inherits.inhrelid "
+    "WHERE pg_inherits.inhparent = 'shipment_events'::regclass"
+)
+
+SHIPMENT_EVENTS = Counter("shipment_events_total", "Shipment status events recorded", ("result",))
+EVENTS_CURRENT = SHIPMENT_EVENTS.labels("current")
+EVENTS_OUT_OF_ORDER = SHIPMENT_EVENTS.labels("out_of_order")
+
+
+class ShipmentNotFoundError(LookupError):
+    """Raised when an event names a tracking number that does not exist."""
+    pass
+
+
+class InvalidEventTimeError(ValueError):
+    """Raised when an event's occurred_at falls outside the retained partitions."""
+    pass
+
+
+def _utcnow() -> datetime:
+    # Columns are timestamp without time zone, stored as UTC
+    return datetime.now(timezone.utc).replace(tzinfo=None)
+
+
+def _month_start(moment: datetime) -> datetime:
+    return moment.replace(day=1, hour=0, minute=0, second=0, microsecond=0)
+
+
+def _add_months(month: datetime, months: int) -> datetime:
+    index = month.year * 12 + month.month - 1 + months
+    return month.replace(year=index // 12, month=index % 12 + 1)
+
+
+def retention_cutoff(now: datetime) -> Optional[datetime]:
+    """Start of the oldest retained month, or None when events are kept forever."""
+    if settings.event_retention_months <= 0:
+        return None
+    return _add_months(_month_start(now), -settings.event_retention_months)
+
+
+class EventPartitions:
+    """
+    Monthly range partitions of shipment_events.
+
+    A background task creates the parent table and the partitions for the
+    next few months, and drops partitions that fall entirely before the
+    retention window, which is far cheaper than deleting old rows. Events
+    for a month without a partition (backfills) create it on demand. All
+    DDL runs under an advisory lock so replicas never race each other.
+    """
+
+    def __init__(self):
+        self._known: Set[datetime] = set()
+        self._task: Optional[asyncio.Task] = None
+        self.dropped = 0
+
+    async def start(self):
+        try:
+            await self.maintain()
+        except Exception as e:
+            logger.error(f"Shipment event partition maintenance failed: {e}")
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(settings.event_partition_check_interval)
+            try:
+                await self.maintain()
+            except Exception as e:
+                logger.error(f"Shipment event partition maintenance failed: {e}")
+
+    async def maintain(self):
+        """Create the table and upcoming partitions, and drop expired ones."""
+        current = _month_start(_utcnow())
+        async with engine.begin() as connection:
+            await connection.execute(PARTITION_LOCK)
+            await connection.run_sync(ShipmentEvent.__table__.create, checkfirst=True)
+            for offset in range(settings.event_partition_months_ahead + 1):
+                await self._create(connection, _add_months(current, offset))
+            cutoff = retention_cutoff(current)
+            if cutoff is not None:
+                await self._prune(connection, cutoff)
+
+    async def ensure(self, occurred_at: datetime):
+        """Make sure the partition for occurred_at exists before inserting into it."""
+        month = _month_start(occurred_at)
+        if month in self._known:
+            return
+        async with engine.begin() as connection:
+            await connection.execute(PARTITION_LOCK)
+            await self._create(connection, month)
+
+    async def _create(self, connection: AsyncConnection, month: datetime):
+        # Bounds are computed here, never taken from input, so formatting them into DDL is safe
+        await connection.execute(text(
+            f"CREATE TABLE IF NOT EXISTS shipment_events_{month:%Y_%m} PARTITION OF shipment_events "
+            f"FOR VALUES FROM ('{month.isoformat(sep=' ')}') TO ('{_add_months(month, 1).isoformat(sep=' ')}')"
+        ))
+        self._known.add(month)
+
+    async def _prune(self, connection: AsyncConnection, cutoff: datetime):
+        for (name,) in (await connection.execute(LIST_PARTITIONS)).all():
+            match = PARTITION_NAME.fullmatch(name)
+            if match is None:
+                continue
+            month = datetime(int(match.group(1)), int(match.group(2)), 1)
+            if _add_months(month, 1) > cutoff:
+                continue
+            await connection.execute(text(f"DROP TABLE IF EXISTS {name}"))
+            self._known.discard(month)
+            self.dropped += 1
+            logger.info(f"Dropped shipment event partition {name}")
+
+    def stats(self) -> dict:
+        return {
+            "known_partitions": sorted(f"{month:%Y-%m}" for month in self._known),
+            "dropped": self.dropped,
+        }
+
+
+async def append_event(
+    db: AsyncSession,
+    tracking_number: str,
+    status: str,
+    location: Optional[str] = None,
+    occurred_at: Optional[datetime] = None,
+) -> Tuple[ShipmentEvent, Shipment, bool]:
+    """
+    Record a status event and fold it into the shipment's latest status.
+
+    The shipment row is locked while the event is inserted, and its status
+    only moves when the event is at least as new as the current one, so
+    events arriving out of order are kept in the history without rolling
+    the projection back. A new current status moves the shipment between
+    lane rollups in the same transaction and is published to live status
+    streams once committed.
+
+    Returns:
+        The stored event, the shipment, and whether the event became its current status
+    """
+    now = _utcnow()
+    if occurred_at is None:
+        occurred_at = now
+    elif occurred_at.tzinfo is not None:
+        occurred_at = occurred_at.astimezone(timezone.utc).replace(tzinfo=None)
+    if occurred_at > now + timedelta(seconds=settings.event_max_future_seconds):
+        raise InvalidEventTimeError("occurred_at is in the future")
+    cutoff = retention_cutoff(now)
+    if cutoff is not None and occurred_at < cutoff:
+        raise InvalidEventTimeError(f"occurred_at is older than the {settings.event_retention_months} month retention")
+
+    await event_partitions.ensure(occurred_at)
+
+    query = select(Shipment).where(Shipment.tracking_number == tracking_number).with_for_update()
+    shipment = (await db.execute(query)).scalar_one_or_none()
+    if shipment is None:
+        raise ShipmentNotFoundError(f"Shipment not found: {tracking_number}")
+
+    event = ShipmentEvent(
+        id=str(uuid.uuid4()),
+        shipment_id=shipment.id,
+        status=status,
+        location=location,
+        occurred_at=occurred_at,
+        recorded_at=now,
+    )
+    db.add(event)
+    current = shipment.status_at is None or occurred_at >= shipment.status_at
+    if current:
+        previous_status = shipment.status
+        shipment.status = status
+        shipment.status_at = occurred_at
+        shipment.updated_at = now
+        await record_status_change(db, shipment, previous_status)
+    await db.commit()
+
+    if current:
+        EVENTS_CURRENT.inc()
+        await status_broadcaster.publish(shipment, location)
+    else:
+        EVENTS_OUT_OF_ORDER.inc()
+    return event, shipment, current
+
+
+async def get_by_tracking_number(db: AsyncSession, tracking_number: str) -> Optional[Shipment]:
+    """A shipment and its latest status, found through the unique tracking_number index."""
+    query = select(Shipment).where(Shipment.tracking_number == tracking_number)
+    return (await db.execute(query)).scalar_one_or_none()
+
+
+async def list_events(db: AsyncSession, shipment_id: str, limit: int) -> List[ShipmentEvent]:
+    """A shipment's most recent events, newest first."""
+    query = (
+        select(ShipmentEvent)
+        .where(ShipmentEvent.shipment_id == shipment_id)
+        .order_by(ShipmentEvent.occurred_at.desc(), ShipmentEvent.id.desc())
+        .limit(limit)
+    )
+    return list((await db.execute(query)).scalars())
+
+
+# Global partition manager instance
+event_partitions = EventPartitions()
@@ -0,0 +1,292 @@
+import csv
+import json
+import logging
+import uuid
+from datetime import datetime, timezone
+from typing import AsyncIterator, Dict, List, Optional, Tuple
+
+import asyncpg
+from sqlalchemy import text
+from sqlalchemy.exc import SQLAlchemyError
+
+from cache import cache
+from database import AsyncSessionLocal
+from rollups import ADD_TO_ROLLUPS, ROLLUP_UPDATES_INGEST
+
+logger = logging.getLogger(__name__)
+
+NDJSON_CONTENT_TYPES = frozenset({"application/x-ndjson", "application/jsonl", "application/json-lines"})
+CSV_CONTENT_TYPES = frozenset({"text/csv"})
+
+REQUIRED_FIELDS = ("tracking_number", "origin", "destination", "status")
+MAX_FIELD_LENGTH = 255
+COPY_COLUMNS = ("id", "tracking_number", "origin", "destination", "status", "created_at", "updated_at")
+
+# Rows land in a per-connection staging table via COPY, then move into
+# shipments in one INSERT ... SELECT so duplicates can be reported per row.
+# The same statement adds the rows that went in to the lane/status rollups,
+# on the UTC day of their naive UTC created_at, like rollups.ROLLUP_DAY.
+CREATE_STAGING_TABLE = text(
+    "CREATE TEMP TABLE IF NOT EXISTS shipments_ingest "
+    "(LIKE shipments INCLUDING DEFAULTS) ON COMMIT DELETE ROWS"
+)
+MOVE_STAGED_ROWS = (
+    "WITH moved AS ("
+    f"INSERT INTO shipments ({', '.join(COPY_COLUMNS)}) "
+    f"SELECT {', '.join(COPY_COLUMNS)} FROM shipments_ingest "
+    "ON CONFLICT DO NOTHING RETURNING tracking_number, origin, destination, status, created_at"
+    "), rolled_up AS ("
+    "INSERT INTO shipment_rollups (day, origin, destination, status, shipments) "
+    "SELECT created_at::date, origin, destination, status, count(*) FROM moved "
+    "GROUP BY 1, 2, 3, 4 "
+    'ORDER BY 1, origin COLLATE "C", destination COLLATE "C", status COLLATE "C" '
+    f"{ADD_TO_ROLLUPS}"
+    ") SELECT tracking_number FROM moved"
+)
+
+# What a batch can fail with once rows are valid: the database, or the connection to it
+BATCH_ERRORS = (SQLAlchemyError, asyncpg.PostgresError, asyncpg.InterfaceError, OSError)
+
+
+class UnsupportedFormatError(ValueError):
+    """Raised when the upload is neither NDJSON nor CSV."""
+    pass
+
+
+class IngestReport:
+    """Running totals and per-row errors for one bulk upload."""
+
+    def __init__(self, max_errors: int):
+        self.max_errors = max_errors
+        self.received = 0
+        self.inserted = 0
+        self.failed = 0
+        self.errors: List[dict] = []
+
+    def add_error(self, row: int, error: str):
+        self.failed += 1
+        if len(self.errors) < self.max_errors:
+            self.errors.append({"row": row, "error": error})
+
+    def as_dict(self) -> dict:
+        return {
+            "received": self.received,
+            "inserted": self.inserted,
+            "failed": self.failed,
+            "errors": self.errors,
+            "errors_truncated": self.failed > len(self.errors),
+        }
+
+
+async def _iter_lines(stream: AsyncIterator[bytes], max_length: int) -> AsyncIterator[Optional[bytes]]:
+    """Split a byte stream into lines; a line longer than max_length comes out as None."""
+    pending = b""
+    skipping = False
+    async for chunk in stream:
+        pending += chunk
+        lines = pending.split(b"\n")
+        pending = lines.pop()
+        for line in lines:
+            if skipping:
+                # The end of an over-long line
+                skipping = False
+                yield None
+            else:
+                yield line if len(line) <= max_length else None
+        if len(pending) > max_length:
+            # Drop an over-long line as it arrives instead of buffering all of it
+            skipping = True
+            pending = b""
+    if skipping:
+        yield None
+    elif pending:
+        yield pending
+
+
+async def _iter_ndjson(
+    stream: AsyncIterator[bytes], max_line_bytes: int
+) -> AsyncIterator[Tuple[Optional[dict], Optional[str]]]:
+    async for line in _iter_lines(stream, max_line_bytes):
+        if line is None:
+            yield None, f"Line longer than {max_line_bytes} bytes"
+            continue
+        if not line.strip():
+            continue
+        try:
+            record = json.loads(line)
+        except ValueError as exc:
+            yield None, f"Invalid JSON: {exc}"
+            continue
+        if not isinstance(record, dict):
+            yield None, "Expected a JSON object"
+            continue
+        yield record, None
+
+
+async def _iter_csv(
+    stream: AsyncIterator[bytes], max_line_bytes: int
+) -> AsyncIterator[Tuple[Optional[dict], Optional[str]]]:
+    header = None
+    record = ""
+    dropping = False
+    quotes = 0
+    async for line in _iter_lines(stream, max_line_bytes):
+        if line is None:
+            record, dropping = "", False
+            yield None, f"Record longer than {max_line_bytes} bytes"
+            continue
+        part = line.decode("utf-8", errors="replace")
+        if dropping:
+            # Skip the rest of an over-long record, following its quotes to find the end
+            quotes += part.count('"')
+            dropping = bool(quotes % 2)
+            continue
+        record += part
+        # An odd number of quotes means a quoted field continues on the next line
+        if record.count('"') % 2:
+            if len(record) > max_line_bytes:
+                dropping, quotes, record = True, record.count('"'), ""
+                yield None, f"Record longer than {max_line_bytes} bytes"
+                continue
+            record += "\n"
+            continue
+        text, record = record.rstrip("\r"), ""
+        if not text.strip():
+            continue
+        values = next(csv.reader([text]))
+        if header is None:
+            header = [name.strip().lower() for name in values]
+            continue
+        if len(values) != len(header):
+            yield None, f"Expected {len(header)} columns, got {len(values)}"
+            continue
+        yield dict(zip(header, values, strict=True)), None
+
+
+def _parse_created_at(value) -> datetime:
+    created_at = datetime.fromisoformat(value)
+    if created_at.tzinfo is not None:
+        # Columns are timestamp without time zone, stored as UTC
+        created_at = created_at.astimezone(timezone.utc).replace(tzinfo=None)
+    return created_at
+
+
+def _validate(record: dict, now: datetime) -> Tuple[Optional[tuple], Optional[str]]:
+    """Turn one raw record into a COPY row, or explain why it is invalid."""
+    values = {}
+    for field in REQUIRED_FIELDS:
+        value = record.get(field)
+        if not isinstance(value, str) or not value.strip():
+            return None, f"Missing or empty field: {field}"
+        if len(value) > MAX_FIELD_LENGTH:
+            return None, f"Field too long: {field}"
+        values[field] = value.strip()
+
+    created_at = now
+    if record.get("created_at"):
+        try:
+            created_at = _parse_created_at(record["created_at"])
+        except (TypeError, ValueError):
+            return None, "Invalid created_at, expected ISO 8601"
+
+    shipment_id = record.get("id") or str(uuid.uuid4())
+    if not isinstance(shipment_id, str) or len(shipment_id) > MAX_FIELD_LENGTH:
+        return None, "Invalid id"
+
+    return (
+        shipment_id,
+        values["tracking_number"],
+        values["origin"],
+        values["destination"],
+        values["status"],
+        created_at,
+        now,
+    ), None
+
+
+async def _load_batch(rows: List[tuple], row_numbers: Dict[str, int], report: IngestReport):
+    """COPY one batch into staging and move it into shipments in a single transaction."""
+    try:
+        async with AsyncSessionLocal() as session:
+            async with session.begin():
+                # The session opens the transaction on its first statement, so this
+                # one goes through it; the driver calls below then run inside it
+                # instead of autocommitting (which would empty the staging table)
+                await session.execute(CREATE_STAGING_TABLE)
+                connection = await session.connection()
+                raw_connection = await connection.get_raw_connection()
+                driver = raw_connection.driver_connection
+                await driver.copy_records_to_table("shipments_ingest", records=rows, columns=COPY_COLUMNS)
+                inserted = {record["tracking_number"] for record in await driver.fetch(MOVE_STAGED_ROWS)}
+    except BATCH_ERRORS:
+        logger.exception(f"Bulk ingest batch of {len(rows)} rows failed")
+        for row_number in row_numbers.values():
+            report.add_error(row_number, "Batch failed to load")
+        return
+
+    report.inserted += len(inserted)
+    for tracking_number, row_number in row_numbers.items():
+        if tracking_number not in inserted:
+            report.add_error(row_number, f"Duplicate shipment: {tracking_number}")
+    # Only a committed batch changes what readers can see
+    if inserted:
+        ROLLUP_UPDATES_INGEST.inc()
+        await cache.invalidate_namespace("shipments")
+
+
+async def ingest_shipments(
+    content_type: str,
+    stream: AsyncIterator[bytes],
+    batch_size: int,
+    max_errors: int,
+    max_line_bytes: int,
+) -> dict:
+    """
+    Load an NDJSON or CSV upload into shipments, batch by batch, as it streams in.
+
+    Rows are validated with plain checks rather than one pydantic model per
+    row. Each batch of valid rows goes through COPY and a single
+    INSERT ... SELECT, and commits on its own. Duplicates of existing
+    tracking numbers (or ids) are reported per row rather than failing the
+    batch. Lines (CSV records) longer than max_line_bytes are rejected
+    without being buffered.
+
+    Returns:
+        Counts of received/inserted/failed rows and the per-row errors
+    """
+    media_type = content_type.split(";", 1)[0].strip().lower()
+    if media_type in NDJSON_CONTENT_TYPES:
+        records = _iter_ndjson(stream, max_line_bytes)
+    elif media_type in CSV_CONTENT_TYPES:
+        records = _iter_csv(stream, max_line_bytes)
+    else:
+        raise UnsupportedFormatError(f"Unsupported content type: {media_type or 'none'}")
+
+    report = IngestReport(max_errors)
+    now = datetime.now(timezone.utc).replace(tzinfo=None)
+    rows: List[tuple] = []
+    row_numbers: Dict[str, int] = {}
+
+    async for record, error in records:
+        report.received += 1
+        row_number = report.received
+        if error is None:
+            row, error = _validate(record, now)
+        if error is not None:
+            report.add_error(row_number, error)
+            continue
+        tracking_number = row[1]
+        if tracking_number in row_numbers:
+            report.add_error(row_number, f"Duplicate shipment in upload: {tracking_number}")
+            continue
+        rows.append(row)
+        row_numbers[tracking_number] = row_number
+        if len(rows) >= batch_size:
+            await _load_batch(rows, row_numbers, report)
+            rows, row_numbers = [], {}
+
+    if rows:
+        await _load_batch(rows, row_numbers, report)
+
+    logger.info(f"Bulk ingest: {report.inserted} inserted, {report.failed} failed of {report.received}")
+    return report.as_dict()
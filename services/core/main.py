@@ -1,11 +1,42 @@
-from fastapi import FastAPI, HTTPException
+from fastapi import FastAPI, HTTPException, Depends, Query, Request
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import ORJSONResponse, Response, StreamingResponse
+from starlette.background import BackgroundTask
 from contextlib import asynccontextmanager
-from schemas import ShipmentListResponse, Shipment
+from sqlalchemy.ext.asyncio import AsyncSession
+from schemas import (
+    ShipmentListResponse,
+    ShipmentSearchResponse,
+    BulkIngestResponse,
+    ShipmentEventCreate,
+    ShipmentEventList,
+    ShipmentEventResult,
+    TrackedShipment,
+)
+from shipments import list_shipments, count_shipments, decode_cursor, encode_page, export_shipments, InvalidCursorError
+from search import search_shipments
+from rollups import daily_series, lane_summary, recompute_rollups
+from ingest import ingest_shipments, UnsupportedFormatError
+from events import (
+    append_event,
+    event_partitions,
+    get_by_tracking_number,
+    list_events,
+    InvalidEventTimeError,
+    ShipmentNotFoundError,
+)
+from status_stream import current_statuses, status_broadcaster, TooManySubscribersError
+from database import get_db, get_read_db, pool_stats, dispose_engines
 from cache import cache
+from access import require_write_access
+from serve import on_drain
+from deadline import DeadlineMiddleware
 from config import settings
-from datetime import datetime, timezone
-import json
+from metrics import CONTENT_TYPE, MetricsMiddleware, generate_latest
+from diagnostics import ProfileBusyError, loop_monitor, profiler, require_admin
+from datetime import date, datetime, timezone
+from typing import List, Literal, Optional
+import hashlib
 import logging
 
 # Configure logging
@@ -17,11 +48,20 @@ logger = logging.getLogger(__name__)
 async def lifespan(app: FastAPI):
     """Lifespan context manager for startup and shutdown events."""
     # Startup
+    await loop_monitor.start()
     await cache.connect()
+    await status_broadcaster.connect()
+    await event_partitions.start()
+    # End status streams as soon as a shutdown starts; they never finish on their own
+    on_drain(status_broadcaster.close_all)
     logger.info("Core service started")
     yield
     # Shutdown
+    await event_partitions.stop()
+    await status_broadcaster.disconnect()
     await cache.disconnect()
+    await dispose_engines()
+    await loop_monitor.stop()
     logger.info("Core service stopped")
 
 
@@ -30,8 +70,12 @@ app = FastAPI(
     description="Core Business Logic Service for HarborX platform",
     version="1.0.0",
     lifespan=lifespan,
+    default_response_class=ORJSONResponse,
 )
 
+# Cancel handlers once the caller's deadline (from the gateway) has passed
+app.add_middleware(DeadlineMiddleware)
+
 # CORS Configuration
 # SECURITY: Default to localhost only for development
 # Production MUST configure specific allowed origins via CORS_ORIGINS env var
@@ -50,6 +94,9 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# Outermost, so rejections by the other middleware are measured too
+app.add_middleware(MetricsMiddleware)
+
 
 @app.get("/health")
 @app.get("/healthz")
@@ -63,55 +110,283 @@ async def health_check():
     }
 
 
+@app.get("/health/cache")
+async def cache_stats():
+    """Hit/miss/eviction counters for the in-process and Redis cache tiers."""
+    return {"cache": cache.stats()}
+
+
+@app.get("/health/stream")
+async def status_stream_stats():
+    """Open status streams and fan-out counters for this process."""
+    return {"status_stream": status_broadcaster.stats()}
+
+
+@app.get("/health/db")
+async def db_pool_stats():
+    """Database connection pool usage and checkout wait times."""
+    return {"pools": pool_stats(), "shipment_event_partitions": event_partitions.stats()}
+
+
+@app.get("/metrics", include_in_schema=False)
+async def metrics():
+    """Prometheus metrics for this process."""
+    return Response(content=generate_latest(), media_type=CONTENT_TYPE)
+
+
+@app.get("/debug/loop-lag", dependencies=[Depends(require_admin)], include_in_schema=False)
+async def loop_lag_stats():
+    """Event-loop lag and the stacks captured for recent stalls (admin only)."""
+    return {"loop_lag": loop_monitor.stats()}
+
+
+@app.get("/debug/profile", dependencies=[Depends(require_admin)], include_in_schema=False)
+async def cpu_profile(seconds: float = Query(10.0, gt=0, le=settings.profile_max_seconds)):
+    """
+    Sample the event loop for N seconds and return collapsed stacks (admin only).
+
+    The output feeds flamegraph.pl or speedscope directly.
+    """
+    try:
+        stacks = await profiler.profile(seconds)
+    except ProfileBusyError as exc:
+        raise HTTPException(status_code=409, detail=str(exc)) from exc
+    return Response(content=stacks, media_type="text/plain; charset=utf-8")
+
+
+@app.post("/admin/rollups/recompute", dependencies=[Depends(require_admin)], include_in_schema=False)
+async def recompute_shipment_rollups(since: Optional[date] = None):
+    """
+    Rebuild lane/status rollups from the shipments table, from `since` or entirely (admin only).
+
+    Rollup writers (bulk ingest, status events) carry on while it runs.
+    """
+    return await recompute_rollups(since)
+
+
+EXPORT_MEDIA_TYPES = {"ndjson": "application/x-ndjson", "csv": "text/csv"}
+
+
+@app.get("/api/v1/shipments/export")
+async def export_shipments_endpoint(
+    format: Literal["ndjson", "csv"] = "ndjson",
+    status: Optional[str] = None,
+    origin: Optional[str] = None,
+    destination: Optional[str] = None,
+):
+    """
+    Stream all matching shipments as NDJSON or CSV (protected endpoint).
+
+    Rows are read from a server-side cursor in batches of EXPORT_BATCH_SIZE
+    and written as they arrive, so exports of any size use constant memory.
+    """
+    return StreamingResponse(
+        export_shipments(format, settings.export_batch_size, status, origin, destination),
+        media_type=EXPORT_MEDIA_TYPES[format],
+        headers={"content-disposition": f'attachment; filename="shipments.{format}"'},
+    )
+
+
+@app.post(
+    "/api/v1/shipments/bulk", response_model=BulkIngestResponse, dependencies=[Depends(require_write_access)]
+)
+async def bulk_ingest_shipments(request: Request):
+    """
+    Bulk-load shipments from an NDJSON (application/x-ndjson) or CSV (text/csv) upload (write access).
+
+    The body is parsed as it streams in and loaded in COPY batches of
+    INGEST_BATCH_SIZE rows, each committed independently. Invalid rows and
+    duplicates are reported per row (1-based, CSV header excluded), as are
+    lines longer than INGEST_MAX_LINE_BYTES.
+    """
+    try:
+        report = await ingest_shipments(
+            request.headers.get("content-type", ""),
+            request.stream(),
+            settings.ingest_batch_size,
+            settings.ingest_max_errors,
+            settings.ingest_max_line_bytes,
+        )
+    except UnsupportedFormatError as exc:
+        raise HTTPException(status_code=415, detail=str(exc)) from exc
+    return report
+
+
+@app.get("/api/v1/shipments/search", response_model=ShipmentSearchResponse)
+async def search_shipments_endpoint(
+    q: str = Query(..., min_length=2, max_length=64),
+    limit: int = Query(10, ge=1, le=50),
+    db: AsyncSession = Depends(get_read_db),
+):
+    """
+    Typeahead search on tracking number, origin and destination (protected endpoint).
+
+    Matches tracking number prefixes, then partial place names ("Jedd",
+    "Abu Dh"), then tracking number substrings, ranked in that order and
+    newest first. Results are cached per query.
+    """
+    return Response(content=await search_shipments(db, q, limit), media_type="application/json")
+
+
+@app.get("/api/v1/shipments/analytics/lanes")
+async def shipment_lane_analytics(
+    days: int = Query(30, ge=1, le=settings.analytics_max_days),
+    limit: int = Query(50, ge=1, le=500),
+    origin: Optional[str] = None,
+    destination: Optional[str] = None,
+    status: Optional[str] = None,
+    db: AsyncSession = Depends(get_read_db),
+):
+    """
+    Shipments created in the last N days per lane and current status, busiest first (protected endpoint).
+
+    Answered from the per-day rollups, so the cost depends on the window and
+    the number of lanes, not on how many shipments there are.
+    """
+    return await lane_summary(db, days, limit, origin, destination, status)
+
+
+@app.get("/api/v1/shipments/analytics/daily")
+async def shipment_daily_analytics(
+    days: int = Query(30, ge=1, le=settings.analytics_max_days),
+    origin: Optional[str] = None,
+    destination: Optional[str] = None,
+    status: Optional[str] = None,
+    db: AsyncSession = Depends(get_read_db),
+):
+    """
+    Shipments created per day over the last N days, split by current status (protected endpoint).
+
+    Answered from the per-day rollups, optionally for one lane or status.
+    """
+    return await daily_series(db, days, origin, destination, status)
+
+
+@app.get("/api/v1/shipments/stream")
+async def stream_shipment_statuses(tracking_number: List[str] = Query(default=[])):
+    """
+    Live shipment status changes as server-sent events (protected endpoint).
+
+    Pass tracking_number (repeatable) to follow specific shipments; their
+    current status is sent first. Without it every status change is sent.
+    Each change arrives as an "event: status" frame; a "resync" event means
+    updates may have been missed and the client should refetch. Idle
+    streams get a comment every STATUS_STREAM_HEARTBEAT_SECONDS.
+    """
+    if len(tracking_number) > settings.status_stream_max_tracking_numbers:
+        raise HTTPException(
+            status_code=400,
+            detail=f"At most {settings.status_stream_max_tracking_numbers} tracking numbers per stream",
+        )
+    try:
+        # Subscribe before reading current statuses so no change falls in between
+        subscription = status_broadcaster.subscribe(tracking_number)
+    except TooManySubscribersError as exc:
+        raise HTTPException(status_code=503, detail=str(exc), headers={"retry-after": "5"}) from exc
+    try:
+        snapshot = await current_statuses(tracking_number) if tracking_number else []
+    except BaseException:
+        status_broadcaster.unsubscribe(subscription)
+        raise
+    return StreamingResponse(
+        status_broadcaster.stream(subscription, snapshot),
+        media_type="text/event-stream",
+        headers={"cache-control": "no-cache", "x-accel-buffering": "no"},
+        # Also runs if the client disconnects before the stream starts
+        background=BackgroundTask(status_broadcaster.unsubscribe, subscription),
+    )
+
+
+@app.get("/api/v1/shipments/tracking/{tracking_number}", response_model=TrackedShipment)
+async def track_shipment(tracking_number: str, db: AsyncSession = Depends(get_read_db)):
+    """
+    Current status of a shipment by tracking number (protected endpoint).
+
+    Reads the latest-status projection kept on the shipment row through the
+    unique tracking_number index, never the event history.
+    """
+    shipment = await get_by_tracking_number(db, tracking_number)
+    if shipment is None:
+        raise HTTPException(status_code=404, detail="Shipment not found")
+    return shipment
+
+
+@app.get("/api/v1/shipments/tracking/{tracking_number}/events", response_model=ShipmentEventList)
+async def shipment_events(
+    tracking_number: str,
+    limit: int = Query(50, ge=1, le=500),
+    db: AsyncSession = Depends(get_read_db),
+):
+    """Most recent status events of a shipment, newest first (protected endpoint)."""
+    shipment = await get_by_tracking_number(db, tracking_number)
+    if shipment is None:
+        raise HTTPException(status_code=404, detail="Shipment not found")
+    return {"tracking_number": tracking_number, "events": await list_events(db, shipment.id, limit)}
+
+
+@app.post(
+    "/api/v1/shipments/tracking/{tracking_number}/events",
+    response_model=ShipmentEventResult,
+    status_code=201,
+    dependencies=[Depends(require_write_access)],
+)
+async def record_shipment_event(
+    tracking_number: str,
+    request: ShipmentEventCreate,
+    db: AsyncSession = Depends(get_db),
+):
+    """
+    Append a status event and update the shipment's latest status (write access).
+
+    Events older than the current status are stored but leave it unchanged.
+    Cached list pages pick up the new status when they expire.
+    """
+    try:
+        event, shipment, current = await append_event(
+            db, tracking_number, request.status, request.location, request.occurred_at
+        )
+    except ShipmentNotFoundError as exc:
+        raise HTTPException(status_code=404, detail="Shipment not found") from exc
+    except InvalidEventTimeError as exc:
+        raise HTTPException(status_code=422, detail=str(exc)) from exc
+    return {"event": event, "shipment": shipment, "current": current}
+
+
 @app.get("/api/v1/shipments", response_model=ShipmentListResponse)
-async def get_shipments():
+async def get_shipments(
+    limit: int = Query(50, ge=1, le=200),
+    cursor: Optional[str] = None,
+    status: Optional[str] = None,
+    origin: Optional[str] = None,
+    destination: Optional[str] = None,
+    db: AsyncSession = Depends(get_read_db),
+):
     """
-    Get list of shipments (protected endpoint).
+    Get list of shipments, newest first (protected endpoint).
     
-    This endpoint demonstrates Redis caching.
-    TODO: Implement actual database queries and authentication.
+    Uses keyset pagination: pass the returned next_cursor as cursor to get
+    the following page. Pages are cached in Redis with stampede protection
+    and served from the cache as stored JSON bytes.
     """
-    cache_key = "shipments:list"
-    
-    # Try to get from cache
-    cached_data = await cache.get(cache_key)
-    if cached_data:
-        logger.info("Returning shipments from cache")
-        data = json.loads(cached_data)
-        return ShipmentListResponse(**data)
+    if cursor is not None:
+        try:
+            decode_cursor(cursor)
+        except InvalidCursorError as exc:
+            raise HTTPException(status_code=400, detail=str(exc)) from exc
     
-    # Generate stub data (TODO: Replace with actual database query)
-    logger.info("Generating fresh shipments data")
-    shipments = [
-        Shipment(
-            id="ship-001",
-            tracking_number="TRK-2024-001",
-            origin="Dubai, UAE",
-            destination="Jeddah, Saudi Arabia",
-            status="in_transit",
-            created_at=datetime.now(timezone.utc)
-        ),
-        Shipment(
-            id="ship-002",
-            tracking_number="TRK-2024-002",
-            origin="Abu Dhabi, UAE",
-            destination="Riyadh, Saudi Arabia",
-            status="delivered",
-            created_at=datetime.now(timezone.utc)
-        ),
-    ]
+    params = f"{limit}|{cursor}|{status}|{origin}|{destination}"
+    cache_key = await cache.versioned_key("shipments", "list:" + hashlib.sha1(params.encode()).hexdigest())
     
-    response = ShipmentListResponse(
-        shipments=shipments,
-        total=len(shipments)
-    )
-    
-    # Cache for 30 seconds
-    await cache.set(cache_key, response.model_dump_json(), expire=30)
-    
-    return response
+    async def build_page() -> bytes:
+        rows, next_cursor = await list_shipments(db, limit, cursor, status, origin, destination)
+        total, total_is_estimate = await count_shipments(db, status, origin, destination)
+        return encode_page(rows, total, total_is_estimate, next_cursor)
+
+    # Returning a Response skips response_model validation and re-serialization
+    cache_data = await cache.get_or_compute(cache_key, build_page, ttl=30)
+    return Response(content=cache_data, media_type="application/json")
 
 
 if __name__ == "__main__":
-    import uvicorn
-    uvicorn.run(app, host="0.0.0.0", port=8002)
+    from serve import serve
+    serve("main:app")
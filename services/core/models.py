@@ -0,0 +1,82 @@
+from datetime import datetime, timezone
+
+from sqlalchemy import BigInteger, Column, Date, DateTime, ForeignKey, Index, String
+
+from database import Base
+
+
+class Shipment(Base):
+    __tablename__ = "shipments"
+
+    id = Column(String, primary_key=True)
+    tracking_number = Column(String, unique=True, nullable=False)
+    origin = Column(String, nullable=False)
+    destination = Column(String, nullable=False)
+    # Latest-status projection: status and status_at follow the newest event
+    status = Column(String, nullable=False)
+    status_at = Column(DateTime, nullable=True)
+    created_at = Column(DateTime, nullable=False, default=lambda: datetime.now(timezone.utc))
+    updated_at = Column(DateTime, nullable=False, default=lambda: datetime.now(timezone.utc), onupdate=lambda: datetime.now(timezone.utc))
+
+    # Keyset pagination walks (created_at, id) newest first; each filter
+    # column gets its own index with the same sort key so filtered pages
+    # are served by an index range scan as well.
+    __table_args__ = (
+        Index("shipments_created_at_id_idx", created_at.desc(), id.desc()),
+        Index("shipments_status_created_at_id_idx", status, created_at.desc(), id.desc()),
+        Index("shipments_origin_created_at_id_idx", origin, created_at.desc(), id.desc()),
+        Index("shipments_destination_created_at_id_idx", destination, created_at.desc(), id.desc()),
+        # Search: tracking number prefixes through a byte-wise btree (LIKE 'prefix%'
+        # can use it whatever the database collation), substrings through trigrams
+        Index("shipments_tracking_number_prefix_idx", tracking_number.collate("C")),
+        Index(
+            "shipments_tracking_number_idx",
+            tracking_number,
+            postgresql_using="gin",
+            postgresql_ops={"tracking_number": "gin_trgm_ops"},
+        ),
+    )
+
+
+class ShipmentEvent(Base):
+    """
+    Append-only status history, range-partitioned by month on occurred_at.
+
+    Partitions are created and pruned by events.EventPartitions; the primary
+    key includes the partition key, as Postgres requires.
+    """
+
+    __tablename__ = "shipment_events"
+
+    id = Column(String, primary_key=True)
+    occurred_at = Column(DateTime, primary_key=True)
+    shipment_id = Column(String, ForeignKey("shipments.id", ondelete="CASCADE"), nullable=False)
+    status = Column(String, nullable=False)
+    location = Column(String, nullable=True)
+    recorded_at = Column(DateTime, nullable=False, default=lambda: datetime.now(timezone.utc))
+
+    __table_args__ = (
+        Index("shipment_events_shipment_id_occurred_at_idx", shipment_id, occurred_at.desc()),
+        {"postgresql_partition_by": "RANGE (occurred_at)"},
+    )
+
+
+class ShipmentRollup(Base):
+    """
+    Shipments per creation day, lane (origin, destination) and current status.
+
+    Maintained incrementally by bulk ingest and status events, and rebuilt
+    from the shipments table by rollups.recompute_rollups for backfills.
+    """
+
+    __tablename__ = "shipment_rollups"
+
+    day = Column(Date, primary_key=True)
+    origin = Column(String, primary_key=True)
+    destination = Column(String, primary_key=True)
+    status = Column(String, primary_key=True)
+    shipments = Column(BigInteger, nullable=False, default=0)
+
+    __table_args__ = (
+        Index("shipment_rollups_origin_destination_day_idx", origin, destination, day),
+    )
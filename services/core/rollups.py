@@ -0,0 +1,288 @@
+import asyncio
+import logging
+import time
+from datetime import date, datetime, timedelta, timezone
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+from sqlalchemy import Date, cast, func, select, text
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from config import settings
+from database import AsyncSessionLocal
+from metrics import Counter
+from models import Shipment, ShipmentRollup
+
+logger = logging.getLogger(__name__)
+
+EPOCH = date(1970, 1, 1)
+
+ROLLUP_KEY = ("day", "origin", "destination", "status")
+ROLLUP_COLUMNS = (*ROLLUP_KEY, "shipments")
+
+# Appended to an INSERT INTO shipment_rollups to add to existing counts. Rows
+# must arrive in key order with strings in code point order (COLLATE "C"),
+# the order record_status_change uses, so writers cannot deadlock.
+ADD_TO_ROLLUPS = (
+    "ON CONFLICT (day, origin, destination, status) "
+    "DO UPDATE SET shipments = shipment_rollups.shipments + EXCLUDED.shipments"
+)
+
+# A recompute reads shipments and rollups from one snapshot, so the
+# difference between them is exactly what the rollups are missing
+SNAPSHOT = text("SET TRANSACTION ISOLATION LEVEL REPEATABLE READ, READ ONLY")
+# Rollup rows added per statement when a recompute applies its corrections
+ROLLUP_CORRECTION_BATCH_SIZE = 1000
+# Drops rows counted down to zero, locking them in key order like the writers
+PRUNE_EMPTY_ROLLUPS = text(
+    "DELETE FROM shipment_rollups r USING ("
+    "SELECT day, origin, destination, status FROM shipment_rollups WHERE shipments = 0 "
+    'ORDER BY day, origin COLLATE "C", destination COLLATE "C", status COLLATE "C" FOR UPDATE'
+    ") empty "
+    "WHERE (r.day, r.origin, r.destination, r.status) = (empty.day, empty.origin, empty.destination, empty.status) "
+    "AND r.shipments = 0"
+)
+
+# A shipment's rollup day is the UTC date it was created. created_at holds
+# naive UTC (timestamp without time zone), so casting it to a date needs no
+# conversion and does not depend on the session's TimeZone.
+ROLLUP_DAY = cast(Shipment.created_at, Date)
+
+ROLLUP_UPDATES = Counter("shipment_rollup_updates_total", "Incremental rollup updates by source", ("source",))
+ROLLUP_UPDATES_EVENT = ROLLUP_UPDATES.labels("status_event")
+ROLLUP_UPDATES_INGEST = ROLLUP_UPDATES.labels("ingest")
+
+
+def _today() -> date:
+    return datetime.now(timezone.utc).date()
+
+
+def rollup_day(created_at: datetime) -> date:
+    """The rollup day of a shipment, matching ROLLUP_DAY for values not yet read back from the database."""
+    if created_at.tzinfo is not None:
+        created_at = created_at.astimezone(timezone.utc)
+    return created_at.date()
+
+
+async def record_status_change(db: AsyncSession, shipment: Shipment, previous_status: str):
+    """
+    Move a shipment from its previous status to its current one in the rollups.
+
+    Runs in the caller's transaction, so the rollup changes commit or roll
+    back with the status change. Both rows are written in one statement in
+    key order (code point order, like ingest's COLLATE "C"), so concurrent
+    writers always lock rollup rows in the same order.
+    """
+    if previous_status == shipment.status:
+        return
+    lane = {"day": rollup_day(shipment.created_at), "origin": shipment.origin, "destination": shipment.destination}
+    rows = sorted(
+        [{**lane, "status": previous_status, "shipments": -1}, {**lane, "status": shipment.status, "shipments": 1}],
+        key=lambda row: row["status"],
+    )
+    statement = insert(ShipmentRollup).values(rows)
+    statement = statement.on_conflict_do_update(
+        index_elements=list(ROLLUP_KEY),
+        set_={"shipments": ShipmentRollup.shipments + statement.excluded.shipments},
+    )
+    await db.execute(statement)
+    ROLLUP_UPDATES_EVENT.inc()
+
+
+def aggregate_batch(columns: Tuple[np.ndarray, ...], sizes: Tuple[int, ...]) -> Tuple[Tuple[np.ndarray, ...], np.ndarray]:
+    """
+    Count rows per distinct combination of non-negative integer columns.
+
+    Each row's combination is packed into one int64 (mixed radix over
+    `sizes`, the number of possible values per column), so counting is a
+    single 1-D np.unique.
+
+    Returns:
+        The distinct combinations, one array per column, and the number of rows for each
+    """
+    packed = np.ravel_multi_index(columns, sizes)
+    distinct, counts = np.unique(packed, return_counts=True)
+    return np.unravel_index(distinct, sizes), counts
+
+
+class _Codes:
+    """Dense integer codes for the distinct strings seen across all batches."""
+
+    def __init__(self):
+        self.codes: Dict[str, int] = {}
+        self.values: List[str] = []
+
+    def encode(self, column: Tuple[str, ...]) -> np.ndarray:
+        for value in set(column).difference(self.codes):
+            self.codes[value] = len(self.values)
+            self.values.append(value)
+        return np.fromiter(map(self.codes.__getitem__, column), dtype=np.int64, count=len(column))
+
+
+async def recompute_rollups(since: Optional[date] = None) -> dict:
+    """
+    Rebuild the rollups from the shipments table, for all days or from `since` on.
+
+    Shipments are read from a server-side cursor in batches of
+    ROLLUP_RECOMPUTE_BATCH_SIZE. Each batch is turned into integer columns
+    (days since the epoch, place and status codes) and counted with NumPy.
+    Splitting rows into columns and encoding strings are still per-row
+    Python, but the counting itself is vectorized and only the distinct
+    combinations of a batch are merged in Python.
+
+    The scan and a read of the current rollups share one snapshot, and only
+    the difference between them is added to the rollups afterwards, like an
+    ingest batch. Writers are never locked out for the scan, and changes
+    they commit meanwhile are kept.
+    """
+    started = time.monotonic()
+    # Days since the epoch, computed by Postgres so NumPy gets plain integers
+    day_number = ROLLUP_DAY - EPOCH
+    query = select(day_number, Shipment.origin, Shipment.destination, Shipment.status)
+    current = select(
+        ShipmentRollup.day, ShipmentRollup.origin, ShipmentRollup.destination, ShipmentRollup.status,
+        ShipmentRollup.shipments,
+    ).where(ShipmentRollup.shipments != 0)
+    if since is not None:
+        query = query.where(Shipment.created_at >= datetime.combine(since, datetime.min.time()))
+        current = current.where(ShipmentRollup.day >= since)
+    query = query.execution_options(yield_per=settings.rollup_recompute_batch_size)
+
+    places = _Codes()
+    statuses = _Codes()
+    totals: Dict[Tuple[int, int, int, int], int] = {}
+    scanned = 0
+
+    def count_batch(rows):
+        day_numbers, origins, destinations, batch_statuses = zip(*rows, strict=True)
+        days = np.array(day_numbers, dtype=np.int64)
+        first_day = int(days.min())
+        columns = (days - first_day, places.encode(origins), places.encode(destinations), statuses.encode(batch_statuses))
+        sizes = (int(days.max()) - first_day + 1, len(places.values), len(places.values), len(statuses.values))
+        (days, origin_codes, destination_codes, status_codes), counts = aggregate_batch(columns, sizes)
+        keys = zip(
+            (days + first_day).tolist(),
+            origin_codes.tolist(),
+            destination_codes.tolist(),
+            status_codes.tolist(),
+            strict=True,
+        )
+        for key, count in zip(keys, counts.tolist(), strict=True):
+            totals[key] = totals.get(key, 0) + count
+
+    async with AsyncSessionLocal() as session:
+        async with session.begin():
+            await session.execute(SNAPSHOT)
+            result = await session.stream(query)
+            async for rows in result.partitions(settings.rollup_recompute_batch_size):
+                # Off the event loop, though it only helps while NumPy counts: encoding,
+                # zip(*rows) and merging totals hold the GIL and still stall the loop
+                await asyncio.to_thread(count_batch, rows)
+                scanned += len(rows)
+            recorded = await session.execute(current)
+
+            corrections: Dict[Tuple[date, str, str, str], int] = {}
+            for (day_number, origin, destination, status), count in totals.items():
+                key = (EPOCH + timedelta(days=day_number), places.values[origin], places.values[destination], statuses.values[status])
+                corrections[key] = count
+            for day, origin, destination, status, count in recorded:
+                key = (day, origin, destination, status)
+                corrections[key] = corrections.get(key, 0) - count
+
+    # Key order, as every rollup writer uses, so this cannot deadlock with them
+    rows = [
+        dict(zip(ROLLUP_COLUMNS, (*key, delta), strict=True))
+        for key, delta in sorted(corrections.items())
+        if delta != 0
+    ]
+    async with AsyncSessionLocal() as session:
+        async with session.begin():
+            for start in range(0, len(rows), ROLLUP_CORRECTION_BATCH_SIZE):
+                statement = insert(ShipmentRollup).values(rows[start:start + ROLLUP_CORRECTION_BATCH_SIZE])
+                statement = statement.on_conflict_do_update(
+                    index_elements=list(ROLLUP_KEY),
+                    set_={"shipments": ShipmentRollup.shipments + statement.excluded.shipments},
+                )
+                await session.execute(statement)
+        async with session.begin():
+            await session.execute(PRUNE_EMPTY_ROLLUPS)
+
+    elapsed = time.monotonic() - started
+    logger.info(
+        f"Recomputed {len(totals)} shipment rollups from {scanned} shipments in {elapsed:.1f}s, "
+        f"corrected {len(rows)}"
+    )
+    return {
+        "since": since,
+        "shipments_scanned": scanned,
+        "rollup_rows": len(totals),
+        "rollup_rows_corrected": len(rows),
+        "seconds": round(elapsed, 3),
+    }
+
+
+def _window(days: int) -> date:
+    return _today() - timedelta(days=days - 1)
+
+
+def _rollup_filters(origin: Optional[str], destination: Optional[str], status: Optional[str]) -> list:
+    conditions = []
+    if origin is not None:
+        conditions.append(ShipmentRollup.origin == origin)
+    if destination is not None:
+        conditions.append(ShipmentRollup.destination == destination)
+    if status is not None:
+        conditions.append(ShipmentRollup.status == status)
+    return conditions
+
+
+async def lane_summary(
+    db: AsyncSession,
+    days: int,
+    limit: int,
+    origin: Optional[str] = None,
+    destination: Optional[str] = None,
+    status: Optional[str] = None,
+) -> dict:
+    """Shipments created in the last `days` days per lane and current status, busiest lanes first."""
+    total = func.sum(ShipmentRollup.shipments)
+    query = (
+        select(ShipmentRollup.origin, ShipmentRollup.destination, ShipmentRollup.status, total)
+        .where(ShipmentRollup.day >= _window(days), *_rollup_filters(origin, destination, status))
+        .group_by(ShipmentRollup.origin, ShipmentRollup.destination, ShipmentRollup.status)
+        .having(total > 0)
+    )
+    lanes: Dict[Tuple[str, str], dict] = {}
+    for lane_origin, lane_destination, lane_status, count in await db.execute(query):
+        lane = lanes.setdefault(
+            (lane_origin, lane_destination),
+            {"origin": lane_origin, "destination": lane_destination, "total": 0, "by_status": {}},
+        )
+        lane["total"] += count
+        lane["by_status"][lane_status] = count
+    ranked = sorted(lanes.values(), key=lambda lane: (-lane["total"], lane["origin"], lane["destination"]))
+    return {"days": days, "since": _window(days), "lanes": ranked[:limit], "lanes_total": len(ranked)}
+
+
+async def daily_series(
+    db: AsyncSession,
+    days: int,
+    origin: Optional[str] = None,
+    destination: Optional[str] = None,
+    status: Optional[str] = None,
+) -> dict:
+    """Shipments created per day over the last `days` days, split by current status."""
+    total = func.sum(ShipmentRollup.shipments)
+    query = (
+        select(ShipmentRollup.day, ShipmentRollup.status, total)
+        .where(ShipmentRollup.day >= _window(days), *_rollup_filters(origin, destination, status))
+        .group_by(ShipmentRollup.day, ShipmentRollup.status)
+        .having(total > 0)
+    )
+    series: Dict[date, dict] = {}
+    for day, day_status, count in await db.execute(query):
+        point = series.setdefault(day, {"day": day, "total": 0, "by_status": {}})
+        point["total"] += count
+        point["by_status"][day_status] = count
+    return {"days": days, "since": _window(days), "series": [series[day] for day in sorted(series)]}
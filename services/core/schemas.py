@@ -1,4 +1,4 @@
-from pydantic import BaseModel
+from pydantic import BaseModel, Field
 from typing import List, Optional
 from datetime import datetime
 
@@ -11,7 +11,80 @@ class Shipment(BaseModel):
     status: str
     created_at: datetime
 
+    class Config:
+        from_attributes = True
+
 
 class ShipmentListResponse(BaseModel):
     shipments: List[Shipment]
     total: int
+    total_is_estimate: bool = False
+    next_cursor: Optional[str] = None
+
+
+class IngestRowError(BaseModel):
+    row: int
+    error: str
+
+
+class BulkIngestResponse(BaseModel):
+    received: int
+    inserted: int
+    failed: int
+    errors: List[IngestRowError]
+    errors_truncated: bool = False
+
+
+class ShipmentEventCreate(BaseModel):
+    status: str = Field(min_length=1, max_length=255)
+    location: Optional[str] = Field(None, max_length=255)
+    # Defaults to the time the event is received
+    occurred_at: Optional[datetime] = None
+
+
+class ShipmentEvent(BaseModel):
+    id: str
+    status: str
+    location: Optional[str] = None
+    occurred_at: datetime
+    recorded_at: datetime
+
+    class Config:
+        from_attributes = True
+
+
+class TrackedShipment(BaseModel):
+    id: str
+    tracking_number: str
+    origin: str
+    destination: str
+    status: str
+    status_at: Optional[datetime] = None
+    created_at: datetime
+    updated_at: datetime
+
+    class Config:
+        from_attributes = True
+
+
+class ShipmentEventResult(BaseModel):
+    event: ShipmentEvent
+    shipment: TrackedShipment
+    # False when a newer event already set the shipment's status
+    current: bool
+
+
+class ShipmentEventList(BaseModel):
+    tracking_number: str
+    events: List[ShipmentEvent]
+
+
+class ShipmentSearchHit(Shipment):
+    matched: str
+    score: float
+
+
+class ShipmentSearchResponse(BaseModel):
+    query: str
+    places: List[str]
+    results: List[ShipmentSearchHit]
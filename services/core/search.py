@@ -0,0 +1,195 @@
+import hashlib
+import re
+from typing import Dict, List, Optional, Tuple
+
+import orjson
+from sqlalchemy import literal, select, text, union_all
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from cache import cache
+from config import settings
+from models import Shipment
+from shipments import EXPORT_COLUMNS
+
+# Scores by how a shipment matched; ties go to the newest shipment
+SCORE_TRACKING_EXACT = 1.0
+SCORE_TRACKING_PREFIX = 0.9
+SCORE_PLACE_PREFIX = 0.8
+SCORE_PLACE_WORD_PREFIX = 0.7
+SCORE_PLACE_SUBSTRING = 0.5
+SCORE_TRACKING_SUBSTRING = 0.4
+
+# Distinct values of an indexed column, one index probe per value (a loose index scan)
+_DISTINCT_VALUES = (
+    "WITH RECURSIVE places AS ("
+    "(SELECT {column} AS place FROM shipments ORDER BY {column} LIMIT 1) "
+    "UNION ALL "
+    "SELECT (SELECT {column} FROM shipments WHERE {column} > places.place ORDER BY {column} LIMIT 1) "
+    "FROM places WHERE places.place IS NOT NULL"
+    ") SELECT place FROM places WHERE place IS NOT NULL"
+)
+DISTINCT_ORIGINS = text(_DISTINCT_VALUES.format(column="origin"))
+DISTINCT_DESTINATIONS = text(_DISTINCT_VALUES.format(column="destination"))
+
+# Tracking numbers compared byte-wise, as in shipments_tracking_number_prefix_idx
+TRACKING_NUMBER_C = Shipment.tracking_number.collate("C")
+
+_WHITESPACE = re.compile(r"\s+")
+
+# Parsed vocabulary, reused for as long as the cache hands back the same bytes
+_places: Tuple[Optional[bytes], List[Tuple[str, str]]] = (None, [])
+
+
+def normalize_query(query: str) -> str:
+    """Trim and collapse whitespace; case is kept for tracking number prefixes."""
+    return _WHITESPACE.sub(" ", query).strip()
+
+
+def _escape_like(value: str) -> str:
+    # Backslash is PostgreSQL's default LIKE escape character
+    return value.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+
+
+async def _load_places(db: AsyncSession) -> List[Tuple[str, str]]:
+    """Distinct origins and destinations as (casefolded, original) pairs, cached per shipments version."""
+    global _places
+
+    async def distinct_places() -> bytes:
+        names = set((await db.execute(DISTINCT_ORIGINS)).scalars())
+        names.update((await db.execute(DISTINCT_DESTINATIONS)).scalars())
+        return orjson.dumps(sorted(names))
+
+    key = await cache.versioned_key("shipments", "search:places")
+    raw = await cache.get_or_compute(key, distinct_places, ttl=settings.search_places_ttl)
+    if raw is not _places[0]:
+        _places = (raw, [(name.casefold(), name) for name in orjson.loads(raw)])
+    return _places[1]
+
+
+def match_places(places: List[Tuple[str, str]], query: str, limit: int) -> List[Tuple[str, float]]:
+    """The best place names for a query: prefix matches, then word prefixes, then substrings."""
+    needle = query.casefold()
+    matches = []
+    for folded, name in places:
+        position = folded.find(needle)
+        if position < 0:
+            continue
+        if position == 0:
+            score = SCORE_PLACE_PREFIX
+        elif not folded[position - 1].isalnum():
+            score = SCORE_PLACE_WORD_PREFIX
+        else:
+            score = SCORE_PLACE_SUBSTRING
+        matches.append((name, score))
+    # Shorter names first within a score: "Jeddah" before "Jeddah Islamic Port"
+    matches.sort(key=lambda match: (-match[1], len(match[0]), match[0]))
+    return matches[:limit]
+
+
+def _columns(score: float, matched: str):
+    return [
+        *(getattr(Shipment, name) for name in EXPORT_COLUMNS),
+        literal(score, literal_execute=True).label("score"),
+        literal(matched, literal_execute=True).label("matched"),
+    ]
+
+
+def _tracking_prefix_queries(query: str, limit: int) -> list:
+    """
+    Recent shipments whose tracking number starts with the query, as typed and upper-cased.
+
+    No index orders prefix matches by age, so sorting all of them would cost
+    as much as the prefix is common. Instead the byte-wise tracking number
+    index yields the first SEARCH_PREFIX_SCAN_LIMIT matches in tracking
+    number order and the newest of those are returned: exact for prefixes
+    with fewer matches, bounded work for short, busy ones.
+    """
+    queries = []
+    for prefix in dict.fromkeys((query, query.upper())):
+        candidates = (
+            select(Shipment.id, Shipment.created_at)
+            .where(TRACKING_NUMBER_C.like(_escape_like(prefix) + "%"))
+            .order_by(TRACKING_NUMBER_C)
+            .limit(settings.search_prefix_scan_limit)
+            .subquery()
+        )
+        newest = (
+            select(candidates.c.id)
+            .order_by(candidates.c.created_at.desc(), candidates.c.id.desc())
+            .limit(limit)
+        )
+        queries.append(select(*_columns(SCORE_TRACKING_PREFIX, "tracking_number")).where(Shipment.id.in_(newest)))
+    return queries
+
+
+def _place_queries(places: List[Tuple[str, float]], limit: int) -> list:
+    """The newest shipments from or to each place, each served by its (column, created_at, id) index."""
+    queries = []
+    for name, score in places:
+        for column in ("origin", "destination"):
+            queries.append(
+                select(*_columns(score, column))
+                .where(getattr(Shipment, column) == name)
+                .order_by(Shipment.created_at.desc(), Shipment.id.desc())
+                .limit(limit)
+            )
+    return queries
+
+
+def _tracking_substring_query(query: str, limit: int):
+    """Case-insensitive substring match through the tracking number trigram index."""
+    return (
+        select(*_columns(SCORE_TRACKING_SUBSTRING, "tracking_number"))
+        .where(Shipment.tracking_number.ilike("%" + _escape_like(query) + "%"))
+        .limit(limit)
+    )
+
+
+def _rank(rows, query: str, limit: int) -> List[dict]:
+    """Keep each shipment's best match and order by score, then newest first."""
+    best: Dict[str, dict] = {}
+    for row in rows:
+        hit = dict(row._mapping)
+        if hit["matched"] == "tracking_number" and hit["tracking_number"].casefold() == query.casefold():
+            hit["score"] = SCORE_TRACKING_EXACT
+        current = best.get(hit["id"])
+        if current is None or hit["score"] > current["score"]:
+            best[hit["id"]] = hit
+    hits = sorted(best.values(), key=lambda hit: (hit["created_at"], hit["id"]), reverse=True)
+    hits.sort(key=lambda hit: hit["score"], reverse=True)
+    return hits[:limit]
+
+
+async def search_shipments(db: AsyncSession, query: str, limit: int) -> bytes:
+    """
+    Ranked typeahead search over tracking numbers, origins and destinations.
+
+    Place names are matched in memory against the cached vocabulary of
+    distinct origins and destinations, and the newest shipments of the best
+    few places are read through the existing per-column keyset indexes.
+    Tracking numbers are matched by prefix through a byte-wise btree index,
+    falling back to a trigram substring match when that finds too little.
+    Every lookup is bounded, by the limit or SEARCH_PREFIX_SCAN_LIMIT, so cost
+    does not grow with the number of shipments a popular city or tracking
+    number prefix has. Results are cached per query.
+    """
+    query = normalize_query(query)
+    if not query:
+        return orjson.dumps({"query": query, "places": [], "results": []})
+
+    async def run_search() -> bytes:
+        places = match_places(await _load_places(db), query, settings.search_max_places)
+        lookups = _tracking_prefix_queries(query, limit) + _place_queries(places, limit)
+        rows = list(await db.execute(union_all(*lookups)))
+        tracking_hits = sum(1 for row in rows if row.matched == "tracking_number")
+        if tracking_hits < limit and len(query) >= settings.search_substring_min_length:
+            rows.extend(await db.execute(_tracking_substring_query(query, limit)))
+        return orjson.dumps({
+            "query": query,
+            "places": [name for name, _ in places],
+            "results": _rank(rows, query, limit),
+        })
+
+    digest = hashlib.sha1(f"{query}|{limit}".encode()).hexdigest()
+    key = await cache.versioned_key("shipments", f"search:{digest}")
+    return await cache.get_or_compute(key, run_search, ttl=settings.search_cache_ttl)
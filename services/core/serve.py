@@ -0,0 +1,246 @@
+import logging
+import math
+import multiprocessing
+import os
+import signal
+import socket
+import threading
+import time
+from collections import deque
+from typing import Callable, Deque, List, Optional
+
+import uvicorn
+
+from config import settings
+
+logger = logging.getLogger(__name__)
+
+# Seconds the supervisor waits past SERVER_GRACEFUL_TIMEOUT before killing a worker
+SUPERVISOR_KILL_MARGIN = 5.0
+# Crashed workers are restarted after a delay that doubles with each recent
+# crash, and the service gives up after too many crashes in the window
+SUPERVISOR_RESTART_DELAY = 0.5
+SUPERVISOR_MAX_RESTART_DELAY = 30.0
+SUPERVISOR_CRASH_WINDOW = 60.0
+SUPERVISOR_MAX_CRASHES = 10
+
+_drain_callbacks: List[Callable[[], None]] = []
+_draining = False
+
+
+def on_drain(callback: Callable[[], None]):
+    """Run callback (on the event loop) as soon as this process is asked to shut down."""
+    _drain_callbacks.append(callback)
+
+
+def draining() -> bool:
+    """Whether this process has been asked to shut down and is finishing in-flight requests."""
+    return _draining
+
+
+def _begin_drain():
+    global _draining
+    if _draining:
+        return
+    _draining = True
+    for callback in _drain_callbacks:
+        try:
+            callback()
+        except Exception as e:
+            logger.error(f"Drain callback failed: {e}")
+
+
+class DrainingServer(uvicorn.Server):
+    """
+    uvicorn server that announces the drain before shutting down.
+
+    uvicorn already stops accepting, lets open requests finish for up to
+    SERVER_GRACEFUL_TIMEOUT and then runs the lifespan shutdown, which closes
+    the Redis and DB pools. Drain callbacks run first, so open-ended
+    responses such as event streams end now instead of holding the process
+    until the timeout.
+    """
+
+    def handle_exit(self, sig, frame):
+        _begin_drain()
+        super().handle_exit(sig, frame)
+
+
+def _cgroup_cpu_limit() -> Optional[float]:
+    """The container's CPU quota in CPUs (cgroup v2, then v1), or None if unlimited."""
+    try:
+        with open("/sys/fs/cgroup/cpu.max") as f:
+            quota, period = f.read().split()
+        return None if quota == "max" else int(quota) / int(period)
+    except (OSError, ValueError):
+        pass
+    try:
+        with open("/sys/fs/cgroup/cpu/cpu.cfs_quota_us") as f:
+            quota = int(f.read())
+        with open("/sys/fs/cgroup/cpu/cpu.cfs_period_us") as f:
+            period = int(f.read())
+        return quota / period if quota > 0 and period > 0 else None
+    except (OSError, ValueError):
+        return None
+
+
+def available_cpus() -> int:
+    """CPUs this process may actually use: its affinity mask, capped by the container quota."""
+    try:
+        cpus = len(os.sched_getaffinity(0))
+    except AttributeError:
+        cpus = os.cpu_count() or 1
+    limit = _cgroup_cpu_limit()
+    if limit is not None:
+        cpus = min(cpus, max(1, math.ceil(limit)))
+    return cpus
+
+
+def _installed(module: str) -> bool:
+    try:
+        __import__(module)
+    except ImportError:
+        return False
+    return True
+
+
+def build_config(app: str) -> uvicorn.Config:
+    return uvicorn.Config(
+        app,
+        host=settings.server_host,
+        port=settings.server_port,
+        loop="uvloop" if _installed("uvloop") else "asyncio",
+        http="httptools" if _installed("httptools") else "h11",
+        backlog=settings.server_backlog,
+        timeout_keep_alive=settings.server_keepalive_timeout,
+        timeout_graceful_shutdown=settings.server_graceful_timeout,
+        access_log=settings.server_access_log,
+        lifespan="on",
+    )
+
+
+def _reuse_port_socket(config: uvicorn.Config) -> socket.socket:
+    """A listening socket of this worker's own; the kernel spreads connections across them."""
+    family = socket.AF_INET6 if ":" in config.host else socket.AF_INET
+    sock = socket.socket(family, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+    sock.bind((config.host, config.port))
+    sock.set_inheritable(True)
+    return sock
+
+
+def _run_worker(config: uvicorn.Config, sock: Optional[socket.socket]):
+    config.configure_logging()
+    if sock is None:
+        sock = _reuse_port_socket(config)
+    DrainingServer(config).run(sockets=[sock])
+
+
+class Supervisor:
+    """
+    Runs the worker processes of one service.
+
+    Workers are restarted if they die, after a back-off that grows while
+    they keep crashing; if more than SUPERVISOR_MAX_CRASHES happen within
+    SUPERVISOR_CRASH_WINDOW the service shuts down instead of spinning.
+    SIGTERM or SIGINT is passed on to every worker, which drains on its own;
+    workers still running after SERVER_GRACEFUL_TIMEOUT plus a margin are killed.
+    """
+
+    def __init__(self, config: uvicorn.Config, workers: int, reuse_port: bool):
+        self.config = config
+        self.workers = workers
+        # Without SO_REUSEPORT the workers accept from one inherited socket
+        self.socket = None if reuse_port else config.bind_socket()
+        self.processes: List[Optional[multiprocessing.process.BaseProcess]] = []
+        self.restart_at: List[float] = []
+        self.crashes: Deque[float] = deque()
+        self.should_exit = threading.Event()
+        self._context = multiprocessing.get_context("spawn")
+
+    def _spawn(self):
+        process = self._context.Process(target=_run_worker, args=(self.config, self.socket))
+        process.start()
+        return process
+
+    def _handle_exit(self, sig, frame):
+        self.should_exit.set()
+
+    def restart_delay(self, now: float) -> Optional[float]:
+        """Record a crash; the delay before restarting, or None when crashing too often to go on."""
+        self.crashes.append(now)
+        while self.crashes and self.crashes[0] <= now - SUPERVISOR_CRASH_WINDOW:
+            self.crashes.popleft()
+        if len(self.crashes) > SUPERVISOR_MAX_CRASHES:
+            return None
+        return min(SUPERVISOR_RESTART_DELAY * 2 ** (len(self.crashes) - 1), SUPERVISOR_MAX_RESTART_DELAY)
+
+    def run(self):
+        signal.signal(signal.SIGTERM, self._handle_exit)
+        signal.signal(signal.SIGINT, self._handle_exit)
+        self.processes = [self._spawn() for _ in range(self.workers)]
+        self.restart_at = [0.0] * self.workers
+        failed = False
+        while not self.should_exit.wait(0.5):
+            now = time.monotonic()
+            for index, process in enumerate(self.processes):
+                if process is None:
+                    if now >= self.restart_at[index]:
+                        self.processes[index] = self._spawn()
+                    continue
+                if process.is_alive():
+                    continue
+                delay = self.restart_delay(now)
+                if delay is None:
+                    logger.error(
+                        f"Workers crashed {len(self.crashes)} times in {SUPERVISOR_CRASH_WINDOW:.0f}s; shutting down"
+                    )
+                    failed = True
+                    self.should_exit.set()
+                    break
+                logger.warning(
+                    f"Worker {process.pid} exited with code {process.exitcode}, restarting in {delay:.1f}s"
+                )
+                self.processes[index] = None
+                self.restart_at[index] = now + delay
+        self.shutdown()
+        if failed:
+            raise SystemExit(1)
+
+    def shutdown(self):
+        processes = [process for process in self.processes if process is not None]
+        for process in processes:
+            if process.is_alive():
+                process.terminate()
+        deadline = time.monotonic() + settings.server_graceful_timeout + SUPERVISOR_KILL_MARGIN
+        for process in processes:
+            process.join(max(0.0, deadline - time.monotonic()))
+        for process in processes:
+            if process.is_alive():
+                logger.warning(f"Worker {process.pid} did not drain in time, killing it")
+                process.kill()
+                process.join()
+        if self.socket is not None:
+            self.socket.close()
+
+
+def serve(app: str):
+    """
+    Production entry point: run `app` (an import string such as "main:app").
+
+    Starts SERVER_WORKERS worker processes, one per available CPU when 0,
+    on uvloop and httptools when they are installed. With
+    SERVER_REUSE_PORT each worker listens on its own SO_REUSEPORT socket.
+    """
+    config = build_config(app)
+    workers = settings.server_workers or available_cpus()
+    reuse_port = settings.server_reuse_port and hasattr(socket, "SO_REUSEPORT")
+    logger.info(
+        f"Serving {app} on {config.host}:{config.port} with {workers} worker(s), "
+        f"loop={config.loop} http={config.http} reuse_port={reuse_port}"
+    )
+    if workers == 1:
+        DrainingServer(config).run()
+        return
+    Supervisor(config, workers, reuse_port).run()
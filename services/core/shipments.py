@@ -0,0 +1,178 @@
+import base64
+import csv
+import hashlib
+import io
+from datetime import datetime
+from typing import AsyncIterator, List, Optional, Tuple
+
+import orjson
+from sqlalchemy import func, select, text, tuple_
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from cache import cache
+from database import AsyncReadSessionLocal
+from models import Shipment
+
+
+class InvalidCursorError(ValueError):
+    """Raised when a pagination cursor cannot be decoded."""
+    pass
+
+
+def encode_cursor(created_at: datetime, shipment_id: str) -> str:
+    """Encode the (created_at, id) position of the last row on a page."""
+    raw = f"{created_at.isoformat()}|{shipment_id}".encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+
+def decode_cursor(cursor: str) -> Tuple[datetime, str]:
+    """Decode a cursor produced by encode_cursor."""
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)).decode()
+        created_at, shipment_id = raw.split("|", 1)
+        return datetime.fromisoformat(created_at), shipment_id
+    except (ValueError, UnicodeDecodeError) as exc:
+        raise InvalidCursorError("Invalid pagination cursor") from exc
+
+
+def _filters(status: Optional[str], origin: Optional[str], destination: Optional[str]) -> list:
+    conditions = []
+    if status is not None:
+        conditions.append(Shipment.status == status)
+    if origin is not None:
+        conditions.append(Shipment.origin == origin)
+    if destination is not None:
+        conditions.append(Shipment.destination == destination)
+    return conditions
+
+
+async def list_shipments(
+    db: AsyncSession,
+    limit: int,
+    cursor: Optional[str] = None,
+    status: Optional[str] = None,
+    origin: Optional[str] = None,
+    destination: Optional[str] = None,
+) -> Tuple[List[Shipment], Optional[str]]:
+    """
+    Fetch one page of shipments, newest first, using keyset pagination.
+
+    The page after a cursor is found with a row comparison on
+    (created_at, id), which the composite indexes turn into an index range
+    scan, so deep pages cost the same as the first one.
+
+    Returns:
+        The page of shipments and the cursor for the next page (None on the last page)
+    """
+    query = select(Shipment).where(*_filters(status, origin, destination))
+    if cursor is not None:
+        created_at, shipment_id = decode_cursor(cursor)
+        query = query.where(tuple_(Shipment.created_at, Shipment.id) < tuple_(created_at, shipment_id))
+    query = query.order_by(Shipment.created_at.desc(), Shipment.id.desc()).limit(limit + 1)
+
+    rows = list((await db.execute(query)).scalars())
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        next_cursor = encode_cursor(rows[-1].created_at, rows[-1].id)
+    return rows, next_cursor
+
+
+async def count_shipments(
+    db: AsyncSession,
+    status: Optional[str] = None,
+    origin: Optional[str] = None,
+    destination: Optional[str] = None,
+) -> Tuple[int, bool]:
+    """
+    Cheap total for a shipment listing.
+
+    The unfiltered total comes from the planner's row estimate in pg_class.
+    Filtered totals (and the unfiltered one before the table has been
+    analyzed) are exact counts cached for a minute per filter combination.
+
+    Returns:
+        The total and whether it is an estimate
+    """
+    if status is None and origin is None and destination is None:
+        estimate = (await db.execute(
+            text("SELECT reltuples::bigint FROM pg_class WHERE oid = 'shipments'::regclass")
+        )).scalar()
+        if estimate is not None and estimate >= 0:
+            return estimate, True
+
+    async def exact_count() -> bytes:
+        query = select(func.count()).select_from(Shipment).where(*_filters(status, origin, destination))
+        return str((await db.execute(query)).scalar_one()).encode()
+
+    digest = hashlib.sha1(f"{status}|{origin}|{destination}".encode()).hexdigest()
+    key = await cache.versioned_key("shipments", f"count:{digest}")
+    total = await cache.get_or_compute(key, exact_count, ttl=60)
+    return int(total), False
+
+
+EXPORT_COLUMNS = ("id", "tracking_number", "origin", "destination", "status", "created_at")
+
+
+def encode_page(
+    rows: List[Shipment],
+    total: int,
+    total_is_estimate: bool,
+    next_cursor: Optional[str],
+) -> bytes:
+    """
+    Serialize a page straight to ShipmentListResponse JSON.
+
+    Rows come from our own typed columns, so they are dumped with orjson
+    instead of being validated into pydantic models first.
+    """
+    return orjson.dumps({
+        "shipments": [{name: getattr(row, name) for name in EXPORT_COLUMNS} for row in rows],
+        "total": total,
+        "total_is_estimate": total_is_estimate,
+        "next_cursor": next_cursor,
+    })
+
+
+def _encode_ndjson(rows) -> bytes:
+    return b"".join(orjson.dumps(dict(zip(EXPORT_COLUMNS, row, strict=True))) + b"\n" for row in rows)
+
+
+def _encode_csv(rows) -> bytes:
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    for row in rows:
+        writer.writerow([value.isoformat() if isinstance(value, datetime) else value for value in row])
+    return buffer.getvalue().encode()
+
+
+async def export_shipments(
+    export_format: str,
+    batch_size: int,
+    status: Optional[str] = None,
+    origin: Optional[str] = None,
+    destination: Optional[str] = None,
+) -> AsyncIterator[bytes]:
+    """
+    Stream matching shipments as NDJSON or CSV chunks.
+
+    Rows come from a server-side cursor in fixed-size batches and each batch
+    is encoded into one chunk, so memory stays constant however many rows
+    match. The session is opened here rather than through a dependency
+    because it has to outlive the endpoint function while the body streams.
+    """
+    columns = [getattr(Shipment, name) for name in EXPORT_COLUMNS]
+    query = (
+        select(*columns)
+        .where(*_filters(status, origin, destination))
+        .order_by(Shipment.created_at.desc(), Shipment.id.desc())
+        .execution_options(yield_per=batch_size)
+    )
+    encode = _encode_csv if export_format == "csv" else _encode_ndjson
+
+    if export_format == "csv":
+        yield _encode_csv([EXPORT_COLUMNS])
+    async with AsyncReadSessionLocal() as session:
+        result = await session.stream(query)
+        async for rows in result.partitions(batch_size):
+            yield encode(rows)
@@ -0,0 +1,303 @@
+import asyncio
+import logging
+from collections import deque
+from typing import AsyncIterator, Dict, Iterable, List, Optional, Set
+
+import orjson
+import redis.asyncio as redis
+from sqlalchemy import select
+
+from config import settings
+from database import AsyncReadSessionLocal
+from deadline import cap_timeout
+from metrics import CallbackCounter, CallbackGauge
+from models import Shipment
+
+logger = logging.getLogger(__name__)
+
+# SSE frames. Comments keep idle connections (and every proxy on the way) alive;
+# "resync" tells the client it may have missed updates and should refetch.
+HEARTBEAT = b": keep-alive\n\n"
+RESYNC = b"event: resync\ndata: {}\n\n"
+
+
+class TooManySubscribersError(Exception):
+    """Raised when this process already holds STATUS_STREAM_MAX_SUBSCRIBERS streams."""
+    pass
+
+
+def status_message(shipment: Shipment, location: Optional[str] = None) -> bytes:
+    """The JSON published for a status change, as sent to subscribers."""
+    return orjson.dumps({
+        "tracking_number": shipment.tracking_number,
+        "shipment_id": shipment.id,
+        "status": shipment.status,
+        "status_at": shipment.status_at,
+        "location": location,
+    })
+
+
+def status_frame(data: bytes) -> bytes:
+    return b"event: status\ndata: " + data + b"\n\n"
+
+
+async def current_statuses(tracking_numbers: Iterable[str]) -> List[bytes]:
+    """Status messages for the shipments' current state, read from the latest-status projection."""
+    query = select(Shipment).where(Shipment.tracking_number.in_(list(tracking_numbers)))
+    async with AsyncReadSessionLocal() as db:
+        shipments = (await db.execute(query)).scalars().all()
+    return [status_message(shipment) for shipment in shipments]
+
+
+class Subscription:
+    """
+    One connected stream: a short queue of encoded frames and a waiter.
+
+    Kept deliberately small, since a process may hold tens of thousands of
+    them. Frames are shared bytes objects built once per message, and an idle
+    subscription costs one future and one timer handle.
+    """
+
+    __slots__ = ("tracking_numbers", "pending", "waiter", "overflowed", "closed")
+
+    def __init__(self, tracking_numbers: Set[str]):
+        self.tracking_numbers = tracking_numbers
+        self.pending: deque = deque()
+        self.waiter: Optional[asyncio.Future] = None
+        self.overflowed = False
+        self.closed = False
+
+    def push(self, frame: bytes):
+        if len(self.pending) >= settings.status_stream_queue_size:
+            # A client this far behind is cut off and resyncs on reconnect
+            self.overflowed = True
+        else:
+            self.pending.append(frame)
+        self._wake()
+
+    def _wake(self):
+        if self.waiter is not None and not self.waiter.done():
+            self.waiter.set_result(None)
+
+    async def next(self, timeout: float) -> Optional[bytes]:
+        """The next frame, or None if nothing arrived within timeout."""
+        if not self.pending and not self.overflowed:
+            loop = asyncio.get_running_loop()
+            self.waiter = loop.create_future()
+            handle = loop.call_later(timeout, self._wake)
+            try:
+                await self.waiter
+            finally:
+                handle.cancel()
+                self.waiter = None
+        if self.pending:
+            return self.pending.popleft()
+        return None
+
+
+class StatusBroadcaster:
+    """
+    Fan-out of shipment status changes to server-sent event streams.
+
+    Status changes are published once to a Redis channel. Each process holds
+    a single subscription to it and hands every message to its local streams
+    through an in-memory index by tracking number, so the number of streams
+    never multiplies Redis connections and a message is encoded once no
+    matter how many clients receive it.
+    """
+
+    def __init__(self):
+        self.redis_client: Optional[redis.Redis] = None
+        self._listener: Optional[asyncio.Task] = None
+        self._by_tracking_number: Dict[str, Set[Subscription]] = {}
+        self._everything: Set[Subscription] = set()
+        self.subscribers = 0
+        self.published = 0
+        self.publish_errors = 0
+        self.received = 0
+        self.delivered = 0
+        self.overflows = 0
+        self.closing = False
+
+    async def connect(self):
+        """Connect to Redis and start listening for status changes."""
+        try:
+            self.redis_client = await redis.from_url(settings.redis_url)
+        except Exception as e:
+            logger.error(f"Status stream failed to connect to Redis: {e}")
+            self.redis_client = None
+            return
+        self._listener = asyncio.create_task(self._listen())
+
+    async def disconnect(self):
+        if self._listener:
+            self._listener.cancel()
+            try:
+                await self._listener
+            except asyncio.CancelledError:
+                pass
+            self._listener = None
+        if self.redis_client:
+            await self.redis_client.close()
+
+    async def publish(self, shipment: Shipment, location: Optional[str] = None):
+        """Announce a shipment's new current status; failures are logged, never raised."""
+        if not self.redis_client:
+            return
+        try:
+            # The change is already committed; a slow Redis must not hold the request
+            await asyncio.wait_for(
+                self.redis_client.publish(settings.status_stream_channel, status_message(shipment, location)),
+                cap_timeout(settings.cache_redis_timeout),
+            )
+            self.published += 1
+        except Exception as e:
+            self.publish_errors += 1
+            logger.error(f"Status stream PUBLISH error: {e!r}")
+
+    async def _listen(self):
+        backoff = 1
+        missed = False
+        while True:
+            pubsub = self.redis_client.pubsub(ignore_subscribe_messages=True)
+            try:
+                await pubsub.subscribe(settings.status_stream_channel)
+                backoff = 1
+                if missed:
+                    # Changes published while we were not subscribed are lost
+                    self._broadcast(RESYNC)
+                    missed = False
+                async for message in pubsub.listen():
+                    self._dispatch(message["data"])
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Status stream listener error: {e}")
+                missed = True
+                await asyncio.sleep(backoff)
+                backoff = min(backoff * 2, 30)
+            finally:
+                await pubsub.aclose()
+
+    def _dispatch(self, data: bytes):
+        self.received += 1
+        try:
+            tracking_number = orjson.loads(data)["tracking_number"]
+        except (orjson.JSONDecodeError, KeyError, TypeError):
+            logger.warning("Ignoring malformed status stream message")
+            return
+        frame = status_frame(data)
+        watchers = self._by_tracking_number.get(tracking_number, ())
+        for subscription in watchers:
+            subscription.push(frame)
+        for subscription in self._everything:
+            subscription.push(frame)
+        self.delivered += len(watchers) + len(self._everything)
+
+    def _broadcast(self, frame: bytes):
+        for subscription in set().union(self._everything, *self._by_tracking_number.values()):
+            subscription.push(frame)
+
+    def subscribe(self, tracking_numbers: Iterable[str]) -> Subscription:
+        """
+        Register a stream for the given tracking numbers, or for every shipment if none are given.
+
+        Raises:
+            TooManySubscribersError: This process is at its subscriber limit
+        """
+        if self.closing:
+            raise TooManySubscribersError("Status streams are closing on this instance")
+        if self.subscribers >= settings.status_stream_max_subscribers:
+            raise TooManySubscribersError("Too many status stream subscribers on this instance")
+        subscription = Subscription(set(tracking_numbers))
+        if subscription.tracking_numbers:
+            for tracking_number in subscription.tracking_numbers:
+                self._by_tracking_number.setdefault(tracking_number, set()).add(subscription)
+        else:
+            self._everything.add(subscription)
+        self.subscribers += 1
+        return subscription
+
+    def unsubscribe(self, subscription: Subscription):
+        """Drop a subscription from the fan-out; safe to call more than once."""
+        if subscription.closed:
+            return
+        subscription.closed = True
+        if subscription.tracking_numbers:
+            for tracking_number in subscription.tracking_numbers:
+                subscribers = self._by_tracking_number.get(tracking_number)
+                if subscribers is not None:
+                    subscribers.discard(subscription)
+                    if not subscribers:
+                        del self._by_tracking_number[tracking_number]
+        else:
+            self._everything.discard(subscription)
+        self.subscribers -= 1
+
+    def close_all(self):
+        """
+        End every stream with a resync frame, for a process that is shutting down.
+
+        Clients reconnect (to another instance) and refetch, instead of the
+        streams holding the shutdown open until the graceful timeout.
+        """
+        self.closing = True
+        for subscription in set().union(self._everything, *self._by_tracking_number.values()):
+            subscription.overflowed = True
+            subscription._wake()
+
+    async def stream(self, subscription: Subscription, snapshot: List[bytes]) -> AsyncIterator[bytes]:
+        """
+        SSE body for one subscription: the current statuses, then changes as they happen.
+
+        The subscription is released when the client disconnects, or after a
+        resync frame if the client fell too far behind or the process is
+        shutting down.
+        """
+        try:
+            yield f"retry: {settings.status_stream_retry_ms}\n\n".encode()
+            for data in snapshot:
+                yield status_frame(data)
+            while True:
+                frame = await subscription.next(settings.status_stream_heartbeat_seconds)
+                if subscription.overflowed:
+                    if not self.closing:
+                        self.overflows += 1
+                    yield RESYNC
+                    return
+                yield HEARTBEAT if frame is None else frame
+        finally:
+            self.unsubscribe(subscription)
+
+    def stats(self) -> dict:
+        return {
+            "connected": self.redis_client is not None,
+            "subscribers": self.subscribers,
+            "watched_tracking_numbers": len(self._by_tracking_number),
+            "published": self.published,
+            "publish_errors": self.publish_errors,
+            "received": self.received,
+            "delivered": self.delivered,
+            "overflows": self.overflows,
+        }
+
+
+# Global status broadcaster instance
+status_broadcaster = StatusBroadcaster()
+
+CallbackGauge(
+    "status_stream_subscribers",
+    "Open shipment status streams in this process",
+    (),
+    lambda: {(): status_broadcaster.subscribers},
+)
+CallbackCounter(
+    "status_stream_messages_total",
+    "Status stream messages by stage",
+    ("stage",),
+    lambda: {
+        ("published",): status_broadcaster.published,
+        ("received",): status_broadcaster.received,
+        ("delivered",): status_broadcaster.delivered,
+    },
+)
@@ -0,0 +1,59 @@
+from datetime import datetime, timedelta, timezone
+
+import httpx
+import pytest
+from jose import jwt
+
+import main
+from config import settings
+
+BULK = "/api/v1/shipments/bulk"
+NDJSON = {"content-type": "application/x-ndjson"}
+ROW = b'{"tracking_number": "HX1", "origin": "Jeddah", "destination": "Rotterdam", "status": "PENDING"}\n'
+
+
+def _bearer(role: str, secret: str = None, expires_in: int = 300) -> dict:
+    claims = {"sub": "ops@example.com", "role": role, "exp": datetime.now(timezone.utc) + timedelta(seconds=expires_in)}
+    token = jwt.encode(claims, secret or settings.jwt_secret, algorithm=settings.jwt_algorithm)
+    return {"authorization": f"Bearer {token}"}
+
+
+@pytest.fixture
+async def client():
+    async with httpx.AsyncClient(transport=httpx.ASGITransport(app=main.app), base_url="http://core") as client:
+        yield client
+
+
+@pytest.mark.parametrize(
+    ("headers", "expected"),
+    [
+        ({}, 401),
+        # The gateway's claim header is not trusted on its own
+        ({"x-auth-role": "ADMIN"}, 401),
+        ({"authorization": "Basic b3BzOnB3"}, 401),
+        (_bearer("ADMIN", secret="not-the-secret"), 401),
+        (_bearer("ADMIN", expires_in=-60), 401),
+        (_bearer("USER"), 403),
+        ({"x-admin-token": "wrong"}, 403),
+    ],
+)
+async def test_bulk_ingest_needs_write_access(client, monkeypatch, headers, expected):
+    monkeypatch.setattr(settings, "admin_token", "s3cret")
+    response = await client.post(BULK, content=ROW, headers={**NDJSON, **headers})
+    assert response.status_code == expected
+
+
+@pytest.mark.parametrize("headers", [_bearer("ADMIN"), {"x-admin-token": "s3cret"}])
+async def test_bulk_ingest_with_write_access(db, client, monkeypatch, headers):
+    monkeypatch.setattr(settings, "admin_token", "s3cret")
+    response = await client.post(BULK, content=ROW, headers={**NDJSON, **headers})
+    assert response.status_code == 200
+    assert response.json()["inserted"] == 1
+
+
+@pytest.mark.parametrize(("headers", "expected"), [({"x-auth-role": "ADMIN"}, 401), (_bearer("USER"), 403)])
+async def test_recording_an_event_needs_write_access(client, headers, expected):
+    response = await client.post(
+        "/api/v1/shipments/tracking/HX1/events", json={"status": "DELIVERED"}, headers=headers
+    )
+    assert response.status_code == expected
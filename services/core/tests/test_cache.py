@@ -0,0 +1,195 @@
+import asyncio
+import time
+
+import fakeredis
+import pytest
+
+import cache as cache_module
+from cache import LocalCache, RedisCache
+from config import settings
+
+
+class SlowRedis(fakeredis.aioredis.FakeRedis):
+    async def set(self, *args, **kwargs):
+        await asyncio.sleep(60)
+
+    async def delete(self, *args):
+        await asyncio.sleep(60)
+
+
+async def test_set_and_delete_round_trip():
+    cache = RedisCache()
+    cache.redis_client = fakeredis.aioredis.FakeRedis()
+    assert await cache.set("shipment:1", b"payload")
+    cache.local.clear()
+    assert await cache.get("shipment:1") == b"payload"
+    assert await cache.delete("shipment:1")
+    assert await cache.get("shipment:1") is None
+
+
+async def test_slow_redis_writes_give_up_after_the_timeout(monkeypatch):
+    monkeypatch.setattr(settings, "cache_redis_timeout", 0.05)
+    cache = RedisCache()
+    cache.redis_client = SlowRedis()
+    started = time.monotonic()
+    assert not await cache.set("shipment:1", b"payload")
+    assert not await cache.delete("shipment:1")
+    assert time.monotonic() - started < 1
+    assert cache.l2_errors == 2
+
+
+async def test_delete_pattern_unlinks_matching_keys():
+    cache = RedisCache()
+    cache.redis_client = fakeredis.aioredis.FakeRedis()
+    for index in range(300):
+        await cache.redis_client.set(f"shipments:{index}", b"x")
+    await cache.redis_client.set("users:1", b"x")
+    assert await cache.delete_pattern("shipments:*") == 300
+    assert await cache.redis_client.dbsize() == 1
+
+
+async def test_slow_redis_scan_gives_up_after_the_timeout(monkeypatch):
+    monkeypatch.setattr(settings, "cache_redis_timeout", 0.05)
+
+    class SlowScan(fakeredis.aioredis.FakeRedis):
+        async def scan(self, *args, **kwargs):
+            await asyncio.sleep(60)
+
+    cache = RedisCache()
+    cache.redis_client = SlowScan()
+    started = time.monotonic()
+    assert await cache.delete_pattern("shipments:*") == 0
+    assert time.monotonic() - started < 1
+    assert cache.l2_errors == 1
+
+
+async def test_lock_release_is_bounded(monkeypatch):
+    monkeypatch.setattr(settings, "cache_redis_timeout", 0.05)
+    cache = RedisCache()
+    cache.redis_client = fakeredis.aioredis.FakeRedis()
+
+    async def hang(keys, args):
+        await asyncio.sleep(60)
+
+    cache._release_lock = hang
+
+    async def load() -> bytes:
+        return b"fresh"
+
+    started = time.monotonic()
+    assert await cache.get_or_compute("shipments:list", load) == b"fresh"
+    assert time.monotonic() - started < 1
+
+
+def test_local_cache_evicts_least_recently_used():
+    local = LocalCache(max_entries=2, ttl=60)
+    local.set("a", b"1")
+    local.set("b", b"2")
+    assert local.get("a") == b"1"
+    local.set("c", b"3")
+    assert local.get("b") is None
+    assert local.get("a") == b"1"
+    assert local.stats()["evictions"] == 1
+
+
+def test_local_cache_entries_expire(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(cache_module.time, "monotonic", lambda: now[0])
+    local = LocalCache(max_entries=10, ttl=5)
+    local.set("a", b"1")
+    local.set("b", b"2", expire=1)
+    now[0] += 2
+    assert local.get("b") is None
+    assert local.get("a") == b"1"
+    now[0] += 5
+    assert local.get("a") is None
+
+
+@pytest.fixture
+async def replicas(monkeypatch):
+    server = fakeredis.FakeServer()
+
+    async def from_url(url):
+        return fakeredis.aioredis.FakeRedis(server=server)
+
+    monkeypatch.setattr(cache_module.redis, "from_url", from_url)
+    caches = [RedisCache(), RedisCache()]
+    for cache in caches:
+        await cache.connect()
+    # Let both listeners subscribe before anything is published
+    while await caches[0].redis_client.pubsub_numsub(settings.cache_invalidation_channel) != [
+        (settings.cache_invalidation_channel.encode(), 2)
+    ]:
+        await asyncio.sleep(0.01)
+    yield caches
+    for cache in caches:
+        await cache.disconnect()
+
+
+async def _until(predicate):
+    for _ in range(100):
+        if predicate():
+            return
+        await asyncio.sleep(0.01)
+    raise AssertionError("condition not reached")
+
+
+async def test_writes_drop_other_replicas_l1_copies(replicas):
+    first, second = replicas
+    await first.set("shipment:1", b"old")
+    assert await second.get("shipment:1") == b"old"
+    assert second.local.get("shipment:1") == b"old"
+
+    await first.set("shipment:1", b"new")
+    await _until(lambda: second.local.get("shipment:1") is None)
+    assert await second.get("shipment:1") == b"new"
+
+    await first.delete("shipment:1")
+    await _until(lambda: second.local.get("shipment:1") is None)
+    assert await second.get("shipment:1") is None
+
+
+async def test_concurrent_misses_share_one_computation():
+    cache = RedisCache()
+    cache.redis_client = fakeredis.aioredis.FakeRedis()
+    calls = 0
+
+    async def load() -> bytes:
+        nonlocal calls
+        calls += 1
+        await asyncio.sleep(0.05)
+        return b"fresh"
+
+    results = await asyncio.gather(*(cache.get_or_compute("shipments:list", load) for _ in range(10)))
+    assert results == [b"fresh"] * 10
+    assert calls == 1
+
+
+async def test_only_the_lock_holder_recomputes(replicas, monkeypatch):
+    monkeypatch.setattr(settings, "cache_lock_poll_interval", 0.01)
+    first, second = replicas
+    calls = []
+
+    def loader(name):
+        async def load() -> bytes:
+            calls.append(name)
+            await asyncio.sleep(0.1)
+            return name.encode()
+
+        return load
+
+    leader = asyncio.create_task(first.get_or_compute("shipments:list", loader("first")))
+    await _until(lambda: calls)
+    assert await second.get_or_compute("shipments:list", loader("second")) == b"first"
+    assert await leader == b"first"
+    assert calls == ["first"]
+
+
+def test_early_refresh_grows_likelier_near_expiry(monkeypatch):
+    monkeypatch.setattr(cache_module.random, "random", lambda: 0.5)
+    # No recorded compute time, or no expiry: never refresh early
+    assert not RedisCache._should_refresh_early(10, None)
+    assert not RedisCache._should_refresh_early(-1, b"100")
+    # -100ms * ln(0.5) is about 69ms
+    assert not RedisCache._should_refresh_early(1000, b"100")
+    assert RedisCache._should_refresh_early(50, b"100")
@@ -0,0 +1,52 @@
+import asyncio
+
+import httpx
+import pytest
+from fastapi import FastAPI
+
+from deadline import DEADLINE_HEADER, DeadlineMiddleware, cap_timeout, remaining
+
+app = FastAPI()
+app.add_middleware(DeadlineMiddleware)
+cancelled = []
+
+
+@app.get("/slow")
+async def slow():
+    try:
+        await asyncio.sleep(5)
+    except asyncio.CancelledError:
+        cancelled.append(True)
+        raise
+    return {"done": True}
+
+
+@app.get("/budget")
+async def budget():
+    return {"remaining": remaining(), "capped": cap_timeout(60)}
+
+
+@pytest.fixture
+async def client():
+    cancelled.clear()
+    async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://core") as client:
+        yield client
+
+
+async def test_expired_deadline_cancels_the_handler_with_504(client):
+    response = await client.get("/slow", headers={DEADLINE_HEADER: "50"})
+    assert response.status_code == 504
+    assert cancelled == [True]
+
+
+async def test_handlers_see_the_time_left(client):
+    response = await client.get("/budget", headers={DEADLINE_HEADER: "2000"})
+    left = response.json()
+    assert 0 < left["remaining"] <= 2 and left["capped"] == pytest.approx(left["remaining"], abs=0.05)
+
+
+@pytest.mark.parametrize("value", ["0", "-5", "soon"])
+async def test_unusable_budgets_are_ignored(client, value):
+    response = await client.get("/budget", headers={DEADLINE_HEADER: value})
+    assert response.status_code == 200
+    assert response.json() == {"remaining": None, "capped": 60}
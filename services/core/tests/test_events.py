@@ -0,0 +1,96 @@
+import asyncio
+import time
+from datetime import timedelta
+
+import fakeredis
+import pytest
+from sqlalchemy import select
+
+import events
+from config import settings
+from database import AsyncSessionLocal
+from events import ShipmentNotFoundError, _utcnow, append_event, list_events
+from models import Shipment, ShipmentRollup
+from status_stream import StatusBroadcaster
+
+
+@pytest.fixture
+def published(monkeypatch):
+    """Status changes handed to the broadcaster, with the status other sessions saw at that moment."""
+    seen = []
+
+    async def publish(shipment, location=None):
+        async with AsyncSessionLocal() as session:
+            stored = await session.get(Shipment, shipment.id)
+            seen.append((shipment.status, stored.status, location))
+
+    monkeypatch.setattr(events.status_broadcaster, "publish", publish)
+    return seen
+
+
+async def _shipment(db) -> Shipment:
+    created_at = _utcnow().replace(microsecond=0) - timedelta(hours=2)
+    shipment = Shipment(
+        id="shp_1",
+        tracking_number="HX1",
+        origin="Jeddah",
+        destination="Rotterdam",
+        status="PENDING",
+        created_at=created_at,
+        updated_at=created_at,
+    )
+    db.add(shipment)
+    db.add(ShipmentRollup(day=created_at.date(), origin="Jeddah", destination="Rotterdam", status="PENDING", shipments=1))
+    await db.commit()
+    return shipment
+
+
+async def _rollups(db) -> dict:
+    rows = (await db.execute(select(ShipmentRollup).where(ShipmentRollup.shipments != 0))).scalars()
+    counts = {row.status: row.shipments for row in rows}
+    await db.commit()
+    return counts
+
+
+async def test_current_event_is_published_after_it_commits(db, published):
+    shipment = await _shipment(db)
+    now = _utcnow()
+    event, updated, current = await append_event(db, "HX1", "IN_TRANSIT", "Jeddah", now - timedelta(minutes=5))
+    assert current and updated.status == "IN_TRANSIT"
+    # Subscribers are told only once other sessions can read the new status
+    assert published == [("IN_TRANSIT", "IN_TRANSIT", "Jeddah")]
+    assert await _rollups(db) == {"IN_TRANSIT": 1}
+    assert [stored.id for stored in await list_events(db, shipment.id, 10)] == [event.id]
+
+
+async def test_out_of_order_event_is_kept_without_moving_the_status(db, published):
+    await _shipment(db)
+    now = _utcnow()
+    await append_event(db, "HX1", "IN_TRANSIT", None, now - timedelta(minutes=5))
+    _, updated, current = await append_event(db, "HX1", "PICKED_UP", None, now - timedelta(minutes=30))
+    assert not current and updated.status == "IN_TRANSIT"
+    assert [status for status, _, _ in published] == ["IN_TRANSIT"]
+    assert await _rollups(db) == {"IN_TRANSIT": 1}
+    assert [stored.status for stored in await list_events(db, "shp_1", 10)] == ["IN_TRANSIT", "PICKED_UP"]
+
+
+async def test_unknown_tracking_number_is_rejected(db, published):
+    with pytest.raises(ShipmentNotFoundError):
+        await append_event(db, "HX404", "DELIVERED")
+    assert published == []
+
+
+async def test_slow_redis_publish_is_dropped_after_the_timeout(monkeypatch):
+    monkeypatch.setattr(settings, "cache_redis_timeout", 0.05)
+
+    class SlowRedis(fakeredis.aioredis.FakeRedis):
+        async def publish(self, *args):
+            await asyncio.sleep(60)
+
+    broadcaster = StatusBroadcaster()
+    broadcaster.redis_client = SlowRedis()
+    shipment = Shipment(id="shp_1", tracking_number="HX1", status="DELIVERED")
+    started = time.monotonic()
+    await broadcaster.publish(shipment)
+    assert time.monotonic() - started < 1
+    assert broadcaster.publish_errors == 1 and broadcaster.published == 0
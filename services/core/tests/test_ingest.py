@@ -0,0 +1,89 @@
+import orjson
+import pytest
+from sqlalchemy import func, select
+
+from ingest import UnsupportedFormatError, ingest_shipments
+from models import Shipment
+
+
+async def _stream(data: bytes, chunk_size: int = 4096):
+    for start in range(0, len(data), chunk_size):
+        yield data[start:start + chunk_size]
+
+
+def _ndjson(count: int, start: int = 0) -> bytes:
+    return b"".join(
+        orjson.dumps({
+            "tracking_number": f"HX{index:08d}",
+            "origin": "Jeddah",
+            "destination": "Rotterdam",
+            "status": "PENDING",
+            "created_at": "2026-01-02T03:04:05Z",
+        }) + b"\n"
+        for index in range(start, start + count)
+    )
+
+
+async def _count(db) -> int:
+    return (await db.execute(select(func.count()).select_from(Shipment))).scalar_one()
+
+
+async def test_ndjson_upload_is_inserted_in_batches(db):
+    report = await ingest_shipments("application/x-ndjson", _stream(_ndjson(12000)), 5000, 100, 65536)
+    assert report["received"] == 12000
+    assert report["inserted"] == 12000
+    assert report["failed"] == 0
+    assert await _count(db) == 12000
+
+
+async def test_existing_tracking_numbers_are_reported_as_duplicates(db):
+    await ingest_shipments("application/x-ndjson", _stream(_ndjson(3)), 100, 100, 65536)
+    report = await ingest_shipments("application/x-ndjson", _stream(_ndjson(5)), 100, 100, 65536)
+    assert report["inserted"] == 2
+    assert report["failed"] == 3
+    assert [error["row"] for error in report["errors"]] == [1, 2, 3]
+    assert all(error["error"].startswith("Duplicate shipment:") for error in report["errors"])
+    assert await _count(db) == 5
+
+
+async def test_csv_upload_with_quoted_fields(db):
+    body = (
+        b"tracking_number,origin,destination,status\r\n"
+        b'HX1,"Jeddah, SA",Rotterdam,PENDING\r\n'
+        b'HX2,"Port\nof Spain",Rotterdam,IN_TRANSIT\r\n'
+    )
+    report = await ingest_shipments("text/csv; charset=utf-8", _stream(body, chunk_size=7), 100, 100, 65536)
+    assert report == {"received": 2, "inserted": 2, "failed": 0, "errors": [], "errors_truncated": False}
+    origins = (await db.execute(select(Shipment.origin).order_by(Shipment.tracking_number))).scalars().all()
+    assert origins == ["Jeddah, SA", "Port\nof Spain"]
+
+
+async def test_invalid_rows_are_reported_without_failing_the_batch(db):
+    body = _ndjson(1) + b"not json\n" + b'{"tracking_number": "HX2"}\n' + b"[1, 2]\n"
+    report = await ingest_shipments("application/x-ndjson", _stream(body), 100, 100, 65536)
+    assert report["inserted"] == 1
+    assert [error["row"] for error in report["errors"]] == [2, 3, 4]
+    assert await _count(db) == 1
+
+
+async def test_over_long_lines_are_rejected_without_buffering(db):
+    long_line = b'{"tracking_number": "' + b"X" * 10000 + b'"}'
+    chunks = [_ndjson(1), long_line[:3000], long_line[3000:], b"\n", _ndjson(1, start=1), long_line]
+    report = await ingest_shipments("application/x-ndjson", _stream(b"".join(chunks), chunk_size=1000), 100, 100, 1024)
+    assert report["inserted"] == 2
+    assert report["errors"] == [
+        {"row": 2, "error": "Line longer than 1024 bytes"},
+        {"row": 4, "error": "Line longer than 1024 bytes"},
+    ]
+
+
+async def test_over_long_csv_record_is_rejected(db):
+    body = b"tracking_number,origin,destination,status\n" + b'HX1,"' + b"a\n" * 600 + b'",B,PENDING\nHX2,A,B,PENDING\n'
+    report = await ingest_shipments("text/csv", _stream(body), 100, 100, 1024)
+    assert report["inserted"] == 1
+    assert report["errors"] == [{"row": 1, "error": "Record longer than 1024 bytes"}]
+
+
+async def test_unsupported_content_type_is_rejected():
+    with pytest.raises(UnsupportedFormatError):
+        await ingest_shipments("application/xml", _stream(b"<shipments/>"), 100, 100, 65536)
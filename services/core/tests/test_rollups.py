@@ -0,0 +1,101 @@
+from datetime import date, datetime, timedelta, timezone
+
+import numpy as np
+import orjson
+from sqlalchemy import delete, func, select, update
+
+from ingest import ingest_shipments
+from models import Shipment, ShipmentRollup
+from rollups import aggregate_batch, recompute_rollups, record_status_change, rollup_day
+
+
+async def _stream(data: bytes):
+    yield data
+
+
+async def _rollups(db) -> dict:
+    rows = await db.execute(select(ShipmentRollup).where(ShipmentRollup.shipments != 0))
+    counts = {(row.day, row.origin, row.destination, row.status): row.shipments for row in rows.scalars()}
+    await db.commit()
+    return counts
+
+
+def test_aggregate_batch_counts_each_combination():
+    columns = (np.array([0, 1, 0, 0]), np.array([2, 0, 2, 1]))
+    (first, second), counts = aggregate_batch(columns, (2, 3))
+    assert list(zip(first.tolist(), second.tolist(), counts.tolist(), strict=True)) == [(0, 1, 1), (0, 2, 2), (1, 0, 1)]
+
+
+def test_rollup_day_is_the_utc_date():
+    riyadh = timezone(timedelta(hours=3))
+    assert rollup_day(datetime(2026, 1, 2, 1, 30, tzinfo=riyadh)) == date(2026, 1, 1)
+    assert rollup_day(datetime(2026, 1, 1, 23, 30)) == date(2026, 1, 1)
+
+
+async def test_incremental_rollups_match_a_recompute(db):
+    records = [
+        # Either side of midnight UTC, one given with an offset
+        {"tracking_number": "HX1", "created_at": "2026-01-01T23:30:00Z", "status": "PENDING"},
+        {"tracking_number": "HX2", "created_at": "2026-01-02T01:30:00+03:00", "status": "PENDING"},
+        {"tracking_number": "HX3", "created_at": "2026-01-02T00:30:00Z", "status": "IN_TRANSIT"},
+    ]
+    body = b"".join(orjson.dumps({**r, "origin": "Jeddah", "destination": "Rotterdam"}) + b"\n" for r in records)
+    report = await ingest_shipments("application/x-ndjson", _stream(body), 100, 100, 65536)
+    assert report["inserted"] == 3
+
+    shipment = (await db.execute(select(Shipment).where(Shipment.tracking_number == "HX2"))).scalar_one()
+    shipment.status = "IN_TRANSIT"
+    shipment.updated_at = datetime(2026, 1, 3)
+    await record_status_change(db, shipment, "PENDING")
+    await db.commit()
+
+    incremental = await _rollups(db)
+    assert incremental == {
+        (date(2026, 1, 1), "Jeddah", "Rotterdam", "PENDING"): 1,
+        (date(2026, 1, 1), "Jeddah", "Rotterdam", "IN_TRANSIT"): 1,
+        (date(2026, 1, 2), "Jeddah", "Rotterdam", "IN_TRANSIT"): 1,
+    }
+    result = await recompute_rollups()
+    assert result["shipments_scanned"] == 3
+    assert await _rollups(db) == incremental
+
+
+async def test_unchanged_status_leaves_rollups_alone(db):
+    body = orjson.dumps({"tracking_number": "HX1", "origin": "Jeddah", "destination": "Rotterdam", "status": "PENDING"})
+    await ingest_shipments("application/x-ndjson", _stream(body + b"\n"), 100, 100, 65536)
+    before = await _rollups(db)
+    shipment = (await db.execute(select(Shipment))).scalar_one()
+    await record_status_change(db, shipment, shipment.status)
+    await db.commit()
+    assert await _rollups(db) == before
+
+
+async def test_recompute_corrects_drifted_rollups_in_place(db):
+    body = b"".join(
+        orjson.dumps({
+            "tracking_number": f"HX{index}",
+            "origin": "Jeddah",
+            "destination": "Rotterdam",
+            "status": "PENDING",
+            "created_at": f"2026-01-0{1 + index % 2}T12:00:00Z",
+        }) + b"\n"
+        for index in range(6)
+    )
+    await ingest_shipments("application/x-ndjson", _stream(body), 100, 100, 65536)
+    expected = await _rollups(db)
+    # Counts gone wrong: one too high, one missing, one stray row
+    await db.execute(update(ShipmentRollup).where(ShipmentRollup.day == date(2026, 1, 1)).values(shipments=7))
+    await db.execute(delete(ShipmentRollup).where(ShipmentRollup.day == date(2026, 1, 2)))
+    db.add(ShipmentRollup(day=date(2026, 1, 3), origin="Dubai", destination="Jeddah", status="PENDING", shipments=2))
+    await db.commit()
+
+    result = await recompute_rollups(since=date(2026, 1, 2))
+    assert result["rollup_rows_corrected"] == 2
+    assert await _rollups(db) == {**expected, (date(2026, 1, 1), "Jeddah", "Rotterdam", "PENDING"): 7}
+
+    result = await recompute_rollups()
+    assert result["rollup_rows_corrected"] == 1
+    assert await _rollups(db) == expected
+    # Rows counted down to zero are dropped, not kept at zero
+    remaining = await db.execute(select(func.count()).select_from(ShipmentRollup))
+    assert remaining.scalar_one() == len(expected)
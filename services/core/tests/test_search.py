@@ -0,0 +1,45 @@
+from datetime import datetime, timedelta
+
+import orjson
+
+from cache import cache
+from config import settings
+from models import Shipment
+from search import normalize_query, search_shipments
+
+NEWEST = datetime(2026, 1, 1, 12, 0, 0)
+
+
+def test_normalize_query_collapses_whitespace():
+    assert normalize_query("  Abu   Dh ") == "Abu Dh"
+
+
+async def _add_reversed(db, count: int):
+    # Tracking numbers sort the opposite way to creation time
+    for index in range(count):
+        created_at = NEWEST - timedelta(minutes=index)
+        db.add(Shipment(
+            id=f"shp_{index:04d}",
+            tracking_number=f"HX{99 - index:08d}",
+            origin="Jeddah",
+            destination="Rotterdam",
+            status="PENDING",
+            created_at=created_at,
+            updated_at=created_at,
+        ))
+    await db.commit()
+    cache.local.clear()
+
+
+async def test_tracking_prefix_returns_the_newest_matches(db):
+    await _add_reversed(db, 30)
+    found = orjson.loads(await search_shipments(db, "hx", 5))
+    assert [hit["id"] for hit in found["results"]] == [f"shp_{index:04d}" for index in range(5)]
+
+
+async def test_busy_prefix_ranks_a_bounded_number_of_matches(db, monkeypatch):
+    monkeypatch.setattr(settings, "search_prefix_scan_limit", 10)
+    await _add_reversed(db, 30)
+    found = orjson.loads(await search_shipments(db, "hx", 5))
+    # The newest of the first 10 matches in tracking number order (HX…70 to HX…79)
+    assert [hit["tracking_number"] for hit in found["results"]] == [f"HX{n:08d}" for n in range(79, 74, -1)]
@@ -0,0 +1,85 @@
+from datetime import datetime, timedelta
+
+import pytest
+
+from models import Shipment
+from shipments import InvalidCursorError, decode_cursor, encode_cursor, list_shipments
+
+NEWEST = datetime(2026, 1, 1, 12, 0, 0)
+
+
+def test_cursor_round_trip():
+    created_at = datetime(2026, 3, 4, 5, 6, 7, 890123)
+    assert decode_cursor(encode_cursor(created_at, "shp_|1")) == (created_at, "shp_|1")
+
+
+@pytest.mark.parametrize("cursor", ["", "not base64!", "bm9waXBl"])
+def test_malformed_cursor_is_rejected(cursor):
+    with pytest.raises(InvalidCursorError):
+        decode_cursor(cursor)
+
+
+async def _add_shipments(db, count: int, **overrides):
+    for index in range(count):
+        # Pairs share a created_at, so the id has to break ties
+        created_at = NEWEST - timedelta(minutes=index // 2)
+        values = {
+            "id": f"shp_{index:04d}",
+            "tracking_number": f"HX{index:08d}",
+            "origin": "Jeddah",
+            "destination": "Rotterdam",
+            "status": "IN_TRANSIT" if index % 3 else "PENDING",
+            "created_at": created_at,
+            "updated_at": created_at,
+        }
+        db.add(Shipment(**{**values, **overrides}))
+    await db.commit()
+
+
+async def _walk(db, limit: int, **filters) -> list:
+    seen, cursor, pages = [], None, 0
+    while True:
+        rows, cursor = await list_shipments(db, limit, cursor=cursor, **filters)
+        seen.extend(row.id for row in rows)
+        pages += 1
+        if cursor is None:
+            return seen
+        assert pages < 100
+
+
+async def test_pages_walk_every_shipment_once_newest_first(db):
+    await _add_shipments(db, 25)
+    seen = await _walk(db, 4)
+    assert len(seen) == 25 and len(set(seen)) == 25
+    expected = sorted(
+        (await db.execute(Shipment.__table__.select())).all(),
+        key=lambda row: (row.created_at, row.id),
+        reverse=True,
+    )
+    assert seen == [row.id for row in expected]
+
+
+async def test_last_full_page_has_no_next_cursor(db):
+    await _add_shipments(db, 8)
+    rows, cursor = await list_shipments(db, 8)
+    assert len(rows) == 8 and cursor is None
+
+
+async def test_filtered_pages_only_return_matching_shipments(db):
+    await _add_shipments(db, 30)
+    seen = await _walk(db, 3, status="PENDING")
+    assert len(seen) == 10
+    assert all(int(shipment_id[4:]) % 3 == 0 for shipment_id in seen)
+
+
+async def test_rows_inserted_above_the_cursor_do_not_shift_later_pages(db):
+    await _add_shipments(db, 10)
+    first, cursor = await list_shipments(db, 5)
+    db.add(Shipment(
+        id="shp_new", tracking_number="HXNEW", origin="Jeddah", destination="Rotterdam",
+        status="PENDING", created_at=NEWEST + timedelta(hours=1), updated_at=NEWEST,
+    ))
+    await db.commit()
+    second, _ = await list_shipments(db, 5, cursor=cursor)
+    assert {row.id for row in first}.isdisjoint(row.id for row in second)
+    assert len(first) + len(second) == 10
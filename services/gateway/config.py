@@ -1,7 +1,10 @@
+from typing import Optional
+
 from pydantic_settings import BaseSettings
 
 
 class Settings(BaseSettings):
+    # Comma-separated to list several replicas of a backend
     auth_service_url: str
     core_service_url: str
     frontend_url: str = "http://localhost:3000"
@@ -9,6 +12,108 @@ class Settings(BaseSettings):
     jwt_algorithm: str = "HS256"
     environment: str = "development"
 
+    # Local JWT verification at the edge; requests under the protected
+    # prefixes without a bearer token are rejected unless JWT_REQUIRED=false
+    jwt_protected_prefixes: str = "/api/v1/shipments"
+    jwt_required: bool = True
+    jwt_claims_cache_size: int = 10000
+    jwt_claims_cache_max_ttl: float = 3600.0
+
+    # Stream raw bodies through the proxy instead of decoding/re-encoding JSON
+    proxy_passthrough: bool = True
+
+    # Gateway response cache for idempotent GETs (exact paths, comma-separated)
+    response_cache_enabled: bool = True
+    response_cache_paths: str = "/api/v1/shipments,/api/v1/shipments/search"
+    response_cache_ttl: float = 5.0
+    response_cache_stale_ttl: float = 30.0
+    response_cache_max_bytes: int = 64 * 1024 * 1024
+    response_cache_max_entry_bytes: int = 1024 * 1024
+
+    # Upstream connection pools (shared by all proxied requests)
+    upstream_max_connections: int = 100
+    upstream_max_keepalive_connections: int = 20
+    upstream_keepalive_expiry: float = 30.0
+    upstream_http2: bool = False
+
+    # Replica balancing ("least_outstanding" or "ewma"), retries and circuit breakers
+    upstream_balancer: str = "least_outstanding"
+    upstream_max_retries: int = 1
+    retry_budget_ratio: float = 0.2
+    retry_budget_max_tokens: float = 10.0
+    breaker_failure_threshold: int = 5
+    breaker_open_seconds: float = 5.0
+    breaker_max_open_seconds: float = 60.0
+    outlier_latency_factor: float = 5.0
+    outlier_min_latency: float = 0.25
+
+    # Background health probes of every replica (seconds)
+    health_probe_interval: float = 5.0
+    health_probe_timeout: float = 2.0
+    health_unhealthy_threshold: int = 2
+
+    # Latency budgets in ms, propagated to backends as a deadline. Comma-separated
+    # "prefix=ms" overrides, longest prefix wins; 0 means no deadline (streams, uploads)
+    request_budget_default_ms: int = 10000
+    request_budgets: str = (
+        "/api/v1/auth/login=5000,"
+        "/api/v1/shipments/export=0,"
+        "/api/v1/shipments/bulk=0,"
+        "/api/v1/shipments/stream=0"
+    )
+
+    # Long-lived streams (exact paths, comma-separated) use a separate upstream
+    # pool, so idle subscribers never hold connections regular requests need.
+    # The read timeout only has to outlast the backend's heartbeat interval.
+    stream_paths: str = "/api/v1/shipments/stream"
+    stream_max_connections: int = 10000
+    stream_read_timeout: float = 45.0
+
+    # Per-backend timeouts in seconds (hard caps, also for routes without a budget)
+    auth_connect_timeout: float = 2.0
+    auth_read_timeout: float = 10.0
+    auth_pool_timeout: float = 2.0
+    core_connect_timeout: float = 2.0
+    core_read_timeout: float = 30.0
+    core_pool_timeout: float = 2.0
+
+    # Edge rate limiting; buckets are shared through Redis when redis_url is set
+    redis_url: Optional[str] = None
+    rate_limit_enabled: bool = True
+    rate_limit_ip_per_minute: int = 600
+    rate_limit_user_per_minute: int = 1200
+    rate_limit_login_per_minute: int = 10
+    rate_limit_lease_size: int = 10
+    rate_limit_lease_ttl: float = 1.0
+    rate_limit_max_local_buckets: int = 100000
+    rate_limit_trust_forwarded_for: bool = False
+    # Redis calls give up after this long (seconds) and fall back to local buckets,
+    # which are then used alone for RATE_LIMIT_REDIS_RETRY_SECONDS
+    rate_limit_redis_timeout: float = 0.1
+    rate_limit_redis_retry_seconds: float = 5.0
+
+    # Event-loop lag monitor (seconds); stalls keep the stack of the blocking call
+    loop_lag_interval: float = 0.1
+    loop_lag_stall_threshold: float = 0.1
+    loop_lag_max_stalls: int = 20
+
+    # Production launcher (python main.py); 0 workers means one per available CPU.
+    # Keep-alive outlasts typical load balancer idle timeouts (60s) so they close first;
+    # the graceful timeout fits inside Kubernetes' default 30s termination grace period.
+    server_host: str = "0.0.0.0"
+    server_port: int = 8000
+    server_workers: int = 0
+    server_reuse_port: bool = True
+    server_backlog: int = 2048
+    server_keepalive_timeout: int = 75
+    server_graceful_timeout: float = 20.0
+    server_access_log: bool = False
+
+    # Admin endpoints (/debug/*) are disabled unless a token is set
+    admin_token: Optional[str] = None
+    profile_max_seconds: float = 60.0
+    profile_sample_interval: float = 0.005
+
     class Config:
         env_file = ".env"
         case_sensitive = False
@@ -0,0 +1,55 @@
+import time
+from typing import List, Optional, Tuple
+
+from fastapi import Request
+
+from config import settings
+
+# Milliseconds the caller is still willing to wait. Sent to backends on every
+# attempt (relative, so clocks need not agree); a client may send it to ask
+# for a tighter budget than the route's.
+DEADLINE_HEADER = "x-request-timeout-ms"
+
+
+class DeadlineExceededError(Exception):
+    """Raised when a request's latency budget runs out before the backend answers."""
+    pass
+
+
+def _parse_budgets(value: str) -> List[Tuple[str, int]]:
+    budgets = []
+    for item in value.split(","):
+        prefix, _, budget_ms = item.strip().partition("=")
+        if prefix and budget_ms:
+            budgets.append((prefix.strip(), int(budget_ms)))
+    # Longest prefix wins
+    return sorted(budgets, key=lambda budget: len(budget[0]), reverse=True)
+
+
+ROUTE_BUDGETS = _parse_budgets(settings.request_budgets)
+
+
+def route_budget_ms(path: str) -> int:
+    """Latency budget for a gateway path in ms; 0 means no deadline."""
+    for prefix, budget_ms in ROUTE_BUDGETS:
+        if path.startswith(prefix):
+            return budget_ms
+    return settings.request_budget_default_ms
+
+
+def request_deadline(request: Request) -> Optional[float]:
+    """Monotonic deadline for a proxied request, or None if the route has no budget."""
+    budgets = []
+    route_ms = route_budget_ms(request.url.path)
+    if route_ms > 0:
+        budgets.append(route_ms)
+    try:
+        client_ms = int(request.headers[DEADLINE_HEADER])
+    except (KeyError, ValueError):
+        client_ms = 0
+    # A client may only tighten the budget; zero or negative values are ignored
+    if client_ms > 0:
+        budgets.append(client_ms)
+    if not budgets:
+        return None
+    return time.monotonic() + min(budgets) / 1000
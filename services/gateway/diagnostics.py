@@ -0,0 +1,219 @@
+import asyncio
+import hmac
+import logging
+import sys
+import threading
+import time
+import traceback
+from collections import Counter as StackCounter
+from collections import deque
+from datetime import datetime, timezone
+from typing import Deque, Optional
+
+from fastapi import Header, HTTPException, status
+
+from config import settings
+from metrics import Counter, Histogram
+
+logger = logging.getLogger(__name__)
+
+# Innermost frames kept for each recorded stall
+STALL_STACK_DEPTH = 40
+
+LOOP_LAG = Histogram(
+    "event_loop_lag_seconds",
+    "How late the loop monitor's heartbeat woke up",
+    buckets=(0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0),
+)
+LOOP_STALLS = Counter("event_loop_stalls_total", "Times the event loop was blocked past the stall threshold")
+
+
+class ProfileBusyError(Exception):
+    """Raised when a profile is requested while another one is running."""
+    pass
+
+
+def require_admin(x_admin_token: Optional[str] = Header(None)):
+    """Admin endpoints are hidden unless ADMIN_TOKEN is set, and then need it in X-Admin-Token."""
+    if not settings.admin_token:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Not Found")
+    if x_admin_token is None or not hmac.compare_digest(x_admin_token.encode(), settings.admin_token.encode()):
+        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Invalid admin token")
+
+
+def _describe_task(task: Optional[asyncio.Task]) -> Optional[str]:
+    if task is None:
+        return None
+    coro = task.get_coro()
+    return f"{task.get_name()} ({getattr(coro, '__qualname__', type(coro).__name__)})"
+
+
+class LoopLagMonitor:
+    """
+    Detects callbacks that block the event loop.
+
+    A heartbeat coroutine records how late it wakes up on every tick. A
+    watchdog thread checks when the heartbeat last ran; once the loop has
+    been stuck past the stall threshold it captures the loop thread's stack
+    and running task while the blocking call is still on it. When idle this
+    costs one wakeup per interval on each side.
+    """
+
+    def __init__(self):
+        self.stalls: Deque[dict] = deque(maxlen=settings.loop_lag_max_stalls)
+        self.stall_count = 0
+        self.lag_max = 0.0
+        self._beat = 0.0
+        self._open_stall: Optional[dict] = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._loop_thread_id: Optional[int] = None
+        self._task: Optional[asyncio.Task] = None
+        self._watchdog: Optional[threading.Thread] = None
+        self._stopped = threading.Event()
+
+    async def start(self):
+        """Start the heartbeat on the running loop and the watchdog thread."""
+        if settings.loop_lag_interval <= 0:
+            return
+        self._loop = asyncio.get_running_loop()
+        self._loop_thread_id = threading.get_ident()
+        self._beat = time.monotonic()
+        self._stopped.clear()
+        self._task = asyncio.create_task(self._heartbeat())
+        self._watchdog = threading.Thread(target=self._watch, name="loop-lag-watchdog", daemon=True)
+        self._watchdog.start()
+
+    async def stop(self):
+        self._stopped.set()
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        if self._watchdog:
+            await asyncio.to_thread(self._watchdog.join)
+            self._watchdog = None
+
+    async def _heartbeat(self):
+        interval = settings.loop_lag_interval
+        while True:
+            expected = time.monotonic() + interval
+            await asyncio.sleep(interval)
+            now = time.monotonic()
+            lag = max(0.0, now - expected)
+            self._beat = now
+            LOOP_LAG.observe(lag)
+            self.lag_max = max(self.lag_max, lag)
+            if lag < settings.loop_lag_stall_threshold:
+                continue
+
+            self.stall_count += 1
+            LOOP_STALLS.inc()
+            stall, self._open_stall = self._open_stall, None
+            if stall is None:
+                # Over before the watchdog looked, so there is no stack to show
+                stall = self._stall_record(None, None)
+                self.stalls.append(stall)
+            stall["blocked_ms"] = round(lag * 1000, 1)
+            logger.warning(f"Event loop blocked for {stall['blocked_ms']}ms in {stall['task'] or 'a callback'}")
+
+    def _watch(self):
+        interval = settings.loop_lag_interval
+        reported = None
+        while not self._stopped.wait(interval):
+            beat = self._beat
+            blocked = time.monotonic() - beat - interval
+            if blocked < settings.loop_lag_stall_threshold or beat == reported:
+                continue
+            reported = beat
+            frame = sys._current_frames().get(self._loop_thread_id)
+            try:
+                task = asyncio.current_task(self._loop)
+            except RuntimeError:
+                task = None
+            stall = self._stall_record(frame, task)
+            del frame
+            stall["blocked_ms"] = round(blocked * 1000, 1)
+            self.stalls.append(stall)
+            self._open_stall = stall
+
+    @staticmethod
+    def _stall_record(frame, task: Optional[asyncio.Task]) -> dict:
+        stack = None
+        if frame is not None:
+            stack = [
+                f"{entry.filename}:{entry.lineno} in {entry.name}"
+                for entry in traceback.extract_stack(frame, limit=STALL_STACK_DEPTH)
+            ]
+        return {
+            "detected_at": datetime.now(timezone.utc).isoformat(),
+            "blocked_ms": None,
+            "task": _describe_task(task),
+            "stack": stack,
+        }
+
+    def stats(self) -> dict:
+        return {
+            "running": self._task is not None,
+            "interval_ms": settings.loop_lag_interval * 1000,
+            "stall_threshold_ms": settings.loop_lag_stall_threshold * 1000,
+            "lag_max_ms": round(self.lag_max * 1000, 1),
+            "stalls": self.stall_count,
+            "recent_stalls": list(self.stalls),
+        }
+
+
+def _collapse(frame) -> str:
+    """A stack as "outer;...;inner" frame names, the collapsed format read by flamegraph.pl and speedscope."""
+    names = []
+    while frame is not None:
+        code = frame.f_code
+        names.append(f"{code.co_qualname} ({code.co_filename}:{code.co_firstlineno})")
+        frame = frame.f_back
+    return ";".join(reversed(names))
+
+
+class SamplingProfiler:
+    """
+    On-demand CPU profile of the event-loop thread.
+
+    A helper thread samples the loop thread's stack every
+    PROFILE_SAMPLE_INTERVAL seconds and counts identical stacks. Nothing is
+    sampled between profiles, and only one profile runs at a time.
+    """
+
+    def __init__(self):
+        self.running = False
+        self.profiles = 0
+
+    async def profile(self, seconds: float) -> str:
+        """Sample the calling loop's thread for the given time and return collapsed stacks."""
+        if self.running:
+            raise ProfileBusyError("A profile is already running")
+        self.running = True
+        try:
+            return await asyncio.to_thread(
+                self._sample, threading.get_ident(), seconds, settings.profile_sample_interval
+            )
+        finally:
+            self.running = False
+            self.profiles += 1
+
+    @staticmethod
+    def _sample(thread_id: int, seconds: float, interval: float) -> str:
+        stacks = StackCounter()
+        deadline = time.monotonic() + seconds
+        while time.monotonic() < deadline:
+            frame = sys._current_frames().get(thread_id)
+            if frame is not None:
+                stacks[_collapse(frame)] += 1
+            del frame
+            time.sleep(interval)
+        return "".join(f"{stack} {count}\n" for stack, count in stacks.most_common())
+
+
+# Global diagnostics instances
+loop_monitor = LoopLagMonitor()
+profiler = SamplingProfiler()
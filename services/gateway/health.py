@@ -0,0 +1,141 @@
+import asyncio
+import logging
+import time
+from datetime import datetime, timezone
+from typing import Dict, Optional
+
+from config import settings
+from upstream import Backend, Replica, upstreams
+
+logger = logging.getLogger(__name__)
+
+
+class ProbeResult:
+    """Outcome of the latest health probe against one replica."""
+
+    __slots__ = ("status", "latency_ms", "checked_at", "checked_at_monotonic", "error")
+
+    def __init__(self, status: str, latency_ms: Optional[float], error: Optional[str] = None):
+        self.status = status
+        self.latency_ms = latency_ms
+        self.checked_at = datetime.now(timezone.utc).isoformat()
+        self.checked_at_monotonic = time.monotonic()
+        self.error = error
+
+    def as_dict(self) -> dict:
+        return {
+            "status": self.status,
+            "latency_ms": self.latency_ms,
+            "checked_at": self.checked_at,
+            "error": self.error,
+        }
+
+
+class HealthRegistry:
+    """
+    Probes every backend replica concurrently in the background.
+
+    /health and /ready answer from the latest snapshot instead of probing on
+    each call, and replicas that fail consecutive probes are taken out of
+    routing until a probe succeeds again.
+    """
+
+    def __init__(self):
+        self.results: Dict[str, Dict[str, ProbeResult]] = {}
+        self.rounds = 0
+        self._task: Optional[asyncio.Task] = None
+
+    async def start(self):
+        """Run a first probe round, then keep probing on an interval."""
+        await self.probe_all()
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(settings.health_probe_interval)
+            try:
+                await self.probe_all()
+            except Exception as e:
+                logger.error(f"Health probe round failed: {e}")
+
+    async def probe_all(self):
+        """Probe all replicas of all backends at once."""
+        probes = [
+            self._probe(name, backend, replica)
+            for name, backend in upstreams.backends.items()
+            for replica in backend.replicas
+        ]
+        await asyncio.gather(*probes)
+        self.rounds += 1
+
+    async def _probe(self, name: str, backend: Backend, replica: Replica):
+        started = time.monotonic()
+        try:
+            response = await backend.client.get(f"{replica.base_url}/health", timeout=settings.health_probe_timeout)
+            latency_ms = round((time.monotonic() - started) * 1000, 1)
+            if response.status_code == 200:
+                result = ProbeResult("healthy", latency_ms)
+            else:
+                result = ProbeResult("unhealthy", latency_ms, f"HTTP {response.status_code}")
+        except Exception as e:
+            result = ProbeResult("unreachable", None, str(e) or type(e).__name__)
+        self.results.setdefault(name, {})[replica.base_url] = result
+        replica.record_probe(result.status == "healthy")
+
+    def is_stale(self) -> bool:
+        """Whether the probe loop has stopped producing fresh results."""
+        newest = max(
+            (result.checked_at_monotonic for replicas in self.results.values() for result in replicas.values()),
+            default=None,
+        )
+        return newest is None or time.monotonic() - newest > 3 * settings.health_probe_interval
+
+    def backend_status(self, name: str) -> str:
+        """healthy when all replicas are, degraded when some are, otherwise unhealthy/unreachable."""
+        statuses = [result.status for result in self.results.get(name, {}).values()]
+        if not statuses:
+            return "unknown"
+        if all(status == "healthy" for status in statuses):
+            return "healthy"
+        if "healthy" in statuses:
+            return "degraded"
+        return "unreachable" if "unreachable" in statuses else "unhealthy"
+
+    def snapshot(self) -> dict:
+        """Backend and per-replica status from the latest probe round."""
+        services_status = {}
+        replicas_status = {}
+        for name, backend in upstreams.backends.items():
+            services_status[name] = self.backend_status(name)
+            results = self.results.get(name, {})
+            replicas_status[name] = {
+                replica.base_url: {
+                    **(results[replica.base_url].as_dict() if replica.base_url in results else {"status": "unknown"}),
+                    "circuit": replica.state,
+                    "routable": replica.healthy,
+                }
+                for replica in backend.replicas
+            }
+        return {"backend_services": services_status, "replicas": replicas_status}
+
+    def ready(self) -> bool:
+        """Every backend has at least one replica that is passing probes."""
+        if self.rounds == 0 or self.is_stale():
+            return False
+        return all(
+            any(replica.healthy for replica in backend.replicas)
+            for backend in upstreams.backends.values()
+        )
+
+
+# Global health registry instance
+health_registry = HealthRegistry()
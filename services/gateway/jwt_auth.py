@@ -0,0 +1,176 @@
+import hashlib
+import json
+import logging
+import time
+from collections import OrderedDict
+from typing import Optional, Tuple
+
+from jose import JWTError, jwt
+
+from config import settings
+from metrics import Counter
+
+logger = logging.getLogger(__name__)
+
+# Headers carrying verified claims to backend services. Backends may trust
+# them because the gateway strips any client-supplied copies.
+TRUSTED_CLAIM_HEADERS = {
+    "sub": b"x-auth-subject",
+    "role": b"x-auth-role",
+}
+TRUSTED_HEADER_NAMES = frozenset(TRUSTED_CLAIM_HEADERS.values())
+
+JWT_VERIFICATIONS = Counter("jwt_verifications_total", "Bearer tokens checked at the edge", ("result",))
+JWT_CACHED = JWT_VERIFICATIONS.labels("cached")
+JWT_VALID = JWT_VERIFICATIONS.labels("valid")
+JWT_INVALID = JWT_VERIFICATIONS.labels("invalid")
+
+
+class ClaimsCache:
+    """Bounded LRU of decoded JWT claims, keyed by token digest and expiring at the token's exp."""
+
+    def __init__(self, max_size: int, max_ttl: float):
+        self.max_size = max_size
+        self.max_ttl = max_ttl
+        self._entries: "OrderedDict[bytes, Tuple[dict, float]]" = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    @staticmethod
+    def key(token: str) -> bytes:
+        return hashlib.sha256(token.encode()).digest()
+
+    def get(self, key: bytes) -> Optional[dict]:
+        entry = self._entries.get(key)
+        if entry is None:
+            self.misses += 1
+            return None
+        claims, expires_at = entry
+        if expires_at <= time.time():
+            del self._entries[key]
+            self.misses += 1
+            return None
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return claims
+
+    def put(self, key: bytes, claims: dict):
+        now = time.time()
+        expires_at = now + self.max_ttl
+        exp = claims.get("exp")
+        if isinstance(exp, (int, float)):
+            expires_at = min(expires_at, exp)
+        if expires_at <= now:
+            return
+        self._entries[key] = (claims, expires_at)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+    def stats(self) -> dict:
+        return {
+            "size": len(self._entries),
+            "max_size": self.max_size,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+        }
+
+
+claims_cache = ClaimsCache(settings.jwt_claims_cache_size, settings.jwt_claims_cache_max_ttl)
+
+
+def verify_token(token: str) -> Optional[dict]:
+    """Verify a JWT locally, answering repeat tokens from the claims cache."""
+    key = ClaimsCache.key(token)
+    claims = claims_cache.get(key)
+    if claims is not None:
+        JWT_CACHED.inc()
+        return claims
+    try:
+        claims = jwt.decode(token, settings.jwt_secret, algorithms=[settings.jwt_algorithm])
+    except JWTError:
+        JWT_INVALID.inc()
+        return None
+    JWT_VALID.inc()
+    claims_cache.put(key, claims)
+    return claims
+
+
+def _bearer_token(authorization: bytes) -> Optional[str]:
+    scheme, _, token = authorization.decode("latin-1").partition(" ")
+    if scheme.lower() != "bearer" or not token.strip():
+        return None
+    return token.strip()
+
+
+class JWTAuthMiddleware:
+    """
+    Verify bearer tokens at the edge for protected path prefixes.
+
+    Client-supplied trusted claim headers are always stripped. For protected
+    prefixes a valid token adds the verified claims as trusted headers (and to
+    request.state.claims); an invalid token is rejected with 401 before the
+    request reaches a backend.
+    """
+
+    def __init__(self, app):
+        self.app = app
+        self.protected_prefixes = tuple(
+            prefix.strip() for prefix in settings.jwt_protected_prefixes.split(",") if prefix.strip()
+        )
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        headers = []
+        authorization = None
+        for name, value in scope["headers"]:
+            if name in TRUSTED_HEADER_NAMES:
+                continue
+            if name == b"authorization":
+                authorization = value
+            headers.append((name, value))
+        scope["headers"] = headers
+
+        if not scope["path"].startswith(self.protected_prefixes):
+            await self.app(scope, receive, send)
+            return
+
+        if authorization is None:
+            if settings.jwt_required:
+                await self._reject(send, "Missing bearer token")
+                return
+            await self.app(scope, receive, send)
+            return
+
+        token = _bearer_token(authorization)
+        claims = verify_token(token) if token else None
+        if claims is None:
+            await self._reject(send, "Invalid or expired token")
+            return
+
+        for claim, header in TRUSTED_CLAIM_HEADERS.items():
+            value = claims.get(claim)
+            if value is not None:
+                headers.append((header, str(value).encode("latin-1", "replace")))
+        scope.setdefault("state", {})["claims"] = claims
+        await self.app(scope, receive, send)
+
+    @staticmethod
+    async def _reject(send, message: str):
+        body = json.dumps({"error": "Unauthorized", "message": message}).encode()
+        await send({
+            "type": "http.response.start",
+            "status": 401,
+            "headers": [
+                (b"content-type", b"application/json"),
+                (b"content-length", str(len(body)).encode()),
+                (b"www-authenticate", b"Bearer"),
+            ],
+        })
+        await send({"type": "http.response.body", "body": body})
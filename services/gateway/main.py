@@ -1,20 +1,59 @@
-from fastapi import FastAPI, Request, HTTPException, status
+from fastapi import FastAPI, Request, HTTPException, Depends, Query, status
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import JSONResponse
+from fastapi.responses import JSONResponse, ORJSONResponse, Response, StreamingResponse
+from starlette.background import BackgroundTask
+from contextlib import asynccontextmanager
 import httpx
+from typing import Optional
 from config import settings
+from metrics import CONTENT_TYPE, MetricsMiddleware, generate_latest
+from diagnostics import ProfileBusyError, loop_monitor, profiler, require_admin
+from upstream import NoHealthyReplicaError, upstreams
+from health import health_registry
+from deadline import DeadlineExceededError, request_deadline
+from jwt_auth import JWTAuthMiddleware, TRUSTED_HEADER_NAMES
+from serve import draining
+from rate_limit import RateLimitMiddleware, rate_limiter
+from response_cache import CachedResponse, ResponseCache, response_cache
 import logging
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """Lifespan context manager for startup and shutdown events."""
+    # Startup
+    await loop_monitor.start()
+    await upstreams.startup()
+    await health_registry.start()
+    await rate_limiter.connect()
+    logger.info("Gateway started")
+    yield
+    # Shutdown
+    await rate_limiter.disconnect()
+    await health_registry.stop()
+    await upstreams.shutdown()
+    await loop_monitor.stop()
+    logger.info("Gateway stopped")
+
+
 app = FastAPI(
     title="HarborX API Gateway",
     description="Central API Gateway for HarborX Microservices",
     version="1.0.0",
+    lifespan=lifespan,
+    default_response_class=ORJSONResponse,
 )
 
+# Shed abusive traffic before it is proxied; runs inside JWTAuthMiddleware so per-user limits see verified claims
+app.add_middleware(RateLimitMiddleware)
+
+# Verify bearer tokens locally; registered before CORS so rejections still carry CORS headers
+app.add_middleware(JWTAuthMiddleware)
+
 # CORS Configuration
 # Allow gateway and frontend origins
 # SECURITY: Use environment variables for production origins
@@ -34,6 +73,9 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# Outermost, so rejections by the other middleware are measured too
+app.add_middleware(MetricsMiddleware)
+
 
 class ServiceUnavailableError(Exception):
     """Raised when a backend service is unavailable."""
@@ -53,6 +95,19 @@ async def service_unavailable_handler(request: Request, exc: ServiceUnavailableE
     )
 
 
+@app.exception_handler(DeadlineExceededError)
+async def deadline_exceeded_handler(request: Request, exc: DeadlineExceededError):
+    """Give up on a request once its latency budget is spent."""
+    return JSONResponse(
+        status_code=status.HTTP_504_GATEWAY_TIMEOUT,
+        content={
+            "error": "Gateway Timeout",
+            "message": "The backend service did not respond in time.",
+            "detail": str(exc)
+        }
+    )
+
+
 @app.exception_handler(httpx.RequestError)
 async def request_error_handler(request: Request, exc: httpx.RequestError):
     """Handle HTTP request errors."""
@@ -86,97 +141,335 @@ async def http_status_error_handler(request: Request, exc: httpx.HTTPStatusError
     )
 
 
-async def forward_request(service_url: str, path: str, request: Request):
+# Headers copied between client and backend in passthrough mode.
+# Hop-by-hop headers (connection, transfer-encoding, ...) are never forwarded.
+FORWARDED_REQUEST_HEADERS = (
+    "accept",
+    "accept-encoding",
+    "accept-language",
+    "authorization",
+    "content-encoding",
+    "content-length",
+    "content-type",
+    "if-modified-since",
+    "if-none-match",
+    "user-agent",
+    "x-request-id",
+    *(name.decode() for name in sorted(TRUSTED_HEADER_NAMES)),
+)
+FORWARDED_RESPONSE_HEADERS = (
+    "cache-control",
+    "content-disposition",
+    "content-encoding",
+    "content-length",
+    "content-type",
+    "etag",
+    "last-modified",
+    "location",
+    "retry-after",
+    "vary",
+    "www-authenticate",
+    "x-accel-buffering",
+    "x-request-id",
+)
+
+
+def _has_body(request: Request) -> bool:
+    """Whether the client sent a request body."""
+    content_length = request.headers.get("content-length")
+    if content_length is not None:
+        return content_length != "0"
+    return "transfer-encoding" in request.headers
+
+
+async def stream_request(
+    service: str, path: str, request: Request, deadline: Optional[float] = None, long_lived: bool = False
+):
+    """
+    Proxy request to a backend service without parsing either body.
+
+    The raw request body is streamed upstream and the upstream response is
+    relayed chunk by chunk, so memory use stays constant for large payloads.
+    Status code and allow-listed headers are preserved.
+
+    Args:
+        service: Name of the backend service ("auth" or "core")
+        path: Path to forward to
+        request: Original request
+        deadline: Monotonic deadline for the response headers, if any
+        long_lived: Relay an open-ended stream (SSE) through the stream pool
+
+    Returns:
+        Streaming response relaying the backend response
+    """
+    backend = upstreams.get(service)
+    if backend is None:
+        raise ServiceUnavailableError(f"Unknown backend service: {service}")
+
+    headers = {}
+    for name in FORWARDED_REQUEST_HEADERS:
+        value = request.headers.get(name)
+        if value is not None:
+            headers[name] = value
+    # Without this httpx would ask for gzip on the client's behalf
+    headers.setdefault("accept-encoding", "identity")
+
+    try:
+        upstream_response, replica = await backend.request(
+            request.method,
+            path,
+            stream=True,
+            deadline=deadline,
+            long_lived=long_lived,
+            params=request.query_params,
+            headers=headers,
+            content=request.stream() if _has_body(request) else None,
+        )
+    except (httpx.RequestError, NoHealthyReplicaError) as exc:
+        logger.error(f"Request to {service}{path} failed: {exc}")
+        raise ServiceUnavailableError("Failed to connect to backend service") from exc
+
+    closed = False
+
+    async def close():
+        nonlocal closed
+        if not closed:
+            closed = True
+            await upstream_response.aclose()
+            if long_lived:
+                backend.end_stream(replica)
+            else:
+                backend.release(replica)
+
+    async def relay():
+        try:
+            async for chunk in upstream_response.aiter_raw():
+                yield chunk
+                if long_lived and draining():
+                    # Streams never finish on their own; end them at the next
+                    # chunk (at most a heartbeat away) so shutdown is not held up
+                    break
+        finally:
+            await close()
+
+    response_headers = {}
+    for name in FORWARDED_RESPONSE_HEADERS:
+        value = upstream_response.headers.get(name)
+        if value is not None:
+            response_headers[name] = value
+
+    return StreamingResponse(
+        relay(),
+        status_code=upstream_response.status_code,
+        headers=response_headers,
+        background=BackgroundTask(close),
+    )
+
+
+async def forward_json_request(service: str, path: str, request: Request, deadline: Optional[float] = None):
     """
-    Forward request to a backend service.
+    Forward request to a backend service, decoding and re-encoding JSON bodies.
     
     Args:
-        service_url: Base URL of the service
+        service: Name of the backend service ("auth" or "core")
         path: Path to forward to
         request: Original request
+        deadline: Monotonic deadline for the backend response, if any
     
     Returns:
         Response from the backend service
     """
-    url = f"{service_url}{path}"
+    backend = upstreams.get(service)
+    if backend is None:
+        raise ServiceUnavailableError(f"Unknown backend service: {service}")
     
-    # Prepare headers (forward Authorization if present)
+    # Prepare headers (forward Authorization and verified claims if present)
     headers = {}
     if "authorization" in request.headers:
         headers["authorization"] = request.headers["authorization"]
+    for name in TRUSTED_HEADER_NAMES:
+        value = request.headers.get(name.decode())
+        if value is not None:
+            headers[name.decode()] = value
     
-    async with httpx.AsyncClient(timeout=30.0) as client:
-        try:
-            if request.method == "GET":
-                response = await client.get(url, headers=headers, params=request.query_params)
-            elif request.method == "POST":
-                body = await request.json() if request.headers.get("content-type") == "application/json" else None
-                response = await client.post(url, headers=headers, json=body)
-            elif request.method == "PUT":
-                body = await request.json() if request.headers.get("content-type") == "application/json" else None
-                response = await client.put(url, headers=headers, json=body)
-            elif request.method == "DELETE":
-                response = await client.delete(url, headers=headers)
-            else:
-                raise HTTPException(status_code=405, detail="Method not allowed")
-            
-            response.raise_for_status()
-            return response.json()
-        
-        except httpx.RequestError as exc:
-            logger.error(f"Request to {url} failed: {exc}")
-            raise ServiceUnavailableError(f"Failed to connect to backend service")
-        
-        except httpx.HTTPStatusError as exc:
-            logger.error(f"HTTP error from {url}: {exc}")
-            raise
+    if request.method == "GET":
+        kwargs = {"params": request.query_params}
+    elif request.method in ("POST", "PUT", "PATCH"):
+        body = await request.json() if request.headers.get("content-type") == "application/json" else None
+        kwargs = {"json": body}
+    elif request.method == "DELETE":
+        kwargs = {}
+    else:
+        raise HTTPException(status_code=405, detail="Method not allowed")
+
+    try:
+        response, _ = await backend.request(request.method, path, deadline=deadline, headers=headers, **kwargs)
+        response.raise_for_status()
+        return response.json()
+
+    except (httpx.RequestError, NoHealthyReplicaError) as exc:
+        logger.error(f"Request to {service}{path} failed: {exc}")
+        raise ServiceUnavailableError("Failed to connect to backend service") from exc
+
+    except httpx.HTTPStatusError as exc:
+        logger.error(f"HTTP error from {service}{path}: {exc}")
+        raise
+
+
+CACHED_RESPONSE_PATHS = frozenset(
+    path.strip() for path in settings.response_cache_paths.split(",") if path.strip()
+)
+STREAM_PATHS = frozenset(path.strip() for path in settings.stream_paths.split(",") if path.strip())
+
+
+async def fetch_buffered(
+    service: str, path: str, params, headers: dict, deadline: Optional[float] = None
+) -> CachedResponse:
+    """Fetch a GET response from a backend and buffer it for the response cache."""
+    backend = upstreams.get(service)
+    if backend is None:
+        raise ServiceUnavailableError(f"Unknown backend service: {service}")
+
+    try:
+        response, _ = await backend.request("GET", path, deadline=deadline, params=params, headers=headers)
+    except (httpx.RequestError, NoHealthyReplicaError) as exc:
+        logger.error(f"Request to {service}{path} failed: {exc}")
+        raise ServiceUnavailableError("Failed to connect to backend service") from exc
+
+    # The body is already decoded and re-framed, so encoding and length are not copied
+    response_headers = {}
+    for name in FORWARDED_RESPONSE_HEADERS:
+        if name in ("content-encoding", "content-length", "etag"):
+            continue
+        value = response.headers.get(name)
+        if value is not None:
+            response_headers[name] = value
+    return CachedResponse(response.status_code, response_headers, response.content, response.headers.get("etag"))
+
+
+async def serve_cached(service: str, path: str, request: Request, deadline: Optional[float] = None):
+    """Serve an idempotent GET through the gateway response cache."""
+    headers = {"accept-encoding": "identity"}
+    for name in FORWARDED_REQUEST_HEADERS:
+        if name in ("accept-encoding", "if-none-match", "if-modified-since"):
+            continue
+        value = request.headers.get(name)
+        if value is not None:
+            headers[name] = value
+    params = request.query_params
+
+    return await response_cache.serve(
+        ResponseCache.key(request),
+        request,
+        lambda: fetch_buffered(service, path, params, headers, deadline),
+    )
+
+
+async def forward_request(service: str, path: str, request: Request):
+    """Forward request to a backend service using the configured proxy mode and route budget."""
+    deadline = request_deadline(request)
+    if path in STREAM_PATHS:
+        # Never buffered, whatever the proxy mode
+        return await stream_request(service, path, request, deadline, long_lived=True)
+    if request.method == "GET" and settings.response_cache_enabled and path in CACHED_RESPONSE_PATHS:
+        return await serve_cached(service, path, request, deadline)
+    if settings.proxy_passthrough or request.method in ("HEAD", "OPTIONS"):
+        # HEAD and OPTIONS have no JSON to re-encode; relay them as they are in either mode
+        return await stream_request(service, path, request, deadline)
+    return await forward_json_request(service, path, request, deadline)
 
 
 @app.get("/health")
 async def health_check():
-    """Gateway health check endpoint."""
-    # Check if backend services are reachable
-    services_status = {}
-    
-    async with httpx.AsyncClient(timeout=5.0) as client:
-        # Check auth service
-        try:
-            auth_response = await client.get(f"{settings.auth_service_url}/health")
-            services_status["auth"] = "healthy" if auth_response.status_code == 200 else "unhealthy"
-        except:
-            services_status["auth"] = "unreachable"
-        
-        # Check core service
-        try:
-            core_response = await client.get(f"{settings.core_service_url}/health")
-            services_status["core"] = "healthy" if core_response.status_code == 200 else "unhealthy"
-        except:
-            services_status["core"] = "unreachable"
-    
-    overall_status = "healthy" if all(s == "healthy" for s in services_status.values()) else "degraded"
+    """Gateway health check endpoint, answered from the background probe snapshot."""
+    snapshot = health_registry.snapshot()
+    services_status = snapshot["backend_services"]
+    if health_registry.is_stale():
+        overall_status = "unknown"
+    elif all(s == "healthy" for s in services_status.values()):
+        overall_status = "healthy"
+    else:
+        overall_status = "degraded"
     
     return {
         "status": overall_status,
         "service": "gateway",
         "version": "1.0.0",
-        "backend_services": services_status
+        **snapshot,
     }
 
 
+@app.get("/ready")
+async def readiness_check():
+    """Readiness for load balancers: 503 unless every backend has a replica passing probes."""
+    ready = health_registry.ready()
+    return JSONResponse(
+        status_code=status.HTTP_200_OK if ready else status.HTTP_503_SERVICE_UNAVAILABLE,
+        content={"ready": ready, "backend_services": health_registry.snapshot()["backend_services"]},
+    )
+
+
+@app.get("/health/upstreams")
+async def upstream_pool_stats():
+    """Connection pool usage and saturation for each backend."""
+    return {"upstreams": upstreams.stats()}
+
+
+@app.get("/health/cache")
+async def response_cache_stats():
+    """Gateway response cache usage."""
+    return {"response_cache": response_cache.stats()}
+
+
+@app.get("/health/rate-limit")
+async def rate_limit_stats():
+    """Rate limiter decisions and Redis usage."""
+    return {"rate_limit": rate_limiter.stats()}
+
+
+@app.get("/metrics", include_in_schema=False)
+async def metrics():
+    """Prometheus metrics for this process."""
+    return Response(content=generate_latest(), media_type=CONTENT_TYPE)
+
+
+@app.get("/debug/loop-lag", dependencies=[Depends(require_admin)], include_in_schema=False)
+async def loop_lag_stats():
+    """Event-loop lag and the stacks captured for recent stalls (admin only)."""
+    return {"loop_lag": loop_monitor.stats()}
+
+
+@app.get("/debug/profile", dependencies=[Depends(require_admin)], include_in_schema=False)
+async def cpu_profile(seconds: float = Query(10.0, gt=0, le=settings.profile_max_seconds)):
+    """
+    Sample the event loop for N seconds and return collapsed stacks (admin only).
+
+    The output feeds flamegraph.pl or speedscope directly.
+    """
+    try:
+        stacks = await profiler.profile(seconds)
+    except ProfileBusyError as exc:
+        raise HTTPException(status_code=409, detail=str(exc)) from exc
+    return Response(content=stacks, media_type="text/plain; charset=utf-8")
+
+
+PROXY_METHODS = ["GET", "HEAD", "OPTIONS", "POST", "PUT", "PATCH", "DELETE"]
+
+
 # Auth routes - Forward to auth service
-@app.api_route("/api/v1/auth/{path:path}", methods=["GET", "POST", "PUT", "DELETE"])
+@app.api_route("/api/v1/auth/{path:path}", methods=PROXY_METHODS)
 async def auth_proxy(path: str, request: Request):
     """Forward authentication requests to auth service."""
-    return await forward_request(settings.auth_service_url, f"/api/v1/auth/{path}", request)
+    return await forward_request("auth", f"/api/v1/auth/{path}", request)
 
 
 # Core routes - Forward to core service
-@app.api_route("/api/v1/shipments{path:path}", methods=["GET", "POST", "PUT", "DELETE"])
+@app.api_route("/api/v1/shipments{path:path}", methods=PROXY_METHODS)
 async def core_proxy(path: str, request: Request):
     """Forward core business logic requests to core service."""
-    return await forward_request(settings.core_service_url, f"/api/v1/shipments{path}", request)
+    return await forward_request("core", f"/api/v1/shipments{path}", request)
 
 
 if __name__ == "__main__":
-    import uvicorn
-    uvicorn.run(app, host="0.0.0.0", port=8000)
+    from serve import serve
+    serve("main:app")
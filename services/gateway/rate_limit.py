@@ -0,0 +1,275 @@
+import asyncio
+import heapq
+import json
+import logging
+import math
+import time
+from typing import Dict, List, Optional, Tuple
+
+import redis.asyncio as redis
+
+from config import settings
+from metrics import CallbackCounter
+
+logger = logging.getLogger(__name__)
+
+# Pruning a full bucket table evicts down to this share of RATE_LIMIT_MAX_LOCAL_BUCKETS
+LOCAL_BUCKETS_PRUNED_TO = 0.9
+
+# Token bucket shared by all gateway replicas. Instead of one token per
+# call, a replica leases up to ARGV[4] tokens at once and spends them
+# locally, so most decisions need no Redis round-trip.
+# Returns {granted, retry_after_ms}.
+LEASE_TOKENS_SCRIPT = """
+local capacity = tonumber(ARGV[1])
+local rate = tonumber(ARGV[2])
+local now = tonumber(ARGV[3])
+local requested = tonumber(ARGV[4])
+local state = redis.call("HMGET", KEYS[1], "tokens", "ts")
+local tokens = tonumber(state[1]) or capacity
+local ts = tonumber(state[2]) or now
+tokens = math.min(capacity, tokens + math.max(0, now - ts) * rate / 1000)
+local granted = math.min(requested, math.floor(tokens))
+tokens = tokens - granted
+redis.call("HSET", KEYS[1], "tokens", tokens, "ts", now)
+redis.call("PEXPIRE", KEYS[1], math.ceil(capacity / rate * 1000) + 1000)
+local retry_after = 0
+if granted == 0 then
+    retry_after = math.ceil((1 - tokens) / rate * 1000)
+end
+return {granted, retry_after}
+"""
+
+
+class Rule:
+    """A token bucket limit: `capacity` requests per `period` seconds."""
+
+    def __init__(self, name: str, capacity: int, period: float):
+        self.name = name
+        self.capacity = capacity
+        self.rate = capacity / period  # tokens per second
+        # Small buckets lease one token at a time to stay accurate across replicas
+        self.lease_size = max(1, min(settings.rate_limit_lease_size, capacity // 10))
+
+
+class LocalBucket:
+    """Tokens leased from Redis (or, without Redis, refilled locally)."""
+
+    __slots__ = ("tokens", "expires_at", "blocked_until", "updated_at")
+
+    def __init__(self):
+        self.tokens = 0.0
+        self.expires_at = 0.0
+        self.blocked_until = 0.0
+        self.updated_at = time.monotonic()
+
+
+class RateLimiter:
+    """Token bucket rate limiting per IP, per user and per route, backed by Redis."""
+
+    def __init__(self):
+        self.redis_client: Optional[redis.Redis] = None
+        self._lease_script = None
+        self._buckets: Dict[str, LocalBucket] = {}
+        self.ip_rule = Rule("ip", settings.rate_limit_ip_per_minute, 60)
+        self.user_rule = Rule("user", settings.rate_limit_user_per_minute, 60)
+        self.route_rules: List[Tuple[str, Rule]] = [
+            ("/api/v1/auth/login", Rule("login", settings.rate_limit_login_per_minute, 60)),
+        ]
+        self.allowed = 0
+        self.limited = 0
+        self.redis_calls = 0
+        self.redis_errors = 0
+        self._redis_down_until = 0.0
+
+    async def connect(self):
+        """Connect to Redis; without it limits are enforced per replica only."""
+        if not settings.redis_url:
+            logger.warning("REDIS_URL not set; rate limits are enforced per gateway replica")
+            return
+        try:
+            self.redis_client = redis.from_url(
+                settings.redis_url,
+                socket_timeout=settings.rate_limit_redis_timeout,
+                socket_connect_timeout=settings.rate_limit_redis_timeout,
+            )
+            self._lease_script = self.redis_client.register_script(LEASE_TOKENS_SCRIPT)
+            logger.info("Rate limiter connected to Redis")
+        except Exception as e:
+            logger.error(f"Failed to connect rate limiter to Redis: {e}")
+            self.redis_client = None
+
+    async def disconnect(self):
+        if self.redis_client:
+            await self.redis_client.aclose()
+            self.redis_client = None
+
+    def rules_for(self, path: str, client_ip: str, user: Optional[str]) -> List[Tuple[str, Rule]]:
+        """The (bucket key, rule) pairs that apply to one request."""
+        checks = [(f"ip:{client_ip}", self.ip_rule)]
+        if user:
+            checks.append((f"user:{user}", self.user_rule))
+        for prefix, rule in self.route_rules:
+            if path.startswith(prefix):
+                checks.append((f"{rule.name}:{client_ip}", rule))
+        return checks
+
+    async def check(self, path: str, client_ip: str, user: Optional[str]) -> float:
+        """
+        Spend one token from every bucket that applies to this request.
+
+        Returns:
+            0 if the request is allowed, otherwise seconds until it may be retried
+        """
+        for key, rule in self.rules_for(path, client_ip, user):
+            retry_after = await self._take(key, rule)
+            if retry_after > 0:
+                self.limited += 1
+                return retry_after
+        self.allowed += 1
+        return 0.0
+
+    async def _take(self, key: str, rule: Rule) -> float:
+        now = time.monotonic()
+        bucket = self._buckets.get(key)
+        if bucket is None:
+            if len(self._buckets) >= settings.rate_limit_max_local_buckets:
+                self._prune(now)
+            bucket = self._buckets[key] = LocalBucket()
+
+        if bucket.blocked_until > now:
+            return bucket.blocked_until - now
+
+        if self.redis_client is None or self._redis_down_until > now:
+            return self._take_locally(bucket, rule, now)
+
+        if bucket.tokens >= 1 and bucket.expires_at > now:
+            bucket.tokens -= 1
+            return 0.0
+
+        self.redis_calls += 1
+        try:
+            granted, retry_after_ms = await asyncio.wait_for(
+                self._lease_script(
+                    keys=[f"ratelimit:{key}"],
+                    args=[rule.capacity, rule.rate, int(time.time() * 1000), rule.lease_size],
+                ),
+                settings.rate_limit_redis_timeout,
+            )
+        except Exception as e:
+            # Fail open to per-replica limiting rather than rejecting traffic or
+            # making every request wait out a slow Redis
+            self.redis_errors += 1
+            self._redis_down_until = now + settings.rate_limit_redis_retry_seconds
+            logger.error(f"Rate limiter Redis error, using local buckets: {e!r}")
+            return self._take_locally(bucket, rule, now)
+
+        if int(granted) == 0:
+            retry_after = int(retry_after_ms) / 1000
+            bucket.tokens = 0
+            bucket.blocked_until = now + retry_after
+            return retry_after
+        # Unspent leased tokens lapse quickly so they are not hoarded
+        bucket.tokens = int(granted) - 1
+        bucket.expires_at = now + settings.rate_limit_lease_ttl
+        return 0.0
+
+    @staticmethod
+    def _take_locally(bucket: LocalBucket, rule: Rule, now: float) -> float:
+        if bucket.expires_at == 0.0:
+            # First use of a local-only bucket starts it full
+            bucket.tokens = rule.capacity
+        else:
+            bucket.tokens = min(rule.capacity, bucket.tokens + (now - bucket.updated_at) * rule.rate)
+        bucket.updated_at = now
+        retry_after = 0.0
+        if bucket.tokens >= 1:
+            bucket.tokens -= 1
+        else:
+            retry_after = (1 - bucket.tokens) / rule.rate
+            bucket.blocked_until = now + retry_after
+        # Once refilled the bucket is no different from a new one, so it may be pruned
+        bucket.expires_at = now + (rule.capacity - bucket.tokens) / rule.rate
+        return retry_after
+
+    def _prune(self, now: float):
+        """
+        Keep the local buckets bounded: drop idle ones, then the least recently used.
+
+        A bucket is idle once its lease has lapsed (Redis) or it has refilled
+        (local only), so dropping it loses nothing. If that is not enough,
+        unblocked buckets go before blocked ones, so filling the table with
+        new keys cannot lift a block early.
+        """
+        for key in [key for key, bucket in self._buckets.items() if bucket.expires_at <= now and bucket.blocked_until <= now]:
+            del self._buckets[key]
+        excess = len(self._buckets) - int(settings.rate_limit_max_local_buckets * LOCAL_BUCKETS_PRUNED_TO)
+        if excess > 0:
+            evicted = heapq.nsmallest(
+                excess,
+                self._buckets.items(),
+                key=lambda item: (item[1].blocked_until > now, item[1].updated_at),
+            )
+            for key, _ in evicted:
+                del self._buckets[key]
+
+    def stats(self) -> dict:
+        return {
+            "backend": "redis" if self.redis_client and self._redis_down_until <= time.monotonic() else "local",
+            "allowed": self.allowed,
+            "limited": self.limited,
+            "redis_calls": self.redis_calls,
+            "redis_errors": self.redis_errors,
+            "local_buckets": len(self._buckets),
+        }
+
+
+rate_limiter = RateLimiter()
+
+CallbackCounter(
+    "rate_limit_decisions_total",
+    "Rate limiter decisions",
+    ("result",),
+    lambda: {("allowed",): rate_limiter.allowed, ("limited",): rate_limiter.limited},
+)
+
+
+class RateLimitMiddleware:
+    """Reject requests over their rate limits with 429 and Retry-After."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not settings.rate_limit_enabled or not scope["path"].startswith("/api/"):
+            await self.app(scope, receive, send)
+            return
+
+        client_ip = scope["client"][0] if scope.get("client") else "unknown"
+        if settings.rate_limit_trust_forwarded_for:
+            for name, value in scope["headers"]:
+                if name == b"x-forwarded-for":
+                    client_ip = value.decode("latin-1").split(",")[0].strip()
+                    break
+        claims = scope.get("state", {}).get("claims")
+        user = claims.get("sub") if claims else None
+
+        retry_after = await rate_limiter.check(scope["path"], client_ip, user)
+        if retry_after <= 0:
+            await self.app(scope, receive, send)
+            return
+
+        body = json.dumps({
+            "error": "Too Many Requests",
+            "message": "Rate limit exceeded. Please slow down.",
+        }).encode()
+        await send({
+            "type": "http.response.start",
+            "status": 429,
+            "headers": [
+                (b"content-type", b"application/json"),
+                (b"content-length", str(len(body)).encode()),
+                (b"retry-after", str(max(1, math.ceil(retry_after))).encode()),
+            ],
+        })
+        await send({"type": "http.response.body", "body": body})
@@ -0,0 +1,210 @@
+import asyncio
+import hashlib
+import logging
+import time
+from collections import OrderedDict
+from typing import Awaitable, Callable, Dict, Optional
+
+from fastapi import Request, Response
+
+from config import settings
+from metrics import CallbackCounter, CallbackGauge
+
+logger = logging.getLogger(__name__)
+
+# Rough per-entry bookkeeping cost counted against the memory budget
+ENTRY_OVERHEAD_BYTES = 256
+
+
+class CachedResponse:
+    """A fully buffered upstream response."""
+
+    __slots__ = ("status_code", "headers", "body", "etag", "stored_at", "size")
+
+    def __init__(self, status_code: int, headers: Dict[str, str], body: bytes, etag: Optional[str] = None):
+        self.status_code = status_code
+        self.headers = headers
+        self.body = body
+        self.etag = etag or '"' + hashlib.blake2b(body, digest_size=16).hexdigest() + '"'
+        self.stored_at = time.monotonic()
+        self.size = len(body) + ENTRY_OVERHEAD_BYTES
+
+    @property
+    def cacheable(self) -> bool:
+        return self.status_code == 200 and "no-store" not in self.headers.get("cache-control", "")
+
+
+Loader = Callable[[], Awaitable[CachedResponse]]
+
+
+def _etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == "*":
+        return True
+    opaque = etag.removeprefix("W/")
+    return any(candidate.strip().removeprefix("W/") == opaque for candidate in if_none_match.split(","))
+
+
+class ResponseCache:
+    """
+    In-memory cache for idempotent GET responses.
+
+    Fresh entries are served directly; entries past their TTL but within the
+    stale window are served while a single background task revalidates them.
+    Concurrent misses for the same key share one upstream fetch, and total
+    size is bounded by evicting least recently used entries.
+    """
+
+    def __init__(self, max_bytes: int, max_entry_bytes: int, ttl: float, stale_ttl: float):
+        self.max_bytes = max_bytes
+        self.max_entry_bytes = max_entry_bytes
+        self.ttl = ttl
+        self.stale_ttl = stale_ttl
+        self._entries: "OrderedDict[str, CachedResponse]" = OrderedDict()
+        self._pending: Dict[str, asyncio.Future] = {}
+        self._refreshing: Dict[str, asyncio.Task] = {}
+        self.total_bytes = 0
+        self.hits = 0
+        self.stale_hits = 0
+        self.misses = 0
+        self.not_modified = 0
+        self.evictions = 0
+
+    @staticmethod
+    def key(request: Request) -> str:
+        """Cache key from path, normalized query and the caller's auth scope."""
+        claims = getattr(request.state, "claims", None)
+        if claims is not None and claims.get("sub"):
+            scope = f"sub:{claims['sub']}"
+        elif "authorization" in request.headers:
+            scope = "tok:" + hashlib.sha256(request.headers["authorization"].encode()).hexdigest()[:32]
+        else:
+            scope = "anon"
+        query = "&".join(sorted(f"{k}={v}" for k, v in request.query_params.multi_items()))
+        return f"{scope}|{request.url.path}?{query}"
+
+    async def serve(self, key: str, request: Request, loader: Loader) -> Response:
+        """Answer a GET from the cache, fetching through loader on a miss."""
+        entry = self._entries.get(key)
+        bypass = "no-cache" in request.headers.get("cache-control", "")
+        if entry is not None and not bypass:
+            age = time.monotonic() - entry.stored_at
+            if age < self.ttl:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return self._respond(entry, request, "HIT")
+            if age < self.ttl + self.stale_ttl:
+                self._entries.move_to_end(key)
+                self.stale_hits += 1
+                self._revalidate(key, loader)
+                return self._respond(entry, request, "STALE")
+
+        self.misses += 1
+        entry = await self._fetch(key, loader)
+        return self._respond(entry, request, "MISS")
+
+    async def _fetch(self, key: str, loader: Loader) -> CachedResponse:
+        """Fetch and store an entry, coalescing concurrent misses for the same key."""
+        pending = self._pending.get(key)
+        while pending is not None:
+            try:
+                return await asyncio.shield(pending)
+            except asyncio.CancelledError:
+                if not pending.cancelled():
+                    raise
+                # The leading request was abandoned (client gone or deadline passed); take over
+                pending = self._pending.get(key)
+
+        future = asyncio.get_running_loop().create_future()
+        self._pending[key] = future
+        try:
+            entry = await loader()
+            self._store(key, entry)
+            future.set_result(entry)
+            return entry
+        except asyncio.CancelledError:
+            future.cancel()
+            raise
+        except Exception as exc:
+            future.set_exception(exc)
+            # Mark the exception retrieved when nobody else was waiting
+            future.exception()
+            raise
+        finally:
+            del self._pending[key]
+
+    def _revalidate(self, key: str, loader: Loader):
+        if key in self._refreshing or key in self._pending:
+            return
+
+        async def refresh():
+            try:
+                await self._fetch(key, loader)
+            except Exception as e:
+                logger.warning(f"Background revalidation failed for {key}: {e}")
+            finally:
+                self._refreshing.pop(key, None)
+
+        self._refreshing[key] = asyncio.create_task(refresh())
+
+    def _store(self, key: str, entry: CachedResponse):
+        if not entry.cacheable or len(entry.body) > self.max_entry_bytes:
+            self._evict(key)
+            return
+        self._evict(key)
+        self._entries[key] = entry
+        self.total_bytes += entry.size
+        while self.total_bytes > self.max_bytes and self._entries:
+            _, evicted = self._entries.popitem(last=False)
+            self.total_bytes -= evicted.size
+            self.evictions += 1
+
+    def _evict(self, key: str):
+        old = self._entries.pop(key, None)
+        if old is not None:
+            self.total_bytes -= old.size
+
+    def _respond(self, entry: CachedResponse, request: Request, state: str) -> Response:
+        headers = {"etag": entry.etag, "x-cache": state}
+        if _etag_matches(request.headers.get("if-none-match"), entry.etag) and entry.status_code == 200:
+            self.not_modified += 1
+            if "cache-control" in entry.headers:
+                headers["cache-control"] = entry.headers["cache-control"]
+            return Response(status_code=304, headers=headers)
+        return Response(content=entry.body, status_code=entry.status_code, headers={**entry.headers, **headers})
+
+    def stats(self) -> dict:
+        return {
+            "entries": len(self._entries),
+            "bytes": self.total_bytes,
+            "max_bytes": self.max_bytes,
+            "hits": self.hits,
+            "stale_hits": self.stale_hits,
+            "misses": self.misses,
+            "not_modified": self.not_modified,
+            "evictions": self.evictions,
+            "revalidating": len(self._refreshing),
+        }
+
+
+# Global response cache instance
+response_cache = ResponseCache(
+    max_bytes=settings.response_cache_max_bytes,
+    max_entry_bytes=settings.response_cache_max_entry_bytes,
+    ttl=settings.response_cache_ttl,
+    stale_ttl=settings.response_cache_stale_ttl,
+)
+
+CallbackCounter(
+    "gateway_response_cache_requests_total",
+    "Cached GETs by result",
+    ("result",),
+    lambda: {
+        ("hit",): response_cache.hits,
+        ("stale",): response_cache.stale_hits,
+        ("miss",): response_cache.misses,
+        ("not_modified",): response_cache.not_modified,
+    },
+)
+CallbackGauge("gateway_response_cache_bytes", "Bytes held by the response cache", (), lambda: {(): response_cache.total_bytes})
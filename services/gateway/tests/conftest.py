@@ -0,0 +1,6 @@
+import os
+
+# Settings are read at import time; point them at addresses nothing listens on
+os.environ.setdefault("AUTH_SERVICE_URL", "http://auth.invalid:8001")
+os.environ.setdefault("CORE_SERVICE_URL", "http://core.invalid:8002")
+os.environ.setdefault("JWT_SECRET", "test-secret-key-with-at-least-32-characters")
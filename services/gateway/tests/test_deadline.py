@@ -0,0 +1,34 @@
+import time
+
+import pytest
+from starlette.requests import Request
+
+from deadline import DEADLINE_HEADER, request_deadline, route_budget_ms
+
+
+def _request(path: str, timeout_ms: str = None) -> Request:
+    headers = [] if timeout_ms is None else [(DEADLINE_HEADER.encode(), timeout_ms.encode())]
+    return Request({"type": "http", "method": "GET", "path": path, "query_string": b"", "headers": headers})
+
+
+def _budget_ms(request: Request):
+    deadline = request_deadline(request)
+    return None if deadline is None else round((deadline - time.monotonic()) * 1000, -1)
+
+
+def test_client_can_tighten_but_not_extend_the_route_budget():
+    route_ms = route_budget_ms("/api/v1/shipments")
+    assert route_ms > 100
+    assert _budget_ms(_request("/api/v1/shipments", "100")) == 100
+    assert _budget_ms(_request("/api/v1/shipments", str(route_ms * 10))) == route_ms
+
+
+@pytest.mark.parametrize("value", ["0", "-1", "later"])
+def test_unusable_client_budgets_are_ignored(value):
+    route_ms = route_budget_ms("/api/v1/shipments")
+    assert _budget_ms(_request("/api/v1/shipments", value)) == route_ms
+
+
+def test_routes_without_a_budget_keep_none_unless_the_client_sets_one():
+    assert _budget_ms(_request("/api/v1/shipments/export", "0")) is None
+    assert _budget_ms(_request("/api/v1/shipments/export", "500")) == 500
@@ -0,0 +1,103 @@
+import asyncio
+import time
+
+import httpx
+import pytest
+
+import health
+from config import settings
+from health import HealthRegistry
+from upstream import Backend, UpstreamPool
+
+
+def _pool(handler) -> UpstreamPool:
+    pool = UpstreamPool()
+    for name, urls in (("auth", ["http://auth-a"]), ("core", ["http://core-a", "http://core-b"])):
+        backend = Backend(
+            name,
+            urls,
+            httpx.Timeout(1.0),
+            httpx.Limits(max_connections=10),
+            False,
+            httpx.Timeout(1.0),
+            httpx.Limits(max_connections=10),
+        )
+        backend.client = httpx.AsyncClient(transport=httpx.MockTransport(handler))
+        pool.backends[name] = backend
+    return pool
+
+
+@pytest.fixture
+def down():
+    """Hosts whose /health fails; the rest answer 200."""
+    return set()
+
+
+@pytest.fixture
+def pool(monkeypatch, down):
+    def handler(request: httpx.Request) -> httpx.Response:
+        if request.url.host in down:
+            raise httpx.ConnectError("connection refused", request=request)
+        return httpx.Response(200, json={"status": "healthy"})
+
+    pool = _pool(handler)
+    monkeypatch.setattr(health, "upstreams", pool)
+    return pool
+
+
+async def test_not_ready_before_the_first_round(pool):
+    registry = HealthRegistry()
+    assert not registry.ready()
+    await registry.probe_all()
+    assert registry.ready()
+    assert registry.snapshot()["backend_services"] == {"auth": "healthy", "core": "healthy"}
+
+
+async def test_failing_replica_leaves_routing_after_consecutive_probes(pool, down, monkeypatch):
+    monkeypatch.setattr(settings, "health_unhealthy_threshold", 2)
+    registry = HealthRegistry()
+    down.add("core-b")
+    core_b = pool.backends["core"].replicas[1]
+
+    await registry.probe_all()
+    assert core_b.healthy
+    await registry.probe_all()
+    assert not core_b.healthy
+    assert registry.backend_status("core") == "degraded"
+    assert registry.ready()
+
+    down.clear()
+    await registry.probe_all()
+    assert core_b.healthy
+    assert registry.backend_status("core") == "healthy"
+
+
+async def test_backend_without_a_healthy_replica_is_not_ready(pool, down, monkeypatch):
+    monkeypatch.setattr(settings, "health_unhealthy_threshold", 1)
+    down.add("auth-a")
+    registry = HealthRegistry()
+    await registry.probe_all()
+    assert registry.backend_status("auth") == "unreachable"
+    assert not registry.ready()
+
+
+async def test_probes_run_concurrently(monkeypatch):
+    async def slow(request: httpx.Request) -> httpx.Response:
+        await asyncio.sleep(0.2)
+        return httpx.Response(200)
+
+    monkeypatch.setattr(health, "upstreams", _pool(slow))
+    registry = HealthRegistry()
+    started = time.monotonic()
+    await registry.probe_all()
+    # Three replicas probed at once, not one after the other
+    assert time.monotonic() - started < 0.5
+
+
+async def test_stale_snapshot_is_not_ready(pool, monkeypatch):
+    registry = HealthRegistry()
+    await registry.probe_all()
+    later = time.monotonic() + 4 * settings.health_probe_interval
+    monkeypatch.setattr(health.time, "monotonic", lambda: later)
+    assert registry.is_stale()
+    assert not registry.ready()
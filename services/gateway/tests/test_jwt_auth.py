@@ -0,0 +1,96 @@
+from datetime import datetime, timedelta, timezone
+
+import httpx
+import pytest
+from jose import jwt
+from test_proxy import _body
+from test_upstream import _backend
+
+import jwt_auth
+import main
+from config import settings
+from jwt_auth import ClaimsCache
+
+
+def _token(role: str = "USER") -> str:
+    claims = {"sub": "ops@example.com", "role": role, "exp": datetime.now(timezone.utc) + timedelta(minutes=5)}
+    return jwt.encode(claims, settings.jwt_secret, algorithm=settings.jwt_algorithm)
+
+
+@pytest.fixture
+async def client(monkeypatch):
+    forwarded = []
+
+    def handler(request: httpx.Request) -> httpx.Response:
+        forwarded.append(request.headers)
+        return httpx.Response(200, content=_body(b"[]"))
+
+    backend = _backend(handler)
+    monkeypatch.setattr(main.upstreams, "get", lambda service: backend)
+    monkeypatch.setattr(settings, "response_cache_enabled", False)
+    transport = httpx.ASGITransport(app=main.app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://gateway") as client:
+        client.forwarded = forwarded
+        yield client
+
+
+def test_tokens_are_required_by_default():
+    assert settings.jwt_required
+
+
+@pytest.mark.parametrize(
+    "headers",
+    [{}, {"x-auth-role": "ADMIN"}, {"authorization": "Bearer not-a-jwt"}],
+)
+async def test_shipments_reject_requests_without_a_valid_token(client, headers):
+    response = await client.get("/api/v1/shipments/export", headers=headers)
+    assert response.status_code == 401
+    assert client.forwarded == []
+
+
+async def test_verified_claims_replace_client_supplied_ones(client):
+    headers = {"authorization": f"Bearer {_token()}", "x-auth-role": "ADMIN"}
+    response = await client.get("/api/v1/shipments/export", headers=headers)
+    assert response.status_code == 200
+    assert client.forwarded[0]["x-auth-role"] == "USER"
+    assert client.forwarded[0]["x-auth-subject"] == "ops@example.com"
+
+
+def test_repeat_tokens_are_answered_from_the_claims_cache(monkeypatch):
+    monkeypatch.setattr(jwt_auth, "claims_cache", ClaimsCache(10, 60))
+    token = _token()
+    assert jwt_auth.verify_token(token)["role"] == "USER"
+
+    def decode(*args, **kwargs):
+        raise AssertionError("cached token decoded again")
+
+    monkeypatch.setattr(jwt_auth.jwt, "decode", decode)
+    assert jwt_auth.verify_token(token)["role"] == "USER"
+    assert jwt_auth.claims_cache.hits == 1
+
+
+def test_cached_claims_expire_with_the_token(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(jwt_auth.time, "time", lambda: now[0])
+    cache = ClaimsCache(max_size=2, max_ttl=60)
+    cache.put(b"short", {"exp": 1010})
+    cache.put(b"long", {"exp": 5000})
+    now[0] += 20
+    assert cache.get(b"short") is None
+    assert cache.get(b"long") is not None
+    # Capped by max_ttl even when exp is further away
+    now[0] += 60
+    assert cache.get(b"long") is None
+    # Already expired tokens are never cached
+    cache.put(b"old", {"exp": 900})
+    assert cache.get(b"old") is None
+
+
+def test_claims_cache_evicts_least_recently_used():
+    cache = ClaimsCache(max_size=2, max_ttl=60)
+    cache.put(b"a", {})
+    cache.put(b"b", {})
+    assert cache.get(b"a") is not None
+    cache.put(b"c", {})
+    assert cache.get(b"b") is None
+    assert cache.stats()["evictions"] == 1
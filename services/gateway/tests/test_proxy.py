@@ -0,0 +1,38 @@
+import httpx
+import pytest
+from test_upstream import _backend
+
+import main
+from config import settings
+
+
+async def _body(content: bytes):
+    # A streamed body, as a real upstream connection gives the relay
+    yield content
+
+
+@pytest.fixture
+def upstream_calls(monkeypatch):
+    calls = []
+
+    def handler(request: httpx.Request) -> httpx.Response:
+        calls.append((request.method, request.url.path, request.content))
+        if request.method == "OPTIONS":
+            return httpx.Response(204, content=_body(b""))
+        return httpx.Response(200, headers={"content-type": "application/json"}, content=_body(b"[]"))
+
+    backend = _backend(handler)
+    monkeypatch.setattr(main.upstreams, "get", lambda service: backend)
+    return calls
+
+
+@pytest.mark.parametrize("passthrough", [True, False])
+async def test_head_and_options_are_relayed_in_both_proxy_modes(monkeypatch, upstream_calls, passthrough):
+    monkeypatch.setattr(settings, "proxy_passthrough", passthrough)
+    transport = httpx.ASGITransport(app=main.app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://gateway") as client:
+        head = await client.head("/api/v1/auth/me")
+        options = await client.options("/api/v1/auth/me")
+    assert head.status_code == 200 and head.content == b""
+    assert options.status_code == 204
+    assert upstream_calls == [("HEAD", "/api/v1/auth/me", b""), ("OPTIONS", "/api/v1/auth/me", b"")]
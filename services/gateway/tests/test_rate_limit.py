@@ -0,0 +1,101 @@
+import asyncio
+import time
+
+import fakeredis
+
+from config import settings
+from rate_limit import LEASE_TOKENS_SCRIPT, RateLimiter
+
+LOGIN = "/api/v1/auth/login"
+
+
+def _limiter(server: fakeredis.FakeServer = None) -> RateLimiter:
+    limiter = RateLimiter()
+    if server is not None:
+        limiter.redis_client = fakeredis.aioredis.FakeRedis(server=server)
+        limiter._lease_script = limiter.redis_client.register_script(LEASE_TOKENS_SCRIPT)
+    return limiter
+
+
+async def _allowed(limiter: RateLimiter, attempts: int, client_ip: str = "10.0.0.1") -> int:
+    allowed = 0
+    for _ in range(attempts):
+        if await limiter.check(LOGIN, client_ip, None) == 0:
+            allowed += 1
+    return allowed
+
+
+async def test_local_buckets_limit_without_redis():
+    limiter = _limiter()
+    capacity = limiter.route_rules[0][1].capacity
+    assert await _allowed(limiter, capacity + 5) == capacity
+    retry_after = await limiter.check(LOGIN, "10.0.0.1", None)
+    assert 0 < retry_after <= 60 / capacity
+    # Other clients have buckets of their own
+    assert await _allowed(limiter, 1, client_ip="10.0.0.2") == 1
+
+
+async def test_replicas_share_buckets_through_redis():
+    server = fakeredis.FakeServer()
+    first, second = _limiter(server), _limiter(server)
+    capacity = first.route_rules[0][1].capacity
+    allowed = await _allowed(first, capacity) + await _allowed(second, capacity)
+    assert allowed == capacity
+    assert first.redis_errors == 0 and second.redis_errors == 0
+
+
+async def test_redis_errors_fall_back_to_local_buckets():
+    server = fakeredis.FakeServer()
+    server.connected = False
+    limiter = _limiter(server)
+    capacity = limiter.route_rules[0][1].capacity
+    # Limits still hold per replica while Redis is down
+    assert await _allowed(limiter, capacity + 5) == capacity
+    assert limiter.redis_errors >= 1
+
+
+async def test_slow_redis_times_out_to_local_buckets(monkeypatch):
+    monkeypatch.setattr(settings, "rate_limit_redis_timeout", 0.05)
+    limiter = _limiter()
+    limiter.redis_client = object()
+    calls = 0
+
+    async def hang(keys, args):
+        nonlocal calls
+        calls += 1
+        await asyncio.sleep(60)
+
+    limiter._lease_script = hang
+    capacity = limiter.route_rules[0][1].capacity
+    started = time.monotonic()
+    assert await _allowed(limiter, capacity + 5) == capacity
+    # One timed-out call, then local buckets until the retry interval passes
+    assert time.monotonic() - started < 1
+    assert calls == 1 and limiter.redis_errors == 1
+    assert limiter.stats()["backend"] == "local"
+
+
+async def test_full_bucket_table_keeps_blocked_buckets(monkeypatch):
+    monkeypatch.setattr(settings, "rate_limit_max_local_buckets", 20)
+    limiter = _limiter()
+    capacity = limiter.route_rules[0][1].capacity
+    assert await _allowed(limiter, capacity + 1, client_ip="10.0.0.1") == capacity
+    # Rotating addresses fills the table many times over
+    for index in range(200):
+        await limiter.check("/api/v1/shipments", f"10.1.{index // 250}.{index % 250}", None)
+        assert len(limiter._buckets) <= 20
+    assert await limiter.check(LOGIN, "10.0.0.1", None) > 0
+
+
+async def test_refilled_local_buckets_are_pruned_first(monkeypatch):
+    monkeypatch.setattr(settings, "rate_limit_max_local_buckets", 10)
+    limiter = _limiter()
+    for index in range(9):
+        await limiter.check("/api/v1/shipments", f"10.0.0.{index}", None)
+    # Refilled in a second or so, so idle once time has moved on
+    for bucket in limiter._buckets.values():
+        assert bucket.expires_at < time.monotonic() + 60
+        bucket.expires_at -= 60
+    await limiter.check("/api/v1/shipments", "10.0.1.1", None)
+    await limiter.check("/api/v1/shipments", "10.0.1.2", None)
+    assert set(limiter._buckets) == {"ip:10.0.1.1", "ip:10.0.1.2"}
@@ -0,0 +1,51 @@
+import asyncio
+
+from response_cache import CachedResponse, ResponseCache
+
+
+def _cache() -> ResponseCache:
+    return ResponseCache(max_bytes=1 << 20, max_entry_bytes=1 << 16, ttl=30, stale_ttl=30)
+
+
+def _loader(release: asyncio.Event):
+    calls = []
+
+    async def load() -> CachedResponse:
+        calls.append(None)
+        await release.wait()
+        return CachedResponse(200, {"content-type": "application/json"}, b"[]")
+
+    return load, calls
+
+
+async def test_concurrent_misses_share_one_fetch():
+    cache, release = _cache(), asyncio.Event()
+    load, calls = _loader(release)
+    tasks = [asyncio.create_task(cache._fetch("k", load)) for _ in range(5)]
+    await asyncio.sleep(0)
+    release.set()
+    entries = await asyncio.gather(*tasks)
+    assert len(calls) == 1
+    assert all(entry is entries[0] for entry in entries)
+
+
+async def test_waiter_takes_over_when_the_leader_is_cancelled():
+    cache, release = _cache(), asyncio.Event()
+    load, calls = _loader(release)
+    leader = asyncio.create_task(cache._fetch("k", load))
+    await asyncio.sleep(0)
+    waiters = [asyncio.create_task(cache._fetch("k", load)) for _ in range(3)]
+    await asyncio.sleep(0)
+
+    abandoned = cache._pending["k"]
+    leader.cancel()
+    while cache._pending.get("k") in (None, abandoned):
+        await asyncio.sleep(0)
+    release.set()
+    entries = await asyncio.gather(*waiters)
+
+    assert leader.cancelled()
+    # One waiter fetched again and the others shared its result
+    assert len(calls) == 2
+    assert all(entry.body == b"[]" for entry in entries)
+    assert "k" not in cache._pending
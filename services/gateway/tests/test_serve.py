@@ -0,0 +1,60 @@
+import threading
+from collections import deque
+
+import pytest
+
+import serve
+from serve import Supervisor
+
+
+class _DeadProcess:
+    pid = 1
+    exitcode = 1
+
+    def is_alive(self):
+        return False
+
+    def join(self, timeout=None):
+        pass
+
+
+def _supervisor() -> Supervisor:
+    supervisor = Supervisor.__new__(Supervisor)
+    supervisor.crashes = deque()
+    return supervisor
+
+
+def test_restart_delay_doubles_up_to_the_cap():
+    supervisor = _supervisor()
+
+    delays = [supervisor.restart_delay(0.0) for _ in range(serve.SUPERVISOR_MAX_CRASHES)]
+
+    assert delays[:3] == [serve.SUPERVISOR_RESTART_DELAY * factor for factor in (1, 2, 4)]
+    assert max(delays) == serve.SUPERVISOR_MAX_RESTART_DELAY
+
+
+def test_crashes_outside_the_window_are_forgotten():
+    supervisor = _supervisor()
+    for _ in range(serve.SUPERVISOR_MAX_CRASHES):
+        supervisor.restart_delay(0.0)
+
+    assert supervisor.restart_delay(serve.SUPERVISOR_CRASH_WINDOW + 1) == serve.SUPERVISOR_RESTART_DELAY
+
+
+def test_crash_loop_gives_up(monkeypatch):
+    monkeypatch.setattr(serve, "SUPERVISOR_RESTART_DELAY", 0.0)
+    monkeypatch.setattr(serve, "SUPERVISOR_MAX_CRASHES", 3)
+    monkeypatch.setattr(serve.signal, "signal", lambda *args: None)
+    supervisor = _supervisor()
+    supervisor.workers = 1
+    supervisor.socket = None
+    supervisor.should_exit = threading.Event()
+    spawned = []
+    supervisor._spawn = lambda: spawned.append(_DeadProcess()) or spawned[-1]
+    monkeypatch.setattr(supervisor.should_exit, "wait", lambda timeout: supervisor.should_exit.is_set())
+
+    with pytest.raises(SystemExit):
+        supervisor.run()
+
+    # The first worker plus one restart per tolerated crash
+    assert len(spawned) == 1 + 3
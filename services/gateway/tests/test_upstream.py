@@ -0,0 +1,127 @@
+import asyncio
+import time
+
+import httpx
+import pytest
+
+from config import settings
+from upstream import Backend, Replica, RetryBudget, UpstreamPool
+
+
+def _backend(handler, urls=("http://core-a", "http://core-b")) -> Backend:
+    backend = Backend(
+        "core",
+        list(urls),
+        httpx.Timeout(1.0),
+        httpx.Limits(max_connections=10),
+        False,
+        httpx.Timeout(1.0),
+        httpx.Limits(max_connections=10),
+    )
+    transport = httpx.MockTransport(handler)
+    backend.client = httpx.AsyncClient(transport=transport)
+    backend.stream_client = httpx.AsyncClient(transport=transport)
+    return backend
+
+
+async def test_pool_shares_one_client_per_backend_until_shutdown():
+    pool = UpstreamPool()
+    await pool.startup()
+    core = pool.get("core")
+    assert core is not None and pool.get("core") is core
+    assert core.client is not pool.get("auth").client
+    client = core.client
+    await pool.shutdown()
+    assert client.is_closed
+    assert pool.get("core") is None
+
+
+async def test_buffered_request_releases_in_flight():
+    backend = _backend(lambda request: httpx.Response(200, json={"ok": True}))
+    response, replica = await backend.request("GET", "/api/v1/shipments")
+    assert response.json() == {"ok": True}
+    assert backend.in_flight == 0 and replica.in_flight == 0
+    assert backend.total_requests == 1
+
+
+async def test_streamed_request_stays_in_flight_until_released():
+    backend = _backend(lambda request: httpx.Response(200, content=b"x" * 10))
+    response, replica = await backend.request("GET", "/api/v1/shipments", stream=True)
+    assert backend.in_flight == 1 and replica.in_flight == 1
+    await response.aclose()
+    backend.release(replica)
+    assert backend.in_flight == 0 and replica.in_flight == 0
+
+
+async def test_cancelled_request_releases_in_flight():
+    started = asyncio.Event()
+
+    async def hang(request):
+        started.set()
+        await asyncio.sleep(60)
+
+    backend = _backend(hang)
+    task = asyncio.create_task(backend.request("GET", "/api/v1/shipments"))
+    await started.wait()
+    assert backend.in_flight == 1
+    task.cancel()
+    with pytest.raises(asyncio.CancelledError):
+        await task
+    assert backend.in_flight == 0
+    assert all(replica.in_flight == 0 for replica in backend.replicas)
+
+
+async def test_failed_request_body_releases_in_flight():
+    async def body():
+        yield b"{"
+        raise ValueError("client went away")
+
+    backend = _backend(lambda request: httpx.Response(200))
+    with pytest.raises(ValueError):
+        await backend.request("POST", "/api/v1/shipments", content=body())
+    assert backend.in_flight == 0
+
+
+async def test_failing_replica_is_ejected_and_retried_elsewhere():
+    def handler(request):
+        if request.url.host == "core-a":
+            raise httpx.ConnectError("refused")
+        return httpx.Response(200, json={"ok": True})
+
+    backend = _backend(handler)
+    for _ in range(20):
+        response, replica = await backend.request("GET", "/api/v1/shipments")
+        assert response.status_code == 200 and replica.base_url == "http://core-b"
+    failing = backend.replicas[0]
+    assert failing.state == Replica.OPEN
+    # Once open, the failing replica is skipped without being tried
+    assert failing.failures == settings.breaker_failure_threshold
+    assert backend.in_flight == 0
+
+
+def test_half_open_replica_admits_one_trial_and_backs_off_on_failure():
+    replica = Replica("http://core-a")
+    for _ in range(settings.breaker_failure_threshold):
+        replica.record_failure()
+    assert replica.state == Replica.OPEN and not replica.available(time.monotonic())
+    later = replica.open_until
+    assert replica.available(later)
+    assert replica.state == Replica.HALF_OPEN
+    replica.in_flight = 1
+    assert not replica.available(later)
+    replica.in_flight = 0
+    replica.record_failure()
+    assert replica.state == Replica.OPEN
+    assert replica.open_seconds == settings.breaker_open_seconds * 2
+    replica.record_success(0.01)
+    assert replica.state == Replica.CLOSED and replica.open_seconds == settings.breaker_open_seconds
+
+
+def test_retry_budget_spends_whole_tokens_from_fractional_deposits():
+    budget = RetryBudget(ratio=0.25, max_tokens=1.0)
+    assert budget.withdraw()
+    assert not budget.withdraw()
+    for _ in range(4):
+        budget.deposit()
+    assert budget.withdraw()
+    assert (budget.retries, budget.exhausted) == (2, 1)
@@ -0,0 +1,485 @@
+import asyncio
+import logging
+import random
+import time
+from typing import Dict, List, Optional, Tuple
+
+import httpx
+
+from config import settings
+from deadline import DEADLINE_HEADER, DeadlineExceededError
+from metrics import CallbackGauge, Counter, Histogram
+
+logger = logging.getLogger(__name__)
+
+# Methods that may be replayed against another replica when they carry no body
+IDEMPOTENT_METHODS = frozenset({"GET", "HEAD", "OPTIONS", "PUT", "DELETE"})
+# Upstream statuses that mean "this replica could not serve it", not "the request was bad"
+FAILURE_STATUSES = frozenset({502, 503, 504})
+# Weight of the newest sample in a replica's latency EWMA
+EWMA_ALPHA = 0.2
+
+UPSTREAM_DURATION = Histogram(
+    "upstream_request_duration_seconds",
+    "Time from sending an upstream request to its response headers, per attempt",
+    ("backend", "outcome"),
+)
+UPSTREAM_RETRIES = Counter("upstream_retries_total", "Upstream attempts retried on another replica", ("backend",))
+UPSTREAM_REJECTED = Counter(
+    "upstream_rejected_total", "Requests failed fast because no replica was available", ("backend",)
+)
+
+
+class NoHealthyReplicaError(Exception):
+    """Raised when every replica of a backend is failing probes, ejected or has its breaker open."""
+    pass
+
+
+class Replica:
+    """One instance of a backend service, with load, latency and circuit breaker state."""
+
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+    def __init__(self, base_url: str):
+        self.base_url = base_url.rstrip("/")
+        self.in_flight = 0
+        self.total_requests = 0
+        self.failures = 0
+        self.ewma_latency: Optional[float] = None
+        self.state = self.CLOSED
+        self.consecutive_failures = 0
+        self.open_until = 0.0
+        self.open_seconds = settings.breaker_open_seconds
+        self.ejections = 0
+        self.open_streams = 0
+        # Maintained by the background health registry
+        self.healthy = True
+        self.failed_probes = 0
+
+    def available(self, now: float) -> bool:
+        """Whether health probes and the breaker let a request through right now."""
+        if not self.healthy:
+            return False
+        if self.state == self.CLOSED:
+            return True
+        if self.state == self.OPEN and now >= self.open_until:
+            self.state = self.HALF_OPEN
+        # Half-open admits a single trial request at a time
+        return self.state == self.HALF_OPEN and self.in_flight == 0
+
+    def score(self) -> float:
+        """Lower is better: outstanding requests, weighted by latency in EWMA mode."""
+        if settings.upstream_balancer == "ewma":
+            return (self.ewma_latency or 0.0) * (self.in_flight + 1)
+        return self.in_flight
+
+    def record_success(self, latency: float):
+        self.ewma_latency = latency if self.ewma_latency is None else (
+            EWMA_ALPHA * latency + (1 - EWMA_ALPHA) * self.ewma_latency
+        )
+        self.consecutive_failures = 0
+        if self.state != self.CLOSED:
+            logger.info(f"Circuit closed for {self.base_url}")
+            self.state = self.CLOSED
+            self.open_seconds = settings.breaker_open_seconds
+
+    def record_failure(self):
+        self.failures += 1
+        self.consecutive_failures += 1
+        if self.state == self.HALF_OPEN:
+            # The trial request failed; back off for longer
+            self.open_seconds = min(self.open_seconds * 2, settings.breaker_max_open_seconds)
+            self.eject()
+        elif self.state == self.CLOSED and self.consecutive_failures >= settings.breaker_failure_threshold:
+            self.eject()
+
+    def record_probe(self, ok: bool):
+        """Take the replica out of routing after consecutive failed probes; one success restores it."""
+        if ok:
+            if not self.healthy:
+                logger.info(f"Health probes passing again for {self.base_url}")
+            self.healthy = True
+            self.failed_probes = 0
+            return
+        self.failed_probes += 1
+        if self.healthy and self.failed_probes >= settings.health_unhealthy_threshold:
+            logger.warning(f"{self.base_url} failed {self.failed_probes} health probes; removed from routing")
+            self.healthy = False
+
+    def eject(self):
+        """Open the breaker, keeping traffic away until the cool-down has passed."""
+        self.state = self.OPEN
+        self.open_until = time.monotonic() + self.open_seconds
+        self.ejections += 1
+        logger.warning(f"Circuit opened for {self.base_url} for {self.open_seconds:.0f}s")
+
+    def stats(self) -> dict:
+        return {
+            "state": self.state,
+            "healthy": self.healthy,
+            "in_flight": self.in_flight,
+            "total_requests": self.total_requests,
+            "failures": self.failures,
+            "consecutive_failures": self.consecutive_failures,
+            "ewma_latency_ms": round(self.ewma_latency * 1000, 1) if self.ewma_latency is not None else None,
+            "ejections": self.ejections,
+            "open_streams": self.open_streams,
+            "retry_in": round(max(0.0, self.open_until - time.monotonic()), 1) if self.state == self.OPEN else None,
+        }
+
+
+class RetryBudget:
+    """Every request deposits a fraction of a retry token; every retry spends a whole one."""
+
+    def __init__(self, ratio: float, max_tokens: float):
+        self.ratio = ratio
+        self.max_tokens = max_tokens
+        self.tokens = max_tokens
+        self.retries = 0
+        self.exhausted = 0
+
+    def deposit(self):
+        self.tokens = min(self.max_tokens, self.tokens + self.ratio)
+
+    def withdraw(self) -> bool:
+        if self.tokens < 1:
+            self.exhausted += 1
+            return False
+        self.tokens -= 1
+        self.retries += 1
+        return True
+
+
+class Backend:
+    """
+    A long-lived HTTP client for one backend service, balanced across its replicas.
+
+    Each request goes to the available replica with the lowest score. Replicas
+    whose breaker is open are skipped, so a dead instance costs a few failed
+    requests rather than one timeout per request. Idempotent requests without
+    a body are retried on another replica while the retry budget allows.
+
+    Long-lived streams go through a second client with its own pool and read
+    timeout. Once their headers arrive they stop counting as in flight and are
+    spread across replicas by open stream count instead.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        base_urls: List[str],
+        timeout: httpx.Timeout,
+        limits: httpx.Limits,
+        http2: bool,
+        stream_timeout: httpx.Timeout,
+        stream_limits: httpx.Limits,
+    ):
+        self.name = name
+        self.replicas = [Replica(url) for url in base_urls]
+        self.limits = limits
+        self.client = httpx.AsyncClient(timeout=timeout, limits=limits, http2=http2)
+        self.stream_limits = stream_limits
+        self.stream_client = httpx.AsyncClient(timeout=stream_timeout, limits=stream_limits, http2=http2)
+        self.open_streams = 0
+        self.peak_open_streams = 0
+        self.retry_budget = RetryBudget(settings.retry_budget_ratio, settings.retry_budget_max_tokens)
+        self.in_flight = 0
+        self.peak_in_flight = 0
+        self.saturated_requests = 0
+        self.total_requests = 0
+        self.rejected_requests = 0
+
+    def choose(self, exclude: Tuple[Replica, ...] = (), long_lived: bool = False) -> Optional[Replica]:
+        """Pick the best available replica, breaking ties at random."""
+        now = time.monotonic()
+        candidates = [r for r in self.replicas if r not in exclude and r.available(now)]
+        if not candidates:
+            return None
+        if long_lived:
+            best = min(replica.open_streams for replica in candidates)
+            return random.choice([replica for replica in candidates if replica.open_streams == best])
+        best = min(replica.score() for replica in candidates)
+        return random.choice([replica for replica in candidates if replica.score() == best])
+
+    def acquire(self, replica: Replica):
+        """Account for one in-flight request against a replica and the shared pool."""
+        self.total_requests += 1
+        replica.total_requests += 1
+        if self.limits.max_connections is not None and self.in_flight >= self.limits.max_connections:
+            # The pool is full, so this request will wait for a free connection
+            self.saturated_requests += 1
+        self.in_flight += 1
+        replica.in_flight += 1
+        self.peak_in_flight = max(self.peak_in_flight, self.in_flight)
+
+    def release(self, replica: Replica):
+        self.in_flight -= 1
+        replica.in_flight -= 1
+
+    def end_stream(self, replica: Replica):
+        """Account for a long-lived stream returned by request(long_lived=True) having closed."""
+        self.open_streams -= 1
+        replica.open_streams -= 1
+
+    async def request(
+        self,
+        method: str,
+        path: str,
+        stream: bool = False,
+        deadline: Optional[float] = None,
+        long_lived: bool = False,
+        **kwargs,
+    ) -> Tuple[httpx.Response, Replica]:
+        """
+        Send a request to the best replica, retrying idempotent requests elsewhere.
+
+        Args:
+            method: HTTP method
+            path: Path on the backend, appended to the replica's base URL
+            stream: Return before the body is read; the caller must close the
+                response and then call release(replica)
+            deadline: Monotonic time by which the response headers must arrive;
+                the time left is sent to the backend in the deadline header
+            long_lived: Stream through the stream pool; the caller must close
+                the response and then call end_stream(replica) instead
+            **kwargs: Passed to httpx build_request (params, headers, content, json)
+
+        Returns:
+            The upstream response and the replica that served it
+
+        Raises:
+            NoHealthyReplicaError: No replica is currently accepting requests
+            DeadlineExceededError: The deadline passed before a response arrived
+            httpx.RequestError: The last attempt failed to connect or timed out
+        """
+        self.retry_budget.deposit()
+        client = self.stream_client if long_lived else self.client
+        retryable = method in IDEMPOTENT_METHODS and kwargs.get("content") is None and kwargs.get("json") is None
+        tried: Tuple[Replica, ...] = ()
+        while True:
+            left = None
+            if deadline is not None:
+                left = deadline - time.monotonic()
+                if left <= 0:
+                    raise DeadlineExceededError(f"Deadline passed before {method} {path} could be sent")
+                kwargs["headers"] = {**(kwargs.get("headers") or {}), DEADLINE_HEADER: str(max(1, int(left * 1000)))}
+            replica = self.choose(tried, long_lived)
+            if replica is None:
+                self.rejected_requests += 1
+                UPSTREAM_REJECTED.labels(self.name).inc()
+                raise NoHealthyReplicaError(f"No healthy {self.name} replicas")
+            tried += (replica,)
+            can_retry = (
+                retryable
+                and len(tried) <= settings.upstream_max_retries
+                and self.choose(tried) is not None
+            )
+
+            self.acquire(replica)
+            started = time.monotonic()
+            timeout = asyncio.timeout(left)
+            try:
+                async with timeout:
+                    upstream_request = client.build_request(method, f"{replica.base_url}{path}", **kwargs)
+                    response = await client.send(upstream_request, stream=stream or long_lived)
+            except TimeoutError as exc:
+                self.release(replica)
+                if not timeout.expired():
+                    raise
+                UPSTREAM_DURATION.labels(self.name, "deadline").observe(time.monotonic() - started)
+                # A replica that cannot answer within budget counts against its breaker
+                replica.record_failure()
+                raise DeadlineExceededError(f"{replica.base_url} did not answer {method} {path} in time") from exc
+            except httpx.RequestError as exc:
+                outcome = "timeout" if isinstance(exc, httpx.TimeoutException) else "error"
+                UPSTREAM_DURATION.labels(self.name, outcome).observe(time.monotonic() - started)
+                self.release(replica)
+                replica.record_failure()
+                if can_retry and self.retry_budget.withdraw():
+                    UPSTREAM_RETRIES.labels(self.name).inc()
+                    logger.warning(f"Retrying {method} {path} after {replica.base_url} failed: {exc}")
+                    continue
+                raise
+            except BaseException:
+                # Cancelled (client gone) or failed reading the request body: not
+                # the replica's fault, but its slot must be freed all the same
+                self.release(replica)
+                raise
+
+            latency = time.monotonic() - started
+            UPSTREAM_DURATION.labels(self.name, f"{response.status_code // 100}xx").observe(latency)
+            if response.status_code in FAILURE_STATUSES:
+                replica.record_failure()
+                if can_retry and self.retry_budget.withdraw():
+                    UPSTREAM_RETRIES.labels(self.name).inc()
+                    self.release(replica)
+                    await response.aclose()
+                    logger.warning(f"Retrying {method} {path} after {replica.base_url} returned {response.status_code}")
+                    continue
+            else:
+                replica.record_success(latency)
+                self._eject_latency_outliers()
+            if long_lived:
+                self.release(replica)
+                self.open_streams += 1
+                replica.open_streams += 1
+                self.peak_open_streams = max(self.peak_open_streams, self.open_streams)
+            elif not stream:
+                self.release(replica)
+            return response, replica
+
+    def _eject_latency_outliers(self):
+        """Eject a replica far slower than its fastest peer, keeping at least half in rotation."""
+        closed = [r for r in self.replicas if r.state == Replica.CLOSED and r.ewma_latency is not None]
+        if len(closed) < 2 or len(closed) * 2 <= len(self.replicas):
+            return
+        fastest = min(replica.ewma_latency for replica in closed)
+        slowest = max(closed, key=lambda replica: replica.ewma_latency)
+        if (
+            slowest.ewma_latency >= settings.outlier_min_latency
+            and slowest.ewma_latency > fastest * settings.outlier_latency_factor
+        ):
+            slowest.eject()
+            # Re-admitted replicas start from a fresh latency estimate
+            slowest.ewma_latency = None
+
+    def stats(self) -> dict:
+        """Pool usage and per-replica breaker snapshot for this backend."""
+        pool = getattr(self.client._transport, "_pool", None)
+        connections = list(getattr(pool, "connections", []))
+        idle = sum(1 for conn in connections if conn.is_idle())
+        max_connections = self.limits.max_connections
+        return {
+            "in_flight": self.in_flight,
+            "peak_in_flight": self.peak_in_flight,
+            "max_connections": max_connections,
+            "saturation": round(self.in_flight / max_connections, 3) if max_connections else None,
+            "saturated_requests": self.saturated_requests,
+            "total_requests": self.total_requests,
+            "rejected_requests": self.rejected_requests,
+            "retries": self.retry_budget.retries,
+            "retry_budget_exhausted": self.retry_budget.exhausted,
+            "open_connections": len(connections),
+            "idle_connections": idle,
+            "open_streams": self.open_streams,
+            "peak_open_streams": self.peak_open_streams,
+            "max_streams": self.stream_limits.max_connections,
+            "replicas": {replica.base_url: replica.stats() for replica in self.replicas},
+        }
+
+
+def _split_urls(value: str) -> List[str]:
+    return [url.strip() for url in value.split(",") if url.strip()]
+
+
+class UpstreamPool:
+    """Shared upstream clients for all backends, opened and closed with the app lifespan."""
+
+    def __init__(self):
+        self.backends: Dict[str, Backend] = {}
+
+    def _http2_enabled(self) -> bool:
+        if not settings.upstream_http2:
+            return False
+        try:
+            import h2  # noqa: F401
+        except ImportError:
+            logger.warning("UPSTREAM_HTTP2 is set but the h2 package is not installed; using HTTP/1.1")
+            return False
+        return True
+
+    async def startup(self):
+        """Create one pooled client per backend."""
+        limits = httpx.Limits(
+            max_connections=settings.upstream_max_connections,
+            max_keepalive_connections=settings.upstream_max_keepalive_connections,
+            keepalive_expiry=settings.upstream_keepalive_expiry,
+        )
+        http2 = self._http2_enabled()
+        stream_limits = httpx.Limits(
+            max_connections=settings.stream_max_connections,
+            max_keepalive_connections=settings.upstream_max_keepalive_connections,
+            keepalive_expiry=settings.upstream_keepalive_expiry,
+        )
+        self.backends = {
+            "auth": Backend(
+                "auth",
+                _split_urls(settings.auth_service_url),
+                httpx.Timeout(
+                    connect=settings.auth_connect_timeout,
+                    read=settings.auth_read_timeout,
+                    write=settings.auth_read_timeout,
+                    pool=settings.auth_pool_timeout,
+                ),
+                limits,
+                http2,
+                httpx.Timeout(
+                    connect=settings.auth_connect_timeout,
+                    read=settings.stream_read_timeout,
+                    write=settings.auth_read_timeout,
+                    pool=settings.auth_pool_timeout,
+                ),
+                stream_limits,
+            ),
+            "core": Backend(
+                "core",
+                _split_urls(settings.core_service_url),
+                httpx.Timeout(
+                    connect=settings.core_connect_timeout,
+                    read=settings.core_read_timeout,
+                    write=settings.core_read_timeout,
+                    pool=settings.core_pool_timeout,
+                ),
+                limits,
+                http2,
+                httpx.Timeout(
+                    connect=settings.core_connect_timeout,
+                    read=settings.stream_read_timeout,
+                    write=settings.core_read_timeout,
+                    pool=settings.core_pool_timeout,
+                ),
+                stream_limits,
+            ),
+        }
+        replica_counts = ", ".join(f"{name}={len(backend.replicas)}" for name, backend in self.backends.items())
+        logger.info(
+            f"Upstream pools ready (max_connections={limits.max_connections}, http2={http2}, "
+            f"balancer={settings.upstream_balancer}, replicas: {replica_counts})"
+        )
+
+    async def shutdown(self):
+        """Close all backend clients and their connections."""
+        for backend in self.backends.values():
+            await backend.client.aclose()
+            await backend.stream_client.aclose()
+        self.backends = {}
+        logger.info("Upstream pools closed")
+
+    def get(self, name: str) -> Optional[Backend]:
+        return self.backends.get(name)
+
+    def stats(self) -> dict:
+        return {name: backend.stats() for name, backend in self.backends.items()}
+
+
+# Global upstream pool instance
+upstreams = UpstreamPool()
+
+CallbackGauge(
+    "upstream_in_flight",
+    "Requests in flight per backend",
+    ("backend",),
+    lambda: {(name,): backend.in_flight for name, backend in upstreams.backends.items()},
+)
+CallbackGauge(
+    "upstream_replica_routable",
+    "1 if a replica passes health probes and its breaker is closed",
+    ("backend", "replica"),
+    lambda: {
+        (name, replica.base_url): int(replica.healthy and replica.state == Replica.CLOSED)
+        for name, backend in upstreams.backends.items()
+        for replica in backend.replicas
+    },
+)